@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+from clean_data_before_json import additional_matches_to_table
+
+# Degrees -> meters, the survey outputs' meters_divide convention
+METERS_DIVIDE = 100000
+
+
+def candidate_pairs(df, candidates=None):
+    """
+    Build the detection x candidate pair arrays the matching works on.
+
+    Args:
+        df (pd.DataFrame): Survey rows with x_image, y_image, real_angle and additional_matches.
+        candidates (pd.DataFrame | None): Flat candidate table (row_id, id, location_x, location_y, ...)
+            as returned by additional_matches_to_table, or built from a spatial_index query.
+            Defaults to the additional_matches column of df.
+
+    Returns:
+        dict: position (row position in df), id, location_x, location_y and tree_name arrays, one entry per pair.
+    """
+    if candidates is None:
+        candidates = additional_matches_to_table(df['additional_matches'])
+    position = df.index.get_indexer(candidates['row_id'])
+    if (position < 0).any():
+        raise KeyError("candidates reference rows that are not in df")
+
+    return {
+        'position': position,
+        'id': candidates['id'].to_numpy(),
+        'location_x': candidates['location_x'].to_numpy(dtype=np.float64),
+        'location_y': candidates['location_y'].to_numpy(dtype=np.float64),
+        'tree_name': candidates['tree_name'].to_numpy() if 'tree_name' in candidates
+        else np.full(len(candidates), None, dtype=object),
+    }
+
+
+def pair_angles(df, pairs, meters_divide=METERS_DIVIDE):
+    """
+    Bearing from the car to every candidate and its difference from the detection's real_angle.
+
+    real_angle is the compass bearing (radians, clockwise from north) from the car to the
+    detected tree, so candidate bearings are computed the same way.
+
+    Returns:
+        tuple: (angle_diff in degrees within [0, 180], distance from the car in meters) arrays.
+    """
+    # df can also be a coordinate_store.CoordinateStore
+    position = pairs['position']
+    x_car = np.asarray(df['x_image'], dtype=np.float64)[position]
+    y_car = np.asarray(df['y_image'], dtype=np.float64)[position]
+    real_angle = np.asarray(df['real_angle'], dtype=np.float64)[position]
+
+    dx = pairs['location_x'] - x_car
+    dy = pairs['location_y'] - y_car
+    bearing = np.arctan2(dx, dy)
+    angle_diff = np.abs(np.degrees((bearing - real_angle + np.pi) % (2 * np.pi) - np.pi))
+    distance = np.hypot(dx, dy) * meters_divide
+    return angle_diff, distance
+
+
+def match_detections(df, candidates=None, max_angle_diff=None, max_distance=None, min_threshold=None,
+                     second_threshold=None, meters_divide=METERS_DIVIDE):
+    """
+    Pick the best and second-best candidate tree of every detection by angle difference.
+
+    Args:
+        df (pd.DataFrame): Survey rows, see candidate_pairs.
+        candidates (pd.DataFrame | None): Flat candidate table, defaults to additional_matches.
+        max_angle_diff (float | None): Ignore candidates further than this many degrees from real_angle.
+        max_distance (float | None): Ignore candidates further than this many meters from the car.
+        min_threshold (float | None): With second_threshold, only keep a best match below min_threshold
+            degrees whose runner-up is above second_threshold degrees (ambiguous detections stay unmatched).
+        second_threshold (float | None): See min_threshold.
+        meters_divide (float): Degrees -> meters factor.
+
+    Returns:
+        pd.DataFrame: Indexed like df, with tree_id, tree_name, x_tree, y_tree, best_angle_diff,
+        second_best_match_tree and second_best_angle_diff (NaN/None when there is no such candidate).
+    """
+    pairs = candidate_pairs(df, candidates)
+    angle_diff, distance = pair_angles(df, pairs, meters_divide=meters_divide)
+    best_take, second_take = select_matches(len(df), pairs['position'], angle_diff, distance,
+                                            max_angle_diff=max_angle_diff, max_distance=max_distance,
+                                            min_threshold=min_threshold, second_threshold=second_threshold)
+
+    def scatter(take, values, fill=np.nan, dtype=np.float64):
+        column = np.full(len(df), fill, dtype=dtype)
+        column[pairs['position'][take]] = values[take]
+        return column
+
+    return pd.DataFrame({
+        'tree_id': scatter(best_take, pairs['id']),
+        'tree_name': scatter(best_take, pairs['tree_name'], fill=None, dtype=object),
+        'x_tree': scatter(best_take, pairs['location_x']),
+        'y_tree': scatter(best_take, pairs['location_y']),
+        'best_angle_diff': scatter(best_take, angle_diff),
+        'second_best_match_tree': scatter(second_take, pairs['id']),
+        'second_best_angle_diff': scatter(second_take, angle_diff),
+    }, index=df.index)
+
+
+def select_matches(n_rows, position, angle_diff, distance, max_angle_diff=None, max_distance=None,
+                   min_threshold=None, second_threshold=None):
+    """
+    Core of match_detections on precomputed pair arrays, so parameter sweeps can reuse them.
+
+    Args:
+        n_rows (int): Number of detections.
+        position (np.ndarray): Detection position of every pair.
+        angle_diff (np.ndarray): Angle difference of every pair, see pair_angles.
+        distance (np.ndarray): Car to candidate distance of every pair, in meters.
+        max_angle_diff, max_distance, min_threshold, second_threshold: See match_detections.
+
+    Returns:
+        tuple: (best, second) arrays of pair indices, at most one of each per detection.
+    """
+    valid = np.isfinite(angle_diff)
+    if max_angle_diff is not None:
+        valid &= angle_diff <= max_angle_diff
+    if max_distance is not None:
+        valid &= distance <= max_distance
+    candidates = np.flatnonzero(valid)
+
+    # Rank candidates by angle diff within each detection
+    order = candidates[np.lexsort((angle_diff[candidates], position[candidates]))]
+    counts = np.bincount(position[order], minlength=n_rows)
+    rank = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    best = order[rank == 0]
+    second = order[rank == 1]
+
+    if min_threshold is not None and second_threshold is not None:
+        # Runner-up missing counts as infinitely far, as in update_df_with_min_angle_diff
+        second_diff = np.full(n_rows, np.inf)
+        second_diff[position[second]] = angle_diff[second]
+        keep = (angle_diff[best] < min_threshold) & (second_diff[position[best]] > second_threshold)
+        best = best[keep]
+
+    return best, second
+
+
+def rematch_df(df, **params):
+    """
+    Return a copy of df with its best matches recomputed by match_detections.
+
+    tree_id, tree_name, x_tree, y_tree and best_angle_diff are replaced and a matched_details
+    column ({'second_best_match_tree': id or None, 'second_best_angle_diff': ...}) is added, as
+    read by select_images.
+    """
+    matches = match_detections(df, **params)
+    updated_df = df.copy()
+    for column in ['tree_id', 'tree_name', 'x_tree', 'y_tree', 'best_angle_diff']:
+        updated_df[column] = matches[column]
+    second_trees = matches['second_best_match_tree'].to_numpy()
+    second_diffs = matches['second_best_angle_diff'].to_numpy()
+    updated_df['matched_details'] = [
+        {'second_best_match_tree': None if np.isnan(tree) else int(tree), 'second_best_angle_diff': float(diff)}
+        for tree, diff in zip(second_trees, second_diffs)
+    ]
+    return updated_df
@@ -0,0 +1,228 @@
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+import clean_data_before_json
+import main_3
+from clean_data_before_json import clean_df, fix_and_eval, parse_additional_matches_column, \
+    update_df_with_min_angle_diff
+from synthetic_survey import make_synthetic_survey
+
+BENCHMARK_SIZES = (2_000, 10_000)
+
+# City-wide survey sizes, run with --large (minutes per size). They are only checked against
+# the baseline when it has them (python benchmark.py --large --update-baseline).
+LARGE_BENCHMARK_SIZES = (100_000, 1_000_000)
+
+# Seconds are absolute and machine-specific: the committed baseline was recorded on a single
+# CPU machine. Before checking on another machine (or after an intended slowdown), record one
+# there from a known-good commit with `python benchmark.py --update-baseline`, which rewrites
+# the entries of the sizes it runs and keeps the others.
+BASELINE_PATH = "benchmarks/baseline.json"
+
+# A stage is a regression when it is this much slower than its baseline
+REGRESSION_TOLERANCE = 0.25
+
+
+@contextmanager
+def _working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(func, setup=None, repeat=1, measure_memory=True):
+    """
+    Time func(*setup()) and measure its peak memory.
+
+    The setup (e.g. copying the input frame) is not timed. Timing runs take the best of repeat
+    runs; the memory is measured in one extra run under tracemalloc, which slows Python code
+    down and would skew the timing.
+
+    Returns:
+        dict: seconds and peak_mb (None without measure_memory).
+    """
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if measure_memory:
+        args = setup() if setup else ()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+
+    return {"seconds": min(timings), "peak_mb": peak_mb}
+
+
+def benchmark_stages(df, report_images=50, repeat=1, measure_memory=True):
+    """
+    Run every pipeline stage on one survey and measure it.
+
+    Args:
+        df (pd.DataFrame): Raw survey, as read_excel returns it (see make_synthetic_survey).
+        report_images (int): Images rendered by the generate_map and report stages, which are
+            far slower per row than the others.
+        repeat (int): Timing runs per stage, the best one counts.
+        measure_memory (bool): Also measure every stage's peak memory.
+
+    Returns:
+        list: One dict per stage: stage, rows, seconds, rows_per_sec and peak_mb.
+    """
+    cleaned = clean_df(df.copy())
+    report_files = cleaned['file_name'].unique()[:report_images]
+    report_df = cleaned[cleaned['file_name'].isin(report_files)]
+    map_groups = list(main_3.partition_by_file_name(report_df).values())
+
+    def render_maps_in_process():
+        for rows in map_groups:
+            main_3.generate_map(rows, "left")
+
+    def render_report():
+        main_3.create_html_with_images_and_details(df_tlv_survey=report_df, detected_images_folder="detected_images",
+                                                   output_html_file="index.html", max_images=report_images,
+                                                   map_workers=1, incremental=False)
+
+    stages = [
+        ("fix_and_eval", lambda values: [fix_and_eval(value) for value in values],
+         lambda: (df['additional_matches'].tolist(),), len(df)),
+        ("parse_additional_matches_column", parse_additional_matches_column,
+         lambda: (df['additional_matches'],), len(df)),
+        ("update_df_with_min_angle_diff", update_df_with_min_angle_diff,
+         lambda: (df,), len(df)),
+        ("clean_df", clean_df, lambda: (df.copy(),), len(df)),
+        ("generate_map", render_maps_in_process, None, len(report_df)),
+        ("create_html_with_images_and_details", render_report, None, len(report_df)),
+    ]
+
+    results = []
+    # Maps and the report are written to a scratch folder
+    with tempfile.TemporaryDirectory() as scratch, _working_directory(scratch):
+        for name, func, setup, rows in stages:
+            def cold_setup(setup=setup):
+                # The parse cache would make every run after the first one free
+                clean_data_before_json._parse_matches_string.cache_clear()
+                return setup() if setup else ()
+
+            stats = measure(func, setup=cold_setup, repeat=repeat, measure_memory=measure_memory)
+            stats.update(stage=name, rows=rows, rows_per_sec=rows / stats["seconds"] if stats["seconds"] else None)
+            results.append(stats)
+            print(f"  {name}: {stats['seconds']:.3f}s, {rows} rows"
+                  + (f", peak {stats['peak_mb']:.1f} MB" if stats["peak_mb"] is not None else ""))
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """
+    Store results as the baseline, keyed by '<stage>@<size>'.
+    """
+    baseline = load_baseline(path)
+    for result in results:
+        baseline[f"{result['stage']}@{result['size']}"] = {key: result[key] for key in ("seconds", "peak_mb")}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Add the baseline seconds and the slowdown to every result.
+
+    Returns:
+        list: The results slower than baseline * (1 + tolerance).
+    """
+    regressions = []
+    for result in results:
+        saved = baseline.get(f"{result['stage']}@{result['size']}")
+        result["baseline_seconds"] = saved["seconds"] if saved else None
+        result["slowdown"] = result["seconds"] / saved["seconds"] if saved and saved["seconds"] else None
+        if result["slowdown"] is not None and result["slowdown"] > 1 + tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, seed=0, report_images=50, repeat=1, measure_memory=True,
+                   baseline_path=BASELINE_PATH, update_baseline=False, tolerance=REGRESSION_TOLERANCE):
+    """
+    Benchmark every stage on synthetic surveys of the given sizes and check them against the baseline.
+
+    Args:
+        sizes (tuple): Survey sizes in rows.
+        seed (int): Seed of the synthetic surveys.
+        report_images (int): Images rendered by the map and report stages.
+        repeat (int): Timing runs per stage.
+        measure_memory (bool): Measure peak memory too.
+        baseline_path (str): JSON file of the stored baseline.
+        update_baseline (bool): Store these results as the new baseline.
+        tolerance (float): Allowed slowdown before a stage counts as a regression.
+
+    Returns:
+        tuple: (results DataFrame, list of regressions). Results without a baseline have a
+        missing baseline_seconds and are reported, they can't be checked.
+    """
+    results = []
+    for size in sizes:
+        print(f"Survey of {size} rows")
+        start = time.perf_counter()
+        df = make_synthetic_survey(size, seed=seed)
+        print(f"  generated in {time.perf_counter() - start:.1f}s")
+        for result in benchmark_stages(df, report_images=report_images, repeat=repeat,
+                                       measure_memory=measure_memory):
+            result["size"] = size
+            results.append(result)
+        del df
+
+    baseline = load_baseline(baseline_path)
+    if not baseline and not update_baseline:
+        print(f"⚠️ No baseline at {baseline_path}, run with --update-baseline to store one")
+    regressions = compare_with_baseline(results, baseline, tolerance=tolerance)
+    if update_baseline:
+        save_baseline(results, baseline_path)
+
+    table = pd.DataFrame(results)[["size", "stage", "rows", "seconds", "rows_per_sec", "peak_mb",
+                                   "baseline_seconds", "slowdown"]]
+    print(f"\nPython {platform.python_version()}, pandas {pd.__version__}, {os.cpu_count()} CPUs")
+    print(table.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    for result in regressions:
+        print(f"❌ {result['stage']} @ {result['size']}: {result['slowdown']:.2f}x the baseline")
+    if not update_baseline:
+        for result in results:
+            if result["baseline_seconds"] is None:
+                print(f"⚠️ {result['stage']} @ {result['size']}: not in the baseline, not checked")
+    return table, regressions
+
+
+if __name__ == '__main__':
+    update_baseline = "--update-baseline" in sys.argv
+    sizes = BENCHMARK_SIZES + (LARGE_BENCHMARK_SIZES if "--large" in sys.argv else ())
+    table, regressions = run_benchmarks(sizes=sizes, update_baseline=update_baseline)
+    # A routine stage without a baseline fails the check instead of silently passing it
+    unchecked = (table["baseline_seconds"].isna() & table["size"].isin(BENCHMARK_SIZES)).any()
+    sys.exit(1 if (regressions or unchecked) and not update_baseline else 0)
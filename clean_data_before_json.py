@@ -1,115 +1,128 @@
 import ast
+import json
 import os
 import re
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 
-
-def select_images(df, n):
-    # Load or use existing dataframe
-    df = df.copy()  # Ensure original df is not modified
-
-    # Separate matched and non-matched cases
-    matched = df[df["tree_id"].notna()]  # Rows where a match exists
-    non_matched = df[df["tree_id"].isna()]  # Rows where no match exists
-    # matched["best_angle_diff"] = matched["best_angle_diff"].astype(float)
-    # non_matched["best_angle_diff"] = non_matched["best_angle_diff"].astype(float)
-
-    # Convert 'best_angle_diff' to numeric (force errors to NaN)
-    # matched.loc[:, "best_angle_diff"] = pd.to_numeric(matched["best_angle_diff"], errors="coerce")
-    # non_matched.loc[:, "best_angle_diff"] = pd.to_numeric(non_matched["best_angle_diff"], errors="coerce")
-    # # Handle NaN values in 'additional_matches' column
-    # non_matched.loc[:, "additional_matches"] = non_matched["additional_matches"].apply(
-    #     lambda x: x if isinstance(x, list) else [])
-
-    # Compute quantiles for best_angle_diff
-    matched_high_threshold = matched["best_angle_diff"].quantile(0.9)  # Top 10%
-    matched_low_threshold = matched["best_angle_diff"].quantile(0.1)  # Bottom 10%
-
-    # Prioritize interesting matched cases
-    matched_interesting = matched[
-        (matched["matched_details"].apply(
-            lambda x: isinstance(x, dict) and x.get("second_best_match_tree") is not None)) |
-        (matched["best_angle_diff"] > matched_high_threshold) |
-        (matched["best_angle_diff"] < matched_low_threshold)
-        ]
-
-    # Select 50 unique images from matched and 50 from non-matched
-    selected_matched_images = matched_interesting["file_name"].drop_duplicates().sample(n=100, random_state=42)
-
-    # # Ensure 'file_name' column exists
-    # if "file_name" not in non_matched_interesting.columns:
-    #     print("Column 'file_name' does not exist in non_matched_interesting")
-    # Check the number of available unique images
-    unique_files = non_matched["file_name"].drop_duplicates()
-    if unique_files.empty:
+from image_summary import group_rows_by_image, image_order, image_rows, sample_images, summarize_images
+from profiling import stage, timed_stage
+
+
+def select_images(df, n, n_matched=100, seed=42, output_csv=None, summary=None):
+    """
+    Pick review images: n_matched "interesting" matched images and n images with an unmatched
+    detection.
+
+    An image is interesting, as in the original row-level rule, if one of its matched
+    detections has a runner-up (matched_details' second_best_match_tree) or a best_angle_diff
+    below the 10% or above the 90% quantile of all matched detections. A detection is outside
+    the quantiles exactly when its image's smallest or largest best_angle_diff is, so the rule
+    is evaluated on the per-image summary.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey, in any row order.
+        n (int): Images with an unmatched detection.
+        n_matched (int): Interesting matched images.
+        seed (int): Random seed, the same seed gives the same selection.
+        output_csv (str | None): Also save the selected rows there.
+        summary (pd.DataFrame | None): df's per-image summary if already built (see clean_df).
+
+    Returns:
+        pd.DataFrame: All rows of the selected images, in df's order.
+    """
+    order = image_order(df)
+    if summary is None:
+        summary = summarize_images(df if order is None else df.iloc[order])
+    # Quantiles over every matched detection, not over images
+    matched_diffs = pd.to_numeric(df['best_angle_diff'], errors='coerce')[df['tree_id'].notna()]
+    low, high = matched_diffs.quantile(0.1), matched_diffs.quantile(0.9)
+    interesting = summary['matched'] & (summary['second_best'] | (summary['best_angle_diff'] < low) |
+                                        (summary['worst_angle_diff'] > high))
+    with_unmatched = summary['n_matched'] < summary['n_detections']
+
+    interesting_images = np.flatnonzero(interesting)
+    unmatched_images = np.flatnonzero(with_unmatched)
+    if not len(unmatched_images):
         print("No available images to sample from.")
-        selected_non_matched_images = pd.Series(dtype=object)
-    else:
-        sample_size = min(n, len(unique_files))  # Ensure we don't sample more than available
-        selected_non_matched_images = unique_files.sample(n=sample_size, random_state=42)
-
-    # selected_non_matched_images = non_matched_interesting["file_name"].drop_duplicates().sample(n=50, random_state=42)
-
-    # Combine selected images
-    selected_images = pd.concat([selected_matched_images, selected_non_matched_images])
-
-    # Get all rows that belong to the selected images
-    selected_df = df[df["file_name"].isin(selected_images)]
-
-    # Save to CSV or Parquet
-    selected_df.to_csv("selected_images.csv", index=False)
+    selected_images = np.union1d(
+        interesting_images[sample_images(summary.iloc[interesting_images], n_matched, by=(), seed=seed)],
+        unmatched_images[sample_images(summary.iloc[unmatched_images], n, by=(), seed=seed)])
 
+    selected_df = df.iloc[_df_positions(image_rows(summary, selected_images), order)]
+    if output_csv:
+        selected_df.to_csv(output_csv, index=False)
     return selected_df
 
 
-def update_df_with_min_angle_diff(df, min_threshold=20, second_threshold=30, is_small_survey=False):
+@timed_stage(rows_from="df")
+def update_df_with_min_angle_diff(df, min_threshold=20, second_threshold=30, is_small_survey=False,
+                                  use_thresholds=False):
+    """
+    Keep only the best detection per (file_name, tree_id) pair and blank out the matched
+    Seker fields of every other detection that was matched to the same tree.
+
+    The best detection is the one with the smallest best_angle_diff (ties and all-NaN groups
+    keep the first row). With use_thresholds=True a group keeps its best detection only if
+    its angle diff is below min_threshold and the runner-up is above second_threshold,
+    otherwise every detection in the group is blanked.
+    """
     # Create a copy to avoid modifying the original dataframe
     updated_df = df.copy()
 
-    # Group by 'file_name' and 'tree_id' to process each combination
-    grouped = updated_df.groupby(['file_name', 'tree_id'])
-    counter = 0
-    # Iterate over the groups
-    for (file_name, tree_id), group in grouped:
-        # Sort the group by best_angle_diff
-        sorted_group = group.sort_values(by='best_angle_diff')
-
-        # Get the minimum and second minimum best_angle_diff values
-        if len(sorted_group) > 1:
-            min_angle_diff = sorted_group.iloc[0]['best_angle_diff']
-            second_min_angle_diff = sorted_group.iloc[1]['best_angle_diff']
-        else:
-            min_angle_diff = sorted_group.iloc[0]['best_angle_diff']
-            second_min_angle_diff = float('inf')  # No second value available
-
-        # Check if conditions are met
-        # if min_angle_diff < min_threshold and second_min_angle_diff > second_threshold:
-        #     min_distance_idx = sorted_group.index[0]
-        # else:
-        #     min_distance_idx = None  # No valid match
-        min_distance_idx = sorted_group.index[0]
-
-        # Get all indices of the group
-        group_indices = group.index
-
-        # Define the numeric columns that should get np.nan
-        numeric_cols = ['tree_id', 'x_tree', 'y_tree', 'best_angle_diff']
-
-        # Define the string columns that should get "None"
-        if is_small_survey:
-            string_cols = ['tree_name', 'tree_name_code', 'tree_name_big_csv']
-        else:
-            string_cols = ['tree_name', 'name_eng', 'name_heb', 'type_1', 'type_2', 'type_3']
-
-        # Set fields to 'None' for rows not meeting the criteria
-        for idx in group_indices:
-            if idx != min_distance_idx:
-                updated_df.loc[idx, numeric_cols] = np.nan  # Assign NaN to numeric columns
-                updated_df.loc[idx, string_cols] = "None"  # Assign "None" to string columns
-        # print(counter)
-        counter += 1
+    # Define the numeric columns that should get np.nan
+    numeric_cols = ['tree_id', 'x_tree', 'y_tree', 'best_angle_diff']
+
+    # Define the string columns that should get "None"
+    if is_small_survey:
+        string_cols = ['tree_name', 'tree_name_code', 'tree_name_big_csv']
+    else:
+        string_cols = ['tree_name', 'name_eng', 'name_heb', 'type_1', 'type_2', 'type_3']
+
+    # Rows with a missing key are not part of any (file_name, tree_id) group
+    in_group = (updated_df['file_name'].notna() & updated_df['tree_id'].notna()).to_numpy()
+    if not in_group.any():
+        return updated_df
+
+    # Positional frame so duplicated index labels can't leak into the assignment below
+    candidates = pd.DataFrame({
+        'file_name': updated_df['file_name'].to_numpy()[in_group],
+        'tree_id': updated_df['tree_id'].to_numpy()[in_group],
+        'best_angle_diff': pd.to_numeric(updated_df['best_angle_diff'], errors='coerce').to_numpy()[in_group],
+        'position': np.flatnonzero(in_group),
+    })
+
+    # Stable sort puts the best detection of each group first (NaN diffs last)
+    ordered = candidates.sort_values(by='best_angle_diff', kind='mergesort', na_position='last')
+    grouped = ordered.groupby(['file_name', 'tree_id'], sort=False)
+    rank = grouped.cumcount().to_numpy()
+    keep = rank == 0
+
+    if use_thresholds:
+        angle_diff = ordered['best_angle_diff']
+        min_angle_diff = angle_diff.where(keep).groupby([ordered['file_name'], ordered['tree_id']],
+                                                         sort=False).transform('max').to_numpy()
+        second_min_angle_diff = angle_diff.where(rank == 1).groupby([ordered['file_name'], ordered['tree_id']],
+                                                                    sort=False).transform('max').to_numpy()
+        # No second value available
+        second_min_angle_diff = np.where(grouped['position'].transform('size').to_numpy() > 1,
+                                         second_min_angle_diff, np.inf)
+        keep &= (min_angle_diff < min_threshold) & (second_min_angle_diff > second_threshold)
+
+    # Set fields to 'None' for rows not meeting the criteria
+    drop_mask = np.zeros(len(updated_df), dtype=bool)
+    drop_mask[ordered['position'].to_numpy()[~keep]] = True
+    if drop_mask.any():
+        updated_df.loc[drop_mask, numeric_cols] = np.nan  # Assign NaN to numeric columns
+        # Assign "None" to string columns, compact (categorical) ones use missing values only
+        # Columns projected away at load time (see survey_cache.REPORT_COLUMNS) are skipped
+        string_cols = [col for col in string_cols if col in updated_df.columns]
+        object_cols = [col for col in string_cols if not isinstance(updated_df[col].dtype, pd.CategoricalDtype)]
+        category_cols = [col for col in string_cols if col not in object_cols]
+        updated_df.loc[drop_mask, object_cols] = "None"
+        updated_df.loc[drop_mask, category_cols] = np.nan
 
     return updated_df
 
@@ -130,31 +143,222 @@ def fix_and_eval(value):
     return value  # Return as is if not a string
 
 
-def get_subset_df(df, table_name, n, images_list):
-    # Step 1: Randomly choose 100 unique file_names
-    sample_file_names = df["file_name"].drop_duplicates().sample(n=n, random_state=42)
-    # Step 2: Subset the original DataFrame to only include those file_names
-    df_subset = df[df["file_name"].isin(sample_file_names)]
+# Python-literal tokens that need rewriting before the candidate list is valid JSON
+_MATCHES_TOKEN_RE = re.compile(r"""'([^'\\]*)'|"([^"\\]*)"|\b(nan|None|True|False)\b|(['"\\])""")
+_JSON_KEYWORDS = {"nan": "null", "None": "null", "True": "true", "False": "false"}
 
-    # Remove the extension from the original file
-    base_name = os.path.splitext(table_name)[0]
-    # Create the new filename
-    new_filename = f"{n}_{base_name}.csv"
 
-    # Save to CSV
-    df_subset.to_csv(new_filename, index=False)
-    df_subset["file_name"].to_csv(images_list, index=False, header=False)
+def _matches_token_to_json(match):
+    single_quoted, double_quoted, keyword, stray = match.groups()
+    if stray is not None:
+        # Escaped or unbalanced quotes - leave it to literal_eval
+        raise ValueError("unsupported literal")
+    if keyword is not None:
+        return _JSON_KEYWORDS[keyword]
+    content = single_quoted if single_quoted is not None else double_quoted
+    if "nan" in content:
+        # fix_and_eval rewrites 'nan' inside strings too, keep its output
+        raise ValueError("nan inside string")
+    return json.dumps(content, ensure_ascii=False)
+
+
+@lru_cache(maxsize=16384)
+def _parse_matches_string(value):
+    try:
+        normalized = _MATCHES_TOKEN_RE.sub(_matches_token_to_json, value.strip())
+        return json.loads(re.sub(r"}\s*{", "}, {", normalized))
+    except ValueError:
+        return fix_and_eval(value)
+
+
+def parse_additional_matches(value):
+    """
+    Fast drop-in for fix_and_eval on additional_matches values.
+
+    Candidate lists are rewritten to JSON and parsed with json.loads, falling back to
+    fix_and_eval for anything the rewrite can't handle. Parsed strings are memoized, so
+    rows with the same candidate list share one (read-only) list object.
+    """
+    if isinstance(value, str):
+        return _parse_matches_string(value)
+    if isinstance(value, list):
+        return value
+    return fix_and_eval(value)
+
+
+@timed_stage(rows_from="series")
+def parse_additional_matches_column(series):
+    """
+    Parse an additional_matches column, evaluating every distinct string only once.
+    """
+    parsed = {}
+    for value in series:
+        # Already parsed lists (e.g. a cleaned frame) are passed through below
+        if isinstance(value, str) and value not in parsed:
+            parsed[value] = parse_additional_matches(value)
+    return series.map(lambda x: parsed[x] if isinstance(x, str) else parse_additional_matches(x))
+
+
+def additional_matches_to_table(series):
+    """
+    Flatten an additional_matches column into one row per candidate tree.
+
+    Every distinct candidate list is parsed once and the result is expanded to the rows
+    that share it, so no per-row Python lists are built.
+
+    Args:
+        series (pd.Series): additional_matches strings (or already parsed lists).
+
+    Returns:
+        pd.DataFrame: row_id (index label of the detection row), id, location_x, location_y,
+        tree_name and the remaining candidate keys.
+    """
+    # Lists aren't hashable, factorize them by their repr
+    codes, uniques = pd.factorize(series.map(lambda x: x if isinstance(x, str) or not isinstance(x, list)
+                                             else repr(x)))
+    first_rows = pd.Series(np.arange(len(series))).groupby(codes).first()
+
+    records = []
+    lengths = np.zeros(len(uniques) + 1, dtype=np.int64)  # last slot: missing values
+    for code, row_position in first_rows.items():
+        if code < 0:
+            continue
+        candidates = parse_additional_matches(series.iloc[row_position]) or []
+        records.extend(candidates)
+        lengths[code] = len(candidates)
+    offsets = np.cumsum(lengths) - lengths
+
+    # Position of every output candidate inside records
+    row_lengths = lengths[codes]
+    within_row = np.arange(row_lengths.sum()) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+    gather = np.repeat(offsets[codes], row_lengths) + within_row
+
+    table = pd.DataFrame.from_records(records, columns=None if records else
+                                      ['id', 'location_x', 'location_y', 'tree_name'])
+    table = table.iloc[gather].reset_index(drop=True)
+    table.insert(0, 'row_id', np.repeat(series.index.to_numpy(), row_lengths))
+    return table
+
+
+def get_subset_df(df, table_name=None, n=100, images_list=None, seed=42, summary=None):
+    """
+    Random subset of n images (all their rows) of a cleaned survey.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey, in any row order.
+        table_name (str | None): Also save the subset as "<n>_<table_name stem>.csv".
+        n (int): Number of images.
+        images_list (str | None): Also save the subset's file_name column there.
+        seed (int): Random seed.
+        summary (pd.DataFrame | None): df's per-image summary if already built (see clean_df).
+
+    Returns:
+        pd.DataFrame: The subset, in df's order.
+    """
+    order = image_order(df)
+    if summary is None:
+        summary = summarize_images(df if order is None else df.iloc[order])
+    df_subset = df.iloc[_df_positions(image_rows(summary, sample_images(summary, n, by=(), seed=seed)), order)]
+
+    if table_name:
+        # Remove the extension from the original file
+        base_name = os.path.splitext(table_name)[0]
+        df_subset.to_csv(f"{n}_{base_name}.csv", index=False)
+    if images_list:
+        df_subset["file_name"].to_csv(images_list, index=False, header=False)
 
     return df_subset
 
 
+def _df_positions(positions, order):
+    """
+    Positions in the image-grouped frame (see image_summary.image_order) as sorted positions in df.
+    """
+    return positions if order is None else np.sort(order[positions])
+
+
 def save_file_names_to_txt(df, output_path):
     with open(output_path, "w") as f:
         for name in df["file_name"]:
             f.write(f"{name}\n")
 
 
-def clean_df(df, is_small_survey=False):
+# Repeated strings (image names, species) stored as categoricals in compact mode
+COMPACT_CATEGORY_COLUMNS = ['file_name', 'file_name_with_detections', 'tree_name', 'name_eng', 'name_heb',
+                            'type_1', 'type_2', 'type_3', 'tree_name_code', 'tree_name_big_csv']
+
+# Whole-number columns stored as nullable integers (pd.NA when missing), Int32 when they fit.
+# tree_id stays float64, the report prints it as the survey outputs have it (e.g. "38294.0").
+COMPACT_INTEGER_COLUMNS = ['row_id', 'tree_index', 'possible_trees', 'heading']
+
+# Box fractions and distances keep plenty of precision in float32. The absolute coordinates
+# (x_image, x_tree, x_tree_image, ...) stay float64: float32 would round them by up to half a
+# meter, about the size of the matching differences themselves. So do the angles the report
+# prints and matching compares (real_angle, best_angle_diff, second_best_angle_diff).
+COMPACT_FLOAT32_COLUMNS = ['x_box', 'y_box', 'width_box', 'height_box', 'x_bottom', 'y_bottom', 'meters_to_tree',
+                           'distance_to_tree', 'x_distance', 'y_distance']
+
+
+# Columns clean_df converts to float ("None" sentinels become NaN)
+SURVEY_FLOAT_COLUMNS = ['best_angle_diff', 'x_tree', 'y_tree']
+
+
+def coerce_survey_types(df):
+    """
+    clean_df's type coercions, in place: "None" sentinels become NaN and SURVEY_FLOAT_COLUMNS
+    floats. Safe to apply to every chunk of a survey read in chunks, and again on its result.
+    """
+    with stage("replace_none", rows=len(df)):
+        df.replace("None", np.nan, inplace=True)
+    with stage("to_numeric", rows=len(df)):
+        for column in df.columns.intersection(SURVEY_FLOAT_COLUMNS):
+            df[column] = pd.to_numeric(df[column].astype(float), errors="coerce")
+    return df
+
+
+def compact_dtypes(df):
+    """
+    Convert a cleaned survey frame to compact dtypes, with pd.NA/NaN as the only missing value.
+
+    The "None" sentinels update_df_with_min_angle_diff writes into the string columns become
+    missing values, repeated strings become categoricals, whole-number columns nullable
+    integers and the box and distance floats float32. Columns whose values don't fit (e.g. a
+    fractional heading) are left as they are.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey, as clean_df returns it.
+
+    Returns:
+        pd.DataFrame: The same rows with compact column dtypes.
+    """
+    df = df.copy()
+    for column in df.columns.intersection(COMPACT_CATEGORY_COLUMNS):
+        values = df[column]
+        if values.dtype == object:
+            values = values.mask(values.eq("None"))
+        df[column] = values.astype("category")
+
+    for column in df.columns.intersection(COMPACT_INTEGER_COLUMNS):
+        values = pd.to_numeric(df[column], errors="coerce")
+        whole = values.dropna()
+        if whole.eq(whole.round()).all():
+            df[column] = values.astype("Int32" if whole.abs().max() < 2 ** 31 else "Int64")
+
+    for column in df.columns.intersection(COMPACT_FLOAT32_COLUMNS):
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype(np.float32)
+    return df
+
+
+@timed_stage(rows_from="df")
+def clean_df(df, is_small_survey=False, compact=False, with_summary=False):
+    """
+    Clean a survey output: "None" sentinels, numeric types, one detection per matched tree
+    (see update_df_with_min_angle_diff) and parsed additional_matches.
+
+    With compact=True the result has compact dtypes (see compact_dtypes). With
+    with_summary=True the rows are grouped by image (see group_rows_by_image, a no-op for
+    survey outputs) and (df, per-image summary) is returned (see summarize_images).
+    """
     # df_non_nan_tree_id = df[df["tree_id"].notna()]
     # df_non_nan_tree_id.to_excel("only_matches_updated_min_angle_diff.xlsx")
 
@@ -162,10 +366,7 @@ def clean_df(df, is_small_survey=False):
     # df = pd.read_parquet('combined_data.parquet', engine="pyarrow")
 
     # clearance
-    df.replace("None", np.nan, inplace=True)
-    df["best_angle_diff"] = pd.to_numeric(df["best_angle_diff"].astype(float), errors="coerce")
-    df["x_tree"] = pd.to_numeric(df["x_tree"].astype(float), errors="coerce")
-    df["y_tree"] = pd.to_numeric(df["y_tree"].astype(float), errors="coerce")
+    coerce_survey_types(df)
 
     # selected_df = select_images(df=df)
     updated_df = update_df_with_min_angle_diff(df=df, is_small_survey=is_small_survey)
@@ -192,9 +393,18 @@ def clean_df(df, is_small_survey=False):
 
     # save_file_names_to_txt(df=df_subset, output_path="images_sample_100.txt")
 
-    df_subset.loc[:, 'additional_matches'] = df_subset['additional_matches'].apply(fix_and_eval)
+    df_subset.loc[:, 'additional_matches'] = parse_additional_matches_column(df_subset['additional_matches'])
+
+    with stage("clean_tree_names", rows=len(df_subset)):
+        df_subset['tree_name'] = df_subset['tree_name'].apply(
+            lambda x: x.encode('utf-8').decode('utf-8', 'ignore') if isinstance(x, str) else x)
 
-    df_subset['tree_name'] = df_subset['tree_name'].apply(
-        lambda x: x.encode('utf-8').decode('utf-8', 'ignore') if isinstance(x, str) else x)
+    if compact:
+        with stage("compact_dtypes", rows=len(df_subset)):
+            df_subset = compact_dtypes(df_subset)
 
+    if with_summary:
+        df_subset = group_rows_by_image(df_subset)
+        with stage("summarize_images", rows=len(df_subset)):
+            return df_subset, summarize_images(df_subset)
     return df_subset
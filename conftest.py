@@ -0,0 +1 @@
+# Makes the repo's top-level modules importable from tests/
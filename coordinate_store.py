@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from clean_data_before_json import additional_matches_to_table
+from spatial_index import TreeIndex, load_inventory
+from survey_cache import CACHE_DIR, CLEAN_DF_VERSION, _params_hash, file_content_hash, load_clean_survey
+
+# Bump when the arrays of the store change so stale stores are rebuilt
+COORDINATE_STORE_VERSION = 1
+
+# Per-detection float64 arrays, named as the survey columns they come from
+DETECTION_COORDINATES = ['x_image', 'y_image', 'x_tree_image', 'y_tree_image', 'x_tree', 'y_tree', 'real_angle']
+
+
+def _float_array(values):
+    return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _save_array(folder, name, values):
+    np.save(os.path.join(folder, f"{name}.npy"), np.ascontiguousarray(values))
+
+
+def write_coordinate_store(df, path, inventory=None):
+    """
+    Write the coordinates of a survey as a folder of .npy arrays, memory-mapped by CoordinateStore.
+
+    Per detection (row of df): file_code (position of its image in file_names), tree_index,
+    tree_id (NaN when unmatched) and the DETECTION_COORDINATES. The candidate trees of
+    detection i (its additional_matches) are candidate_id/candidate_x/candidate_y
+    [candidate_offsets[i]:candidate_offsets[i + 1]]. With an inventory (see
+    spatial_index.load_inventory), also inventory_id/inventory_x/inventory_y.
+
+    Args:
+        df (pd.DataFrame): Survey rows, cleaned or raw.
+        path (str): Folder of the store, replaced if it exists.
+        inventory (pd.DataFrame | None): Seker inventory (OBJECTID, x, y).
+    """
+    df = df.reset_index(drop=True)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    file_codes, file_names = pd.factorize(df['file_name'])
+    _save_array(tmp_path, 'file_code', file_codes.astype(np.int32))
+    _save_array(tmp_path, 'tree_index', pd.to_numeric(df['tree_index']).to_numpy(dtype=np.int64))
+    _save_array(tmp_path, 'tree_id', _float_array(df['tree_id']))
+    for column in DETECTION_COORDINATES:
+        _save_array(tmp_path, column, _float_array(df[column]))
+
+    candidates = additional_matches_to_table(df['additional_matches'])
+    counts = np.bincount(candidates['row_id'].to_numpy(dtype=np.int64), minlength=len(df))
+    _save_array(tmp_path, 'candidate_offsets', np.r_[0, np.cumsum(counts)].astype(np.int64))
+    _save_array(tmp_path, 'candidate_id', _float_array(candidates['id']))
+    _save_array(tmp_path, 'candidate_x', _float_array(candidates['location_x']))
+    _save_array(tmp_path, 'candidate_y', _float_array(candidates['location_y']))
+
+    if inventory is not None:
+        _save_array(tmp_path, 'inventory_id', inventory['OBJECTID'].to_numpy(dtype=np.int64))
+        _save_array(tmp_path, 'inventory_x', _float_array(inventory['x']))
+        _save_array(tmp_path, 'inventory_y', _float_array(inventory['y']))
+
+    meta = {'version': COORDINATE_STORE_VERSION, 'rows': len(df), 'file_names': [str(name) for name in file_names]}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+class CoordinateStore:
+    """
+    Read-only, memory-mapped view of a store written by write_coordinate_store.
+
+    Arrays are mapped on first access and never copied: processes opening the same store share
+    its pages through the OS cache. The store pickles as its path, so handing it to worker
+    processes sends no array data.
+
+    Args:
+        path (str): Folder of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != COORDINATE_STORE_VERSION:
+            raise ValueError(f"{path} is a version {self.meta['version']} coordinate store, "
+                             f"expected {COORDINATE_STORE_VERSION}")
+        self.arrays = {}
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __contains__(self, name):
+        return os.path.exists(os.path.join(self.path, f"{name}.npy"))
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            if name not in self:
+                raise KeyError(name)
+            self.arrays[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+        return self.arrays[name]
+
+    @property
+    def file_names(self):
+        return self.meta['file_names']
+
+    def candidates(self, row):
+        """
+        (id, x, y) arrays of the candidate trees of one detection.
+        """
+        start, end = self['candidate_offsets'][row:row + 2]
+        return self['candidate_id'][start:end], self['candidate_x'][start:end], self['candidate_y'][start:end]
+
+    def candidate_pairs(self):
+        """
+        The detection x candidate pairs, as angle_matching.candidate_pairs builds them from the
+        frame (tree_name is None, the store holds no names).
+        """
+        counts = np.diff(self['candidate_offsets'])
+        return {
+            'position': np.repeat(np.arange(len(self)), counts),
+            'id': self['candidate_id'],
+            'location_x': self['candidate_x'],
+            'location_y': self['candidate_y'],
+            'tree_name': np.full(counts.sum(), None, dtype=object),
+        }
+
+    def tree_index(self, cell_size=25.0):
+        """
+        spatial_index.TreeIndex over the store's inventory trees.
+        """
+        if 'inventory_id' not in self:
+            raise KeyError(f"{self.path} has no inventory")
+        return TreeIndex(self['inventory_x'], self['inventory_y'], ids=self['inventory_id'], cell_size=cell_size)
+
+
+def load_coordinate_store(path, is_small_survey=False, inventory_path="data_tree_with_wgs.csv", cache_dir=CACHE_DIR):
+    """
+    Open the coordinate store of a survey output workbook, building it once per survey and
+    inventory content from the cleaned survey (see survey_cache.load_clean_survey).
+
+    Args:
+        path (str): Path to the survey xlsx.
+        is_small_survey (bool): Passed to clean_df.
+        inventory_path (str | None): Seker inventory csv, None for a store without inventory.
+        cache_dir (str): Folder holding the cached files.
+
+    Returns:
+        CoordinateStore
+    """
+    # Built from the cleaned survey, so stores of an older clean_df are rebuilt too
+    params = {'is_small_survey': is_small_survey, 'version': COORDINATE_STORE_VERSION,
+              'clean_version': CLEAN_DF_VERSION, 'inventory': inventory_path and file_content_hash(inventory_path)}
+    store_path = os.path.join(cache_dir, f"{file_content_hash(path)}_coords_{_params_hash(params)}")
+    if not os.path.exists(os.path.join(store_path, 'meta.json')):
+        df = load_clean_survey(path, is_small_survey=is_small_survey, cache_dir=cache_dir)
+        inventory = load_inventory(inventory_path) if inventory_path else None
+        write_coordinate_store(df, store_path, inventory=inventory)
+    return CoordinateStore(store_path)
@@ -1,40 +1,191 @@
+import json
 import os
+import struct
 import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 
+# Local file header: signature, versions, flags, method, time, date, crc, sizes, name and extra lengths
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
 
-def extract_images_from_zip(csv_path, zip_path, image_column, output_dir):
+
+def zip_index_path(zip_path):
+    return f"{zip_path}.index.json"
+
+
+def build_zip_index(zip_path, persist=True):
+    """
+    Map every basename in the zip to its members' location, so they can be read without
+    scanning the archive again.
+
+    The index is saved next to the zip (<zip>.index.json) and reused as long as the zip's
+    size and modification time don't change.
+
+    Returns:
+        dict: basename -> list of [filename, header_offset, compress_type, compress_size, file_size, CRC].
+    """
+    stat = os.stat(zip_path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    index_path = zip_index_path(zip_path)
+    if os.path.exists(index_path):
+        with open(index_path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["stamp"] == stamp:
+            return saved["members"]
+
+    members = {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            members.setdefault(os.path.basename(info.filename), []).append(
+                [info.filename, info.header_offset, info.compress_type, info.compress_size, info.file_size,
+                 info.CRC])
+
+    if persist:
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stamp": stamp, "members": members}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+    return members
+
+
+def read_member(zip_file, entry):
+    """
+    Read one member's bytes straight from its local header, using an entry of build_zip_index.
+
+    Args:
+        zip_file: The zip opened in binary mode (a plain file object, not a ZipFile).
+        entry (list): [filename, header_offset, compress_type, compress_size, file_size, CRC].
+    """
+    filename, header_offset, compress_type, compress_size, file_size, crc = entry
+    zip_file.seek(header_offset)
+    header = _LOCAL_HEADER.unpack(zip_file.read(_LOCAL_HEADER.size))
+    if header[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {filename}")
+    if header[2] & 0x1:
+        raise NotImplementedError(f"{filename} is encrypted")
+    zip_file.seek(header[-2] + header[-1], os.SEEK_CUR)  # name + extra field
+    data = zip_file.read(compress_size)
+
+    if compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    elif compress_type != zipfile.ZIP_STORED:
+        raise NotImplementedError(f"Unsupported compression {compress_type} for {filename}")
+    if len(data) != file_size or zlib.crc32(data) != crc:
+        raise zipfile.BadZipFile(f"Bad CRC or size for {filename}")
+    return data
+
+
+def read_member_with_fallback(zip_file, zip_path, entry):
+    """
+    read_member, falling back to zipfile for the members it can't read (other compressions,
+    encrypted or malformed members). zipfile's errors for the ones it can't read either
+    (RuntimeError for encrypted members, NotImplementedError for unsupported compressions,
+    BadZipFile for corrupt ones) are raised.
+    """
+    try:
+        return read_member(zip_file, entry)
+    except (NotImplementedError, zipfile.BadZipFile, zlib.error):
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            return zip_ref.read(entry[0])
+
+
+# Errors of members that can't be read, see read_member_with_fallback
+UNREADABLE_MEMBER_ERRORS = (RuntimeError, NotImplementedError, zipfile.BadZipFile, zlib.error)
+
+
+def _is_extracted(path, entry):
+    """
+    True when path already holds this member (same size and CRC).
+    """
+    if not os.path.exists(path) or os.path.getsize(path) != entry[4]:
+        return False
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc == entry[5]
+
+
+def _target_path(output_dir, filename):
+    # Same sanitizing as ZipFile.extract: no absolute paths or '..' components
+    parts = [part for part in filename.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return os.path.join(output_dir, *parts)
+
+
+def _extract_entries(job):
+    zip_path, entries, output_dir = job
+    extracted = skipped = 0
+    # Every worker has its own handle on the archive
+    with open(zip_path, "rb") as zip_file:
+        for entry in entries:
+            target = _target_path(output_dir, entry[0])
+            if _is_extracted(target, entry):
+                continue
+            try:
+                data = read_member_with_fallback(zip_file, zip_path, entry)
+            except UNREADABLE_MEMBER_ERRORS as e:
+                print(f"❌ Skipping {entry[0]}: {e}")
+                skipped += 1
+                continue
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+            extracted += 1
+    return extracted, skipped
+
+
+def extract_members(zip_path, entries, output_dir, workers=None, chunk_size=64):
+    """
+    Extract index entries to output_dir (keeping their path inside the zip) in parallel worker
+    processes, skipping files that are already there with the same size and CRC. Members that
+    can't be read (see read_member_with_fallback) are reported and skipped.
+
+    Returns:
+        tuple: (number of files written, number of unreadable members skipped).
+    """
+    # Members in archive order keep the reads sequential within a chunk
+    entries = sorted(entries, key=lambda entry: entry[1])
+    jobs = [(zip_path, entries[start:start + chunk_size], output_dir)
+            for start in range(0, len(entries), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        counts = list(map(_extract_entries, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            counts = list(executor.map(_extract_entries, jobs))
+    return sum(extracted for extracted, _ in counts), sum(skipped for _, skipped in counts)
+
+
+def extract_images_from_zip(csv_path, zip_path, image_column, output_dir, workers=None):
     # 1. Load target filenames from CSV (basename only)
-    df = pd.read_csv(csv_path)
+    df = pd.read_csv(csv_path, usecols=[image_column])
     target_filenames = set(os.path.basename(f) for f in df[image_column])
 
-    # 2. Open the zip file
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        # Get list of all files in the zip
-        zip_files = zip_ref.namelist()
-
-        # Create output dir if not exists
-        os.makedirs(output_dir, exist_ok=True)
-
-        # Track which ones were found
-        found_files = set()
-
-        for zip_file in zip_files:
-            name_in_zip = os.path.basename(zip_file)
-            if name_in_zip in target_filenames:
-                # Extract this file
-                zip_ref.extract(zip_file, output_dir)
-                found_files.add(name_in_zip)
-
-        # Find which ones were missing
-        missing_files = target_filenames - found_files
-        if missing_files:
-            print("\nMissing files:")
-            for fname in sorted(missing_files):
-                print(f"❌ {fname}")
-        else:
-            print("\n✅ All files were found and extracted.")
+    # 2. Look the targets up in the (cached) basename index of the zip
+    zip_index = build_zip_index(zip_path)
+    found_files = target_filenames & zip_index.keys()
+
+    # Create output dir if not exists
+    os.makedirs(output_dir, exist_ok=True)
+    entries = [entry for name in found_files for entry in zip_index[name]]
+    extracted, skipped = extract_members(zip_path, entries, output_dir, workers=workers)
+    print(f"Extracted {extracted} files, {len(entries) - extracted - skipped} were already up to date")
+
+    # Find which ones were missing
+    missing_files = target_filenames - found_files
+    if missing_files:
+        print("\nMissing files:")
+        for fname in sorted(missing_files):
+            print(f"❌ {fname}")
+    if skipped:
+        print(f"\n❌ {skipped} files were found but couldn't be read, see the skipped files above")
+    elif not missing_files:
+        print("\n✅ All files were found and extracted.")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from report_server import ZipImageStore
+
+IMAGE_CACHE_DIR = ".image_cache"
+
+# Street View frame names: "<prefix>_heading=240.0&fov=64.0&location=<lat>,<lon>&source=outdoor.jpg"
+_IMAGE_NAME_RE = re.compile(r"heading=([^&]+)&fov=([^&]+)&location=([^,&]+),([^&]+)&source=([^&.]+)")
+
+# Street View request a frame is fetched by, in the image names' order
+ImageKey = namedtuple("ImageKey", ["lat", "lon", "heading", "fov"])
+
+
+class ImageNotFound(Exception):
+    """
+    The fetcher has no image for a key; not retried.
+    """
+
+
+def parse_image_name(name):
+    """
+    Return the ImageKey encoded in a frame's file name (also "N_segmented_..." names), None if
+    the name doesn't encode one.
+    """
+    match = _IMAGE_NAME_RE.search(os.path.basename(name))
+    if match is None:
+        return None
+    heading, fov, lat, lon, _ = match.groups()
+    return ImageKey(float(lat), float(lon), float(heading), float(fov))
+
+
+def image_name(key, prefix="tel aviv", source="outdoor"):
+    """
+    File name of a frame, as the survey outputs name them (the inverse of parse_image_name).
+    """
+    return f"{prefix}_heading={key.heading!r}&fov={key.fov!r}&location={key.lat!r},{key.lon!r}&source={source}.jpg"
+
+
+class ImageCache:
+    """
+    Content-addressed image cache: every image is stored once under its sha256, and an index
+    maps ImageKey -> sha256.
+
+    Args:
+        cache_dir (str): Folder of the objects and of index.json.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = {ImageKey(*key): digest for key, digest in json.load(f)}
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    def get(self, key):
+        """
+        Path of the cached image for key, None when it isn't cached.
+        """
+        with self.lock:
+            digest = self.index.get(key)
+        if digest is None:
+            return None
+        path = self.object_path(digest)
+        return path if os.path.exists(path) else None
+
+    def put(self, key, data):
+        """
+        Store an image's bytes for key and return its path.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.index[key] = digest
+        return path
+
+    def save(self):
+        with self.lock:
+            items = [[list(key), digest] for key, digest in self.index.items()]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        os.replace(tmp_path, self.index_path)
+
+
+class ZipFetcher:
+    """
+    Fetch frames out of a zip of Street View images (e.g. ALL_GSV.zip), by the key their names encode.
+    """
+
+    def __init__(self, zip_path):
+        # No in-memory cache, fetched images go to the ImageCache
+        self.store = ZipImageStore(zip_path, cache_bytes=0)
+        self.names = {}
+        for basename in self.store.index:
+            key = parse_image_name(basename)
+            if key is not None:
+                self.names.setdefault(key, basename)
+
+    def __call__(self, key):
+        basename = self.names.get(key)
+        found = basename and self.store.get(basename)
+        if not found:
+            raise ImageNotFound(key)
+        return found[0]
+
+
+class HttpFetcher:
+    """
+    Fetch frames over HTTP from a Street View-like endpoint.
+
+    Args:
+        url_template (str): URL with {lat}, {lon}, {heading} and {fov} fields, e.g.
+            "http://localhost:8000/streetview?location={lat},{lon}&heading={heading}&fov={fov}".
+        timeout (float): Seconds per request.
+    """
+
+    def __init__(self, url_template, timeout=30):
+        self.url_template = url_template
+        self.timeout = timeout
+
+    def __call__(self, key):
+        url = self.url_template.format(**key._asdict())
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise ImageNotFound(key) from e
+            raise
+
+
+class ImageStore:
+    """
+    Images by ImageKey: from the local cache, else from the fetcher, fetched in a bounded
+    thread pool with retries. Concurrent requests for the same key share one fetch.
+
+    Args:
+        fetcher (callable): key -> image bytes, raising ImageNotFound for missing images
+            (see ZipFetcher and HttpFetcher).
+        cache (ImageCache | None): Local cache, ImageCache() by default.
+        max_workers (int): Concurrent fetches.
+        retries (int): Extra attempts after a failed fetch.
+        backoff (float): Seconds before the first retry, doubled for every next one.
+    """
+
+    def __init__(self, fetcher, cache=None, max_workers=8, retries=3, backoff=0.5):
+        self.fetcher = fetcher
+        self.cache = cache or ImageCache()
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Reentrant: a future that is already done runs its callback inside submit
+        self.lock = threading.RLock()
+        self.in_flight = {}
+
+    def close(self):
+        self.executor.shutdown()
+        self.cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _fetch(self, key):
+        path = self.cache.get(key)
+        if path is not None:
+            return path
+        for attempt in range(self.retries + 1):
+            try:
+                return self.cache.put(key, self.fetcher(key))
+            except ImageNotFound:
+                return None
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying {key}: {e}")
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def submit(self, key):
+        """
+        Future of key's cached image path (None when the fetcher has no image for it).
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.in_flight[key] = self.executor.submit(self._fetch, key)
+                future.add_done_callback(lambda _, key=key: self._done(key))
+            return future
+
+    def _done(self, key):
+        with self.lock:
+            self.in_flight.pop(key, None)
+
+    def get(self, key):
+        return self.submit(key).result()
+
+    def get_many(self, keys):
+        """
+        Fetch keys in parallel.
+
+        Returns:
+            dict: key -> cached image path, None for images the fetcher doesn't have or that
+            still failed after the retries.
+        """
+        futures = {key: self.submit(key) for key in dict.fromkeys(keys)}
+        paths = {}
+        for key, future in futures.items():
+            try:
+                paths[key] = future.result()
+            except Exception as e:
+                print(f"❌ Failed to fetch {key}: {e}")
+                paths[key] = None
+        return paths
+
+
+def assemble_images(file_names, output_dir, store):
+    """
+    Put copies of the frames of the given file names into output_dir under those names,
+    fetching the ones that aren't cached. Copies rather than links, so editing an assembled
+    image can't change the cached object other keys and runs share.
+
+    Returns:
+        list: The file names no image was found for.
+    """
+    keys = {}
+    missing = []
+    for name in dict.fromkeys(os.path.basename(name) for name in file_names):
+        key = parse_image_name(name)
+        if key is None:
+            missing.append(name)
+        else:
+            keys[name] = key
+
+    paths = store.get_many(keys.values())
+    os.makedirs(output_dir, exist_ok=True)
+    assembled = 0
+    for name, key in keys.items():
+        source = paths[key]
+        if source is None:
+            missing.append(name)
+            continue
+        target = os.path.join(output_dir, name)
+        if os.path.exists(target):
+            # Also breaks a link to the cache left by an older run
+            os.remove(target)
+        shutil.copyfile(source, target)
+        assembled += 1
+    print(f"Assembled {assembled} images in {output_dir}, {len(missing)} missing")
+    return missing
+
+
+if __name__ == '__main__':
+    survey_path = "nadav_output_meters_divide=100000_angle_divide=3_y_times=12_y_exponent=2_count_distinct_trees=608.xlsx"
+    zip_path = "ALL_GSV.zip"
+    output_dir = "images_to_download"
+    file_names = pd.read_excel(survey_path, usecols=["file_name"])["file_name"]
+    with ImageStore(ZipFetcher(zip_path)) as store:
+        for name in assemble_images(file_names, output_dir, store):
+            print(f"❌ {name}")
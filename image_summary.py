@@ -0,0 +1,182 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Quantiles of the matched images' best angle diff splitting them into low / mid / high buckets
+ANGLE_BUCKET_QUANTILES = (0.1, 0.9)
+
+# angle_bucket values
+UNMATCHED, LOW_ANGLE_DIFF, MID_ANGLE_DIFF, HIGH_ANGLE_DIFF = -1, 0, 1, 2
+
+
+def group_rows_by_image(df):
+    """
+    Return df with the rows of every file_name contiguous, images in order of first appearance
+    and rows in their original order within an image. Survey outputs already are, and are
+    returned as they are.
+    """
+    order = image_order(df)
+    return df if order is None else df.iloc[order]
+
+
+def image_order(df):
+    """
+    Row positions of df as group_rows_by_image orders them, None when df already is grouped.
+    Positions in the grouped frame map back to df's as order[positions].
+    """
+    codes, _ = pd.factorize(df['file_name'])
+    # Codes are numbered by first appearance, contiguous images never go back to a lower one
+    if not len(codes) or (codes[1:] >= codes[:-1]).all():
+        return None
+    return np.argsort(codes, kind='stable')
+
+
+def summarize_images(df, quantiles=ANGLE_BUCKET_QUANTILES):
+    """
+    Build the per-image summary table of a cleaned survey, one row per file_name.
+
+    The rows of every image must be contiguous, as in the survey outputs (see
+    group_rows_by_image), so an image's rows are first_row:first_row + n_detections.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey (see clean_data_before_json.clean_df).
+        quantiles (tuple): (low, high) quantiles of the matched images' best_angle_diff
+            bounding the angle_bucket's middle bucket.
+
+    Returns:
+        pd.DataFrame: file_name, first_row, n_detections, n_matched, matched, best_angle_diff,
+        worst_angle_diff, n_candidates (the image's possible_trees, repeated on every one of its
+        rows in the survey outputs), second_best (a match with a runner-up, see _has_second_best),
+        x_image, y_image, heading, n_segmented (the count prefix of file_name_with_detections, 0
+        without one) and angle_bucket, in the images' order in df.
+    """
+    file_names = df['file_name'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, file_names[1:] != file_names[:-1]]) if len(df) else np.array([], int)
+    n_detections = np.diff(np.r_[starts, len(df)])
+    image_names = file_names[starts]
+    if len(pd.unique(image_names)) != len(image_names):
+        raise ValueError("the rows of every file_name must be contiguous, see group_rows_by_image")
+
+    matched_rows = df['tree_id'].notna().to_numpy()
+    angle_diff = pd.to_numeric(df['best_angle_diff'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    angle_diff = np.where(matched_rows, angle_diff, np.nan)
+    candidates = pd.to_numeric(df['possible_trees'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    second_best_rows = matched_rows & _has_second_best(df)
+
+    def per_image(values, reduce):
+        if not len(starts):
+            return values[:0]
+        return reduce.reduceat(values, starts)
+
+    def first_of_image(column):
+        return df[column].to_numpy()[starts] if column in df.columns else np.full(len(starts), np.nan)
+
+    best = per_image(np.where(np.isnan(angle_diff), np.inf, angle_diff), np.minimum)
+    worst = per_image(np.where(np.isnan(angle_diff), -np.inf, angle_diff), np.maximum)
+    summary = pd.DataFrame({
+        'file_name': image_names,
+        'first_row': starts,
+        'n_detections': n_detections,
+        'n_matched': per_image(matched_rows.astype(np.int64), np.add),
+        'best_angle_diff': np.where(np.isinf(best), np.nan, best),
+        'worst_angle_diff': np.where(np.isinf(worst), np.nan, worst),
+        'n_candidates': per_image(candidates, np.maximum),
+        'second_best': per_image(second_best_rows, np.logical_or).astype(bool),
+        'x_image': first_of_image('x_image'),
+        'y_image': first_of_image('y_image'),
+        'heading': first_of_image('heading'),
+        'n_segmented': _segmented_counts(first_of_image('file_name_with_detections')),
+    })
+    summary.insert(4, 'matched', summary['n_matched'] > 0)
+    summary['angle_bucket'] = angle_buckets(summary, quantiles)
+    return summary
+
+
+def _segmented_counts(names):
+    # "/data/detected_images/3_segmented_<file_name>" -> 3, like the report's legend
+    prefixes = pd.Series(names, dtype=object).map(
+        lambda name: os.path.basename(name).split("_")[0] if isinstance(name, str) else "")
+    return pd.to_numeric(prefixes.where(prefixes.str.isdigit(), "0")).to_numpy(dtype=np.int64)
+
+
+def _has_second_best(df):
+    """
+    Rows whose match has a runner-up, from matched_details' second_best_match_tree. Without
+    matched_details (survey outputs that weren't rematched) no row is known to have one.
+    """
+    if 'matched_details' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df['matched_details'].map(
+        lambda x: isinstance(x, dict) and x.get('second_best_match_tree') is not None).to_numpy(dtype=bool)
+
+
+def angle_buckets(summary, quantiles=ANGLE_BUCKET_QUANTILES):
+    """
+    LOW_ANGLE_DIFF / MID_ANGLE_DIFF / HIGH_ANGLE_DIFF by the quantiles of the matched images'
+    best_angle_diff, UNMATCHED for images without a match (or without an angle diff).
+    """
+    angle_diff = summary['best_angle_diff'].to_numpy(dtype=np.float64)
+    known = summary['matched'].to_numpy() & ~np.isnan(angle_diff)
+    buckets = np.full(len(summary), UNMATCHED, dtype=np.int8)
+    if known.any():
+        low, high = np.quantile(angle_diff[known], quantiles)
+        buckets[known] = np.where(angle_diff[known] < low, LOW_ANGLE_DIFF,
+                                  np.where(angle_diff[known] > high, HIGH_ANGLE_DIFF, MID_ANGLE_DIFF))
+    return buckets
+
+
+def sample_images(summary, n, by=('matched', 'angle_bucket', 'second_best'), seed=42):
+    """
+    Stratified sample of images, without replacement, in one vectorized pass.
+
+    Every image gets a random key; within each stratum (a distinct combination of the by
+    columns) the images with the smallest keys are taken. The same seed gives the same sample.
+
+    Args:
+        summary (pd.DataFrame): Per-image summary (see summarize_images).
+        n (int | dict): Images per stratum, or {stratum: images} with strata as tuples of the by
+            values (a bare value when by has one column). Missing strata get none. Strata with
+            fewer images are taken whole.
+        by (tuple): Summary columns defining the strata, () for a simple random sample.
+        seed (int): Random seed.
+
+    Returns:
+        np.ndarray: Sorted positions of the sampled images in summary.
+    """
+    by = list(by)
+    if not by:
+        stratum_codes, strata = np.zeros(len(summary), dtype=np.int64), [()]
+    elif len(by) == 1:
+        stratum_codes, strata = pd.factorize(summary[by[0]])
+    else:
+        stratum_codes, strata = pd.MultiIndex.from_frame(summary[by]).factorize()
+    if isinstance(n, dict):
+        quota = np.array([n.get(stratum, 0) for stratum in strata], dtype=np.int64)
+    else:
+        quota = np.full(len(strata), n, dtype=np.int64)
+
+    random_keys = np.random.default_rng(seed).random(len(summary))
+    order = np.lexsort((random_keys, stratum_codes))
+    sorted_codes = stratum_codes[order]
+    stratum_starts = np.searchsorted(sorted_codes, np.arange(len(strata)))
+    rank = np.arange(len(order)) - stratum_starts[sorted_codes]
+    return np.sort(order[rank < quota[sorted_codes]])
+
+
+def image_rows(summary, images):
+    """
+    Row positions, in the summarized frame, of the given images.
+
+    Args:
+        summary (pd.DataFrame): Per-image summary (see summarize_images).
+        images (np.ndarray): Positions of images in summary, e.g. from sample_images.
+
+    Returns:
+        np.ndarray: Sorted row positions, for df.iloc / df.take.
+    """
+    images = np.sort(np.asarray(images, dtype=np.int64))
+    starts = summary['first_row'].to_numpy()[images]
+    counts = summary['n_detections'].to_numpy()[images]
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + within
@@ -1,20 +1,42 @@
-import ast
+import argparse
+import hashlib
+import json
 import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from urllib.parse import quote
 
 import folium
+import numpy as np
 import pandas as pd
 from folium import Element
 
-from clean_data_before_json import clean_df
+from clean_data_before_json import clean_df, parse_additional_matches_column
+from image_summary import group_rows_by_image, summarize_images
+from profiling import RunLog, recording, stage, timed_stage
+from survey_cache import REPORT_COLUMNS, iter_survey_chunks, load_clean_survey, load_raw_survey
+from survey_comparison import (AGREEMENT_LABELS, BOTH_UNMATCHED, SAME_TREE, agreement_stats, align_surveys,
+                               disagreeing_images, partial_images)
+from thumbnails import THUMBNAIL_WIDTHS, build_thumbnails
 
 colors_dict = {1: (230, 25, 75), 2: (60, 180, 75), 3: (255, 225, 25), 4: (0, 130, 200), 5: (245, 130, 49),
                6: (145, 30, 180), 7: (70, 240, 240), 8: (240, 50, 230), 9: (210, 245, 60), 10: (250, 190, 190),
                11: (0, 128, 128), 12: (230, 190, 255), 13: (170, 110, 40), 14: (255, 250, 200), 15: (128, 0, 0),
                16: (170, 255, 195)}
 
+# Inputs of the report when main_3 is run without arguments
+DEFAULT_TLV_SURVEY = "nadav_output_meters_divide=100000_angle_divide=3_y_times=12_y_exponent=2_count_distinct_trees=608.xlsx"
+DEFAULT_SMALL_SURVEY = "tree_small_survey_output_meters_divide=100000_angle_divide=3_y_times=12_y_exponent=2_count_distinct_trees=0.xlsx"
+DEFAULT_IMAGES_FOLDER = "detected_images/tree_nadav_merged"
+
+# Bump when generate_map/render_case_column output changes, so maps rendered by older code are redone
+RENDER_VERSION = 2
+
+# Fingerprint of the input rows of every map on disk, see render_maps
+maps_manifest_path = "maps/manifest.json"
+
 # Add legend as an HTML element
 legend_html = """
 <div style="
@@ -39,103 +61,8 @@ box-shadow: 3px 3px 5px rgba(0,0,0,0.5);
 """
 
 
-def render_case_column(filtered_df, detected_images_folder, left_or_right=""):
-    """
-    Given a filtered_df for one file_name, produce the HTML
-    for: map iframe, image-with-detections, and details.
-    """
-    html = []
-
-    # 1) Map (half-width wrapper is handled by parent .left/.right)
-    map_path = generate_map(filtered_df, left_or_right)
-    html.append(
-        "<div style='margin-bottom:20px;'>"
-        f"<iframe src='{map_path}' width='100%' height='500px'></iframe>"
-        "</div>"
-    )
-
-    # 2) Detected image
-    full_path = filtered_df.iloc[0]['file_name_with_detections']
-    fname = Path(full_path).name
-    img_url = quote((Path(detected_images_folder) / fname).as_posix())
-    html.append(f"<img src='{img_url}' loading='lazy' alt='Detected Image'>")
-
-    # 3) Details
-    html.append("<div class='details'>")
-    # — matched trees
-    for _, row in filtered_df.iterrows():
-        if pd.isna(row['tree_id']):
-            continue
-        html.append(
-            "<p>"
-            "<strong>Detection Tree With Match:</strong><br>"
-            f"Tree Index: {row['tree_index']}<br>"
-            f"Location: ({row['x_tree_image']}, {row['y_tree_image']})<br>"
-            f"Real Angle (rad): {row['real_angle']:.5f}<br>"
-            f"Angle Difference (deg): {row['best_angle_diff']:.5f}<br>"
-            "<strong>Best Match (Seker):</strong><br>"
-            f"Tree ID: {int(row['tree_id'])}<br>"
-            f"Tree Name: {row['tree_name']}<br>"
-            f"Location: ({row['x_tree']}, {row['y_tree']})<br>"
-            "</p>"
-        )
-    # — unmatched detections
-    unmatched = [
-        (r['tree_index'], r['real_angle'], r['x_tree_image'], r['y_tree_image'])
-        for _, r in filtered_df.iterrows() if pd.isna(r['tree_id'])
-    ]
-    if unmatched:
-        html.append("<strong>Detection Trees Without Match</strong>")
-        for idx, ang, x_img, y_img in unmatched:
-            html.append(
-                "<p>"
-                f"Tree Index: {idx}<br>"
-                f"Real Angle (rad): {ang:.5f}<br>"
-                f"Location: ({x_img}, {y_img})<br>"
-                "</p>"
-            )
-    # additional Seker matches
-    # ensure it's a real list, not a string
-    filtered_df.loc[:, 'additional_matches'] = filtered_df['additional_matches'].apply(
-        lambda x: ast.literal_eval(x.replace('nan', 'None')) if isinstance(x, str) else x
-    )
-    extras = filtered_df.iloc[0]['additional_matches']
-    if extras:
-        html.append("<strong>Potential Seker Trees:</strong>")
-        valid_ids = set(
-            filtered_df['tree_id']
-            .dropna()  # remove NaNs
-            .astype(int)  # cast to ints
-            .tolist()  # make a Python list
-        )
-        for m in extras:
-            if m['id'] not in valid_ids:
-                html.append(
-                    "<p>"
-                    f"ID: {m['id']}<br>"
-                    f"Tree Name: {m['tree_name']}<br>"
-                    f"Location: ({m['location_x']}, {m['location_y']})<br>"
-                    "</p>"
-                )
-
-    html.append("</div>")  # close .details
-
-    return "\n".join(html)
-
-
-def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, output_html_file,
-                                        df_small_survey=pd.DataFrame()):
-    """
-    Generate an HTML file displaying image details and maps for each file_name in the dataframe.
-
-    Args:
-        df_tlv_survey (pd.DataFrame): DataFrame containing the necessary details.
-        detected_images_folder (str): Path to the folder containing detected images.
-        output_html_file (str): Path to save the generated HTML file.
-        df_small_survey (pd.DataFrame)
-    """
-    # Start the HTML file content
-    html = """
+# Page head: styles and Leaflet
+report_head_html = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -198,7 +125,10 @@ def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, o
         <script defer src="https://code.jquery.com/jquery-3.7.1.min.js"></script>
         <script defer src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
 
-        <script>
+"""
+
+# Prev/Next navigation over the file-sections of the page
+case_navigation_script_html = """        <script>
             document.addEventListener("DOMContentLoaded", function () {
                 let currentIndex = 0;
                 const fileSections = document.querySelectorAll(".file-section");
@@ -218,6 +148,7 @@ def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, o
                     nextBtn.disabled = index === totalCases - 1;
     
                     updateProgress(index, totalCases);
+                    document.dispatchEvent(new CustomEvent("casechange", {detail: {section: fileSections[index]}}));
                 }
     
                 function nextCase() {
@@ -245,7 +176,136 @@ def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, o
                 showCase(currentIndex);
             });
         </script>
-    </head>
+"""
+
+# Sharded mode: Prev/Next over every case of the report, loading the shard holding the case on demand.
+# Shards are <script> files (no fetch, so the report also works from file://) and only the shown
+# shard's sections are in the DOM.
+sharded_navigation_script_html = """        <script>
+            document.addEventListener("DOMContentLoaded", function () {
+                const manifest = JSON.parse(document.getElementById("shardManifest").textContent);
+                const container = document.getElementById("cases");
+                const totalCases = manifest.total;
+                const progressBar = document.getElementById("progressBar");
+                const progressText = document.getElementById("progress");
+                const prevBtn = document.getElementById("prevBtn");
+                const nextBtn = document.getElementById("nextBtn");
+
+                // Index of the first case of every shard
+                const starts = [];
+                manifest.shards.reduce(function (start, shard) {
+                    starts.push(start);
+                    return start + shard.count;
+                }, 0);
+
+                const shards = {};
+                const waiting = {};
+                let currentIndex = 0;
+                let shownShard = -1;
+                let sections = [];
+
+                window.reportShardLoaded = function (shard, html) {
+                    if (waiting[shard]) {
+                        waiting[shard](html);
+                        delete waiting[shard];
+                    }
+                };
+
+                function loadShard(shard) {
+                    if (!shards[shard]) {
+                        shards[shard] = new Promise(function (resolve, reject) {
+                            waiting[shard] = resolve;
+                            const script = document.createElement("script");
+                            script.src = manifest.shards[shard].src;
+                            script.onload = function () { script.remove(); };
+                            script.onerror = function () {
+                                script.remove();
+                                delete shards[shard];
+                                reject(new Error("Could not load " + script.src));
+                            };
+                            document.head.appendChild(script);
+                        });
+                    }
+                    // Only the shards next to the requested one stay in memory
+                    Object.keys(shards).forEach(function (key) {
+                        if (Math.abs(key - shard) > 1) {
+                            delete shards[key];
+                        }
+                    });
+                    return shards[shard];
+                }
+
+                function shardOf(index) {
+                    let shard = starts.length - 1;
+                    while (starts[shard] > index) {
+                        shard--;
+                    }
+                    return shard;
+                }
+
+                function updateButtons(index) {
+                    prevBtn.disabled = index === 0;
+                    nextBtn.disabled = index === totalCases - 1;
+                }
+
+                function showCase(index) {
+                    const shard = shardOf(index);
+                    prevBtn.disabled = true;
+                    nextBtn.disabled = true;
+                    loadShard(shard).then(function (html) {
+                        if (shard !== shownShard) {
+                            container.innerHTML = html;
+                            sections = container.querySelectorAll(".file-section");
+                            shownShard = shard;
+                        }
+                        const offset = index - starts[shard];
+                        sections.forEach((section, i) => {
+                            section.style.display = i === offset ? "block" : "none";
+                        });
+
+                        progressText.innerText = `Case ${index + 1} of ${totalCases}`;
+                        progressBar.value = ((index + 1) / totalCases) * 100;
+                        updateButtons(index);
+
+                        if (shard + 1 < starts.length) {
+                            loadShard(shard + 1);
+                        }
+                        document.dispatchEvent(new CustomEvent("casechange", {detail: {section: sections[offset]}}));
+                    }).catch(function (error) {
+                        progressText.innerText = error.message;
+                        updateButtons(index);
+                    });
+                }
+
+                function nextCase() {
+                    if (currentIndex < totalCases - 1) {
+                        currentIndex++;
+                        showCase(currentIndex);
+                    }
+                }
+
+                function prevCase() {
+                    if (currentIndex > 0) {
+                        currentIndex--;
+                        showCase(currentIndex);
+                    }
+                }
+
+                prevBtn.addEventListener("click", prevCase);
+                nextBtn.addEventListener("click", nextCase);
+
+                if (totalCases > 0) {
+                    showCase(currentIndex);
+                } else {
+                    progressText.innerText = "No cases";
+                    nextBtn.disabled = true;
+                }
+            });
+        </script>
+"""
+
+# Progress bar and Prev/Next buttons
+report_body_start_html = """    </head>
     <body>
         <h1>Detections and Matches</h1>
         <div style="text-align: center; margin-bottom: 20px;">
@@ -255,173 +315,1266 @@ def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, o
             <button id="nextBtn">Next</button>
         </div>
     """
-    # Process each file_name
-    unique_files = df_tlv_survey['file_name'].unique()[:200]
-
-    for file_name in unique_files:
-        # Filter rows for the current file_name
-        tlv = df_tlv_survey[df_tlv_survey['file_name'] == file_name]
-        if df_small_survey.empty:
-            # Skip if no detections or no matches in either
-            if (tlv['possible_trees'].astype(int).eq(0).all() or tlv['tree_id'].isna().all()):
-                continue
-        else:
-            small = df_small_survey[df_small_survey['file_name'] == file_name]
 
-            # Skip if no detections or no matches in either
-            if ((tlv['possible_trees'].astype(int).eq(0).all() and small['possible_trees'].astype(int).eq(0).all())
-                    or (tlv['tree_id'].isna().all() and small['tree_id'].isna().all())):
-                continue
+report_header_html = report_head_html + case_navigation_script_html + report_body_start_html
+
+# Shared-map mode: one Leaflet map per column, moved into the visible case and redrawn from its payload
+shared_map_script_html = """
+    <style>
+        .shared-map { width: 100%; height: 500px; }
+        .shared-map-legend { background: white; padding: 6px 8px; border: 2px solid grey; border-radius: 8px; }
+        .shared-map-legend span { display: inline-block; width: 12px; height: 12px; border-radius: 6px; margin-right: 5px; }
+    </style>
+    <script>
+        (function () {
+            const colors = {car: "orange", best: "green", additional: "blue"};
+            const maps = {};
 
-        # File title + legend (shared)
-        html += "<div class='file-section' style='display:none;'>"
-        html += f"<div class='file-title'>File: {file_name}</div>"
-
-        # Legend
-        fname = Path(tlv.iloc[0]['file_name_with_detections']).name
-        num_det = int(fname.split("_")[0]) if fname.split("_")[0].isdigit() else 0
-        html += "<div class='legend'><strong>Legend:</strong><br>"
-        for i in range(1, num_det + 1):
-            idx = (i - 1) % 16 + 1
-            r, g, b = colors_dict[idx]
-            html += (
-                f"<span style='display:inline-block;width:20px;height:20px;"
-                f"background-color:rgb({r},{g},{b});margin-right:5px;'></span>"
-                f"Tree index {i}<br>"
+            function sharedMap(side, slot) {
+                if (!maps[side]) {
+                    const container = document.createElement("div");
+                    container.className = "shared-map";
+                    slot.appendChild(container);
+                    const map = L.map(container);
+                    L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+                        maxZoom: 19,
+                        attribution: "&copy; OpenStreetMap contributors"
+                    }).addTo(map);
+                    const legend = L.control({position: "bottomleft"});
+                    legend.onAdd = function () {
+                        const div = L.DomUtil.create("div", "shared-map-legend");
+                        div.innerHTML = "<b>Legend</b><br>" +
+                            "<span style='background:orange'></span>Car location<br>" +
+                            "<span style='background:green'></span>Seker best match<br>" +
+                            "<span style='background:blue'></span>Seker additional match";
+                        return div;
+                    };
+                    legend.addTo(map);
+                    maps[side] = {container: container, map: map, layer: L.layerGroup().addTo(map)};
+                }
+                slot.appendChild(maps[side].container);
+                return maps[side];
+            }
+
+            function marker(lat, lon, kind) {
+                if (window.L.AwesomeMarkers) {
+                    return L.marker([lat, lon], {icon: L.AwesomeMarkers.icon({markerColor: colors[kind], icon: "info-sign"})});
+                }
+                return L.circleMarker([lat, lon], {radius: 7, color: colors[kind], fillOpacity: 0.9});
+            }
+
+            document.addEventListener("casechange", function (event) {
+                event.detail.section.querySelectorAll(".map-slot").forEach(function (slot) {
+                    const payload = JSON.parse(slot.querySelector("script").textContent);
+                    const shared = sharedMap(slot.dataset.side, slot);
+                    shared.layer.clearLayers();
+                    // Missing coordinates are null in the payload and can't be drawn
+                    const located = function (point) {
+                        return point[0] !== null && point[1] !== null;
+                    };
+                    payload.markers.filter(located).forEach(function (m) {
+                        marker(m[0], m[1], m[2]).bindPopup(m[3]).addTo(shared.layer);
+                    });
+                    payload.lines.filter(function (l) {
+                        return located(l[0]) && located(l[1]);
+                    }).forEach(function (l) {
+                        L.polyline([l[0], l[1]], {color: "black", weight: 2}).bindPopup(l[2]).addTo(shared.layer);
+                    });
+                    shared.map.invalidateSize();
+                    if (located(payload.center)) {
+                        shared.map.setView(payload.center, 15);
+                    }
+                });
+            });
+        })();
+    </script>
+"""
+
+# Thumbnail mode: start loading the next case's image while the current one is reviewed
+thumbnail_prefetch_script_html = """
+    <script>
+        document.addEventListener("casechange", function (event) {
+            let next = event.detail.section.nextElementSibling;
+            while (next && !next.classList.contains("file-section")) {
+                next = next.nextElementSibling;
+            }
+            if (next) {
+                next.querySelectorAll("img[loading='lazy']").forEach(function (img) {
+                    img.loading = "eager";
+                });
+            }
+        });
+    </script>
+"""
+
+
+def case_image_path(filtered_df, detected_images_folder):
+    """
+    Path of the image-with-detections of one file_name, as referenced by the report.
+    """
+    fname = Path(filtered_df.iloc[0]['file_name_with_detections']).name
+    return (Path(detected_images_folder) / fname).as_posix()
+
+
+def render_case_column(filtered_df, detected_images_folder, left_or_right="", map_path=None, map_payload=None,
+                       thumbnails=None):
+    """
+    Given a filtered_df for one file_name, produce the HTML
+    for: map iframe, image-with-detections, and details.
+    The map is generated here unless an already rendered map_path is given. With a
+    map_payload (see build_map_payload) the shared report map is used instead of an iframe.
+    thumbnails (see build_thumbnails) swaps the full image for its downscaled variants,
+    linking to the full image.
+    """
+    html = []
+
+    # 1) Map (half-width wrapper is handled by parent .left/.right)
+    if map_payload is not None:
+        payload_json = json.dumps(json_safe(map_payload), ensure_ascii=False, separators=(',', ':'),
+                                  allow_nan=False).replace("</", "<\\/")
+        html.append(
+            f"<div class='map-slot' data-side='{left_or_right}' style='margin-bottom:20px;'>"
+            f"<script type='application/json'>{payload_json}</script>"
+            "</div>"
+        )
+    else:
+        if map_path is None:
+            map_path = generate_map(filtered_df, left_or_right)
+        html.append(
+            "<div style='margin-bottom:20px;'>"
+            f"<iframe src='{map_path}' width='100%' height='500px'></iframe>"
+            "</div>"
+        )
+
+    # 2) Detected image
+    image_path = case_image_path(filtered_df, detected_images_folder)
+    img_url = quote(image_path)
+    variants = (thumbnails or {}).get(image_path)
+    if variants:
+        srcset = ", ".join(f"{quote(Path(path).as_posix())} {width}w" for path, width in variants)
+        html.append(
+            f"<a href='{img_url}' target='_blank'>"
+            f"<img src='{quote(Path(variants[-1][0]).as_posix())}' srcset='{srcset}' "
+            "sizes='(max-width: 800px) 100vw, 50vw' loading='lazy' alt='Detected Image'>"
+            "</a>"
+        )
+    else:
+        html.append(f"<img src='{img_url}' loading='lazy' alt='Detected Image'>")
+
+    # 3) Details
+    html.append("<div class='details'>")
+    # — matched trees
+    rows = case_rows(filtered_df, ['tree_id', 'tree_index', 'x_tree_image', 'y_tree_image', 'real_angle',
+                                   'best_angle_diff', 'tree_name', 'x_tree', 'y_tree'])
+    for tree_id, tree_index, x_tree_image, y_tree_image, real_angle, angle_diff, tree_name, x_tree, y_tree in rows:
+        if pd.isna(tree_id):
+            continue
+        html.append(
+            "<p>"
+            "<strong>Detection Tree With Match:</strong><br>"
+            f"Tree Index: {tree_index}<br>"
+            f"Location: ({x_tree_image}, {y_tree_image})<br>"
+            f"Real Angle (rad): {real_angle:.5f}<br>"
+            f"Angle Difference (deg): {angle_diff:.5f}<br>"
+            "<strong>Best Match (Seker):</strong><br>"
+            f"Tree ID: {int(tree_id)}<br>"
+            f"Tree Name: {tree_name}<br>"
+            f"Location: ({x_tree}, {y_tree})<br>"
+            "</p>"
+        )
+    # — unmatched detections
+    unmatched = [(row[1], row[4], row[2], row[3]) for row in rows if pd.isna(row[0])]
+    if unmatched:
+        html.append("<strong>Detection Trees Without Match</strong>")
+        for idx, ang, x_img, y_img in unmatched:
+            html.append(
+                "<p>"
+                f"Tree Index: {idx}<br>"
+                f"Real Angle (rad): {ang:.5f}<br>"
+                f"Location: ({x_img}, {y_img})<br>"
+                "</p>"
             )
-        html += "</div>"
+    # additional Seker matches
+    # ensure it's a real list, not a string
+    filtered_df.loc[:, 'additional_matches'] = parse_additional_matches_column(filtered_df['additional_matches'])
+    extras = filtered_df.iloc[0]['additional_matches']
+    if extras:
+        html.append("<strong>Potential Seker Trees:</strong>")
+        valid_ids = set(
+            filtered_df['tree_id']
+            .dropna()  # remove NaNs
+            .astype(int)  # cast to ints
+            .tolist()  # make a Python list
+        )
+        for m in extras:
+            if m['id'] not in valid_ids:
+                html.append(
+                    "<p>"
+                    f"ID: {m['id']}<br>"
+                    f"Tree Name: {m['tree_name']}<br>"
+                    f"Location: ({m['location_x']}, {m['location_y']})<br>"
+                    "</p>"
+                )
+
+    html.append("</div>")  # close .details
+
+    return "\n".join(html)
+
+
+def partition_by_file_name(df):
+    """
+    Split a survey into one DataFrame per file_name in a single pass.
+
+    Returns:
+        dict: file_name -> rows of that image, in their original order.
+    """
+    return {file_name: group for file_name, group in df.groupby('file_name', sort=False, observed=True)}
+
+
+def detection_legend_html(filtered_df):
+    """
+    Legend of the tree index colors drawn on the image-with-detections of one file_name.
+    """
+    html = []
+    fname = Path(filtered_df.iloc[0]['file_name_with_detections']).name
+    num_det = int(fname.split("_")[0]) if fname.split("_")[0].isdigit() else 0
+    html.append("<div class='legend'><strong>Legend:</strong><br>")
+    for i in range(1, num_det + 1):
+        idx = (i - 1) % 16 + 1
+        r, g, b = colors_dict[idx]
+        html.append(
+            f"<span style='display:inline-block;width:20px;height:20px;"
+            f"background-color:rgb({r},{g},{b});margin-right:5px;'></span>"
+            f"Tree index {i}<br>"
+        )
+    html.append("</div>")
+    return "".join(html)
+
+
+@timed_stage()
+def render_file_section(file_name, tlv, small, detected_images_folder, map_paths=(None, None),
+                        map_payloads=(None, None), thumbnails=None):
+    """
+    Produce the HTML of one file-section: title, legend and the TLV/small survey columns.
+    small is None when there is no small survey to compare with, map_paths holds the
+    pre-rendered (left, right) maps, map_payloads the (left, right) shared-map payloads and
+    thumbnails the image variants if any.
+    """
+    html = []
 
-        # Two-column: TLV on left, small on right
-        html += "<div class='row'>"
+    # File title + legend (shared)
+    html.append("<div class='file-section' style='display:none;'>")
+    html.append(f"<div class='file-title'>File: {file_name}</div>")
 
-        html += "<div class='left'>"
-        html += "<h3>TLV Survey</h3>"
-        html += render_case_column(tlv, detected_images_folder, "left")
-        html += "</div>"
+    # Legend
+    html.append(detection_legend_html(tlv))
 
-        if not df_small_survey.empty:
-            html += "<div class='right'>"
-            html += "<h3>Small Survey</h3>"
-            html += render_case_column(small, detected_images_folder, "right")
-            html += "</div>"
+    # Two-column: TLV on left, small on right
+    html.append("<div class='row'>")
 
-        html += "</div>"  # close .row
+    html.append("<div class='left'>")
+    html.append("<h3>TLV Survey</h3>")
+    html.append(render_case_column(tlv, detected_images_folder, "left", map_paths[0], map_payloads[0],
+                                       thumbnails))
+    html.append("</div>")
 
-        html += "</div>"  # Close file-section
+    if small is not None:
+        html.append("<div class='right'>")
+        html.append("<h3>Small Survey</h3>")
+        html.append(render_case_column(small, detected_images_folder, "right", map_paths[1], map_payloads[1],
+                                           thumbnails))
+        html.append("</div>")
 
-    html += "</body></html>"
+    html.append("</div>")  # close .row
+
+    html.append("</div>")  # Close file-section
+
+    return "".join(html)
+
+
+def iter_report_cases(df_tlv_survey, df_small_survey=pd.DataFrame(), max_images=200, tlv_summary=None,
+                      small_summary=None):
+    """
+    Yield (file_name, tlv_rows, small_rows) for every image that goes into the report.
+    small_rows is None when there is no small survey.
+
+    tlv_summary and small_summary are the per-image summaries of the surveys (see
+    summarize_images, e.g. from load_clean_survey(..., with_summary=True)), computed from
+    the rows when None.
+    """
+    # Process each file_name
+    unique_files = df_tlv_survey['file_name'].unique()[:max_images]
+
+    # Skip images without detections or without matches (in either survey), from the
+    # per-image summaries instead of every image's rows
+    tlv_counts = survey_image_counts(df_tlv_survey, unique_files, summary=tlv_summary)
+    if df_small_survey.empty:
+        keep = (tlv_counts['n_candidates'] > 0) & (tlv_counts['n_matched'] > 0)
+    else:
+        small_counts = survey_image_counts(df_small_survey, unique_files, summary=small_summary)
+        keep = (((tlv_counts['n_candidates'] > 0) | (small_counts['n_candidates'] > 0))
+                & ((tlv_counts['n_matched'] > 0) | (small_counts['n_matched'] > 0)))
+    kept_files = unique_files[keep.to_numpy()]
+
+    # Index both surveys by file_name once instead of filtering the whole frame per image
+    tlv_by_file = partition_by_file_name(df_tlv_survey)
+    small_by_file = {} if df_small_survey.empty else partition_by_file_name(df_small_survey)
+
+    for file_name in kept_files:
+        # Rows for the current file_name
+        tlv = tlv_by_file.get(file_name, df_tlv_survey.iloc[0:0])
+        small = None if df_small_survey.empty else small_by_file.get(file_name, df_small_survey.iloc[0:0])
+        yield file_name, tlv, small
+
+
+def survey_image_counts(df, file_names, summary=None):
+    """
+    n_candidates and n_matched of the given images (see summarize_images), 0 for images without
+    rows. The summary of df is computed from its rows unless given.
+    """
+    if summary is None:
+        summary = summarize_images(group_rows_by_image(df))
+    summary = summary.set_index('file_name')
+    return summary[['n_candidates', 'n_matched']].reindex(file_names, fill_value=0)
+
+
+def iter_report_html(df_tlv_survey, detected_images_folder, df_small_survey=pd.DataFrame(), max_images=200,
+                     map_workers=None, incremental=True, map_mode="iframe", thumbnail_widths=None,
+                     thumbnail_workers=None, tlv_summary=None, small_summary=None):
+    """
+    Yield the report HTML piece by piece: the header, one chunk per file-section and the footer.
+    Arguments as in iter_report_parts.
+    """
+    yield report_header_html
+    for _, html in iter_report_parts(df_tlv_survey, detected_images_folder, df_small_survey=df_small_survey,
+                                     max_images=max_images, map_workers=map_workers, incremental=incremental,
+                                     map_mode=map_mode, thumbnail_widths=thumbnail_widths,
+                                     thumbnail_workers=thumbnail_workers, tlv_summary=tlv_summary,
+                                     small_summary=small_summary):
+        yield html
+    yield "</body></html>"
+
+
+def iter_report_parts(df_tlv_survey, detected_images_folder, df_small_survey=pd.DataFrame(), max_images=200,
+                      map_workers=None, incremental=True, map_mode="iframe", thumbnail_widths=None,
+                      thumbnail_workers=None, tlv_summary=None, small_summary=None):
+    """
+    Yield the body of the report as ("script", html) chunks, all coming first, then one
+    ("section", html) chunk per file-section.
+
+    Args:
+        df_tlv_survey (pd.DataFrame): DataFrame containing the necessary details.
+        detected_images_folder (str): Path to the folder containing detected images.
+        df_small_survey (pd.DataFrame)
+        max_images (int | None): Number of file_names to consider, None for all of them.
+        map_workers (int | None): Processes rendering the maps, see render_maps.
+        incremental (bool): Keep maps whose rows didn't change since the last run (tracked in maps/manifest.json).
+        map_mode (str): "iframe" for one folium page per map, "shared" to embed JSON payloads drawn by
+            a single Leaflet map per column (no files under maps/).
+        thumbnail_widths (tuple | None): Embed downscaled variants of these widths (see build_thumbnails)
+            instead of the full images, and prefetch the next case's image. None keeps the full images.
+        thumbnail_workers (int | None): Processes resizing the images.
+        tlv_summary (pd.DataFrame | None): Per-image summary of df_tlv_survey, see iter_report_cases.
+        small_summary (pd.DataFrame | None): Per-image summary of df_small_survey.
+    """
+    with stage("group_cases", rows=len(df_tlv_survey)):
+        cases = [(file_name, [("left", tlv)] + ([] if small is None else [("right", small)]))
+                 for file_name, tlv, small in iter_report_cases(df_tlv_survey, df_small_survey=df_small_survey,
+                                                                max_images=max_images, tlv_summary=tlv_summary,
+                                                                small_summary=small_summary)]
+
+    def render_section(file_name, columns, map_paths, map_payloads, thumbnails):
+        small = columns[1][1] if len(columns) > 1 else None
+        return render_file_section(file_name, columns[0][1], small, detected_images_folder, map_paths=map_paths,
+                                   map_payloads=map_payloads, thumbnails=thumbnails)
+
+    yield from iter_case_parts(cases, render_section, detected_images_folder, map_workers=map_workers,
+                               incremental=incremental, map_mode=map_mode, thumbnail_widths=thumbnail_widths,
+                               thumbnail_workers=thumbnail_workers)
+
+
+def iter_case_parts(cases, render_section, detected_images_folder, map_workers=None, incremental=True,
+                    map_mode="iframe", thumbnail_widths=None, thumbnail_workers=None):
+    """
+    Render the maps and thumbnails of report cases and yield their parts, as iter_report_parts.
+
+    Args:
+        cases (list): (file_name, columns) pairs, columns being the (side, rows) of every column
+            of the case, side naming the column's map (e.g. "left").
+        render_section (callable): (file_name, columns, map_paths, map_payloads, thumbnails) -> the
+            case's file-section HTML, map_paths and map_payloads holding one entry (or None) per column.
+        Other arguments as in iter_report_parts.
+    """
+    if map_mode not in ("iframe", "shared"):
+        raise ValueError(f"Unknown map_mode: {map_mode}")
+
+    thumbnails = None
+    if thumbnail_widths:
+        sources = [case_image_path(rows, detected_images_folder)
+                   for _, columns in cases for _, rows in columns if not rows.empty]
+        with stage("build_thumbnails", rows=len(sources)):
+            thumbnails = build_thumbnails(sources, widths=thumbnail_widths, workers=thumbnail_workers)
+        yield "script", thumbnail_prefetch_script_html
+
+    if map_mode == "shared":
+        yield "script", shared_map_script_html
+        for file_name, columns in cases:
+            payloads = tuple(build_map_payload(rows) for _, rows in columns)
+            yield "section", render_section(file_name, columns, (None,) * len(columns), payloads, thumbnails)
+        return
+
+    # All maps go to the pool up front, sections are emitted as their maps come back in order
+    map_jobs = [(rows, side) for _, columns in cases for side, rows in columns]
+    manifest = load_render_manifest() if incremental else None
+    map_paths = render_maps(map_jobs, workers=map_workers, manifest=manifest)
+
+    try:
+        for file_name, columns in cases:
+            # Rendering in-process, or waiting for the pool
+            with stage("render_maps", rows=len(columns)):
+                paths = tuple(next(map_paths) for _ in columns)
+            yield "section", render_section(file_name, columns, paths, (None,) * len(columns), thumbnails)
+    finally:
+        # Also record the maps of a partial run
+        if manifest is not None:
+            save_render_manifest(manifest)
+
+
+# Images missing from some surveys listed by name in the comparison report, the rest are counted
+PARTIAL_IMAGES_LISTED = 200
+
+
+def agreement_stats_html(stats, n_images, n_disagreeing, partial=None):
+    """
+    Table of the surveys' pairwise agreement (see survey_comparison.agreement_stats), shown above
+    the cases, and the images left out for missing from some surveys (see
+    survey_comparison.partial_images).
+    """
+    html = ["<style>.agreement-stats table, table.agreement { border-collapse: collapse; margin-bottom: 10px; }"
+            ".agreement-stats td, .agreement-stats th, table.agreement td, table.agreement th "
+            "{ border: 1px solid #ccc; padding: 2px 6px; }</style>",
+            "<div class='agreement-stats'>",
+            f"<p><strong>{n_disagreeing}</strong> of {n_images} images have detections the surveys disagree on.</p>",
+            "<table><tr><th>Surveys</th><th>Detections</th><th>Same tree</th><th>Different tree</th>"
+            "<th>One side unmatched</th><th>Both unmatched</th><th>Agreement</th></tr>"]
+    for row in stats.itertuples(index=False):
+        html.append(
+            f"<tr><td>{row.survey_a} vs {row.survey_b}</td><td>{row.detections}</td><td>{row.same_tree}</td>"
+            f"<td>{row.different_tree}</td><td>{row.one_unmatched}</td><td>{row.both_unmatched}</td>"
+            f"<td>{row.agreement:.1%}</td></tr>"
+        )
+    html.append("</table>")
+    if partial is not None and len(partial):
+        missing = ", ".join(f"{name}: {count}" for name, count in (~partial).sum().items() if count)
+        html.append(f"<details><summary><strong>{len(partial)}</strong> images are missing from some surveys "
+                    f"and not compared (missing from {missing})</summary>"
+                    "<table><tr><th>File</th><th>Missing from</th></tr>")
+        for file_name, present in partial.head(PARTIAL_IMAGES_LISTED).iterrows():
+            html.append(f"<tr><td>{file_name}</td><td>{', '.join(present.index[~present])}</td></tr>")
+        html.append("</table>")
+        if len(partial) > PARTIAL_IMAGES_LISTED:
+            html.append(f"<p>... and {len(partial) - PARTIAL_IMAGES_LISTED} more</p>")
+        html.append("</details>")
+    html.append("</div>")
+    return "".join(html)
+
+
+def disagreement_table_html(detections, survey_names):
+    """
+    Table of one image's detections: the tree every survey matched them to and how each pair of
+    surveys agrees (see survey_comparison.disagreeing_images), disagreements in bold.
+    """
+    pairs = [column for column in detections.columns if column not in survey_names]
+    html = ["<table class='agreement'><tr><th>Tree Index</th>"]
+    html.extend(f"<th>{name}</th>" for name in survey_names)
+    html.extend(f"<th>{pair}</th>" for pair in pairs)
+    html.append("</tr>")
+    tree_indexes = detections.index.get_level_values('tree_index').tolist()
+    tree_ids = [detections[name].tolist() for name in survey_names]
+    agreements = [detections[pair].tolist() for pair in pairs]
+    for i, tree_index in enumerate(tree_indexes):
+        html.append(f"<tr><td>{tree_index}</td>")
+        html.extend(f"<td>{'-' if np.isnan(ids[i]) else int(ids[i])}</td>" for ids in tree_ids)
+        for agreement in agreements:
+            label = AGREEMENT_LABELS[agreement[i]]
+            html.append(f"<td>{label if agreement[i] in (SAME_TREE, BOTH_UNMATCHED) else f'<b>{label}</b>'}</td>")
+        html.append("</tr>")
+    html.append("</table>")
+    return "".join(html)
+
+
+@timed_stage()
+def render_comparison_section(file_name, columns, detections, detected_images_folder, map_paths, map_payloads,
+                              thumbnails=None):
+    """
+    Produce the HTML of one file-section of a multi-survey comparison: title, legend, the
+    disagreement table and one column per survey. columns holds the (survey name, rows) of
+    every survey, the other arguments are as in render_file_section.
+    """
+    html = ["<div class='file-section' style='display:none;'>",
+            f"<div class='file-title'>File: {file_name}</div>",
+            detection_legend_html(columns[0][1]),
+            disagreement_table_html(detections, [name for name, _ in columns]),
+            "<div class='row'>"]
+    for i, (name, rows) in enumerate(columns):
+        html.append(f"<div class='{'left' if i == 0 else 'right'}'>")
+        html.append(f"<h3>{name}</h3>")
+        html.append(render_case_column(rows, detected_images_folder, f"survey{i}", map_paths[i], map_payloads[i],
+                                       thumbnails))
+        html.append("</div>")
+    html.append("</div>")  # close .row
+    html.append("</div>")  # Close file-section
+    return "".join(html)
+
+
+def iter_comparison_parts(surveys, detected_images_folder, max_images=None, **render_options):
+    """
+    Yield the parts of a report comparing any number of surveys (as iter_report_parts), with
+    only the images they disagree on: the agreement statistics go with the scripts, then one
+    section per disagreeing image with a column per survey.
+
+    Detections are aligned on (file_name, tree_index) over the images of every survey (see
+    survey_comparison.align_surveys). The images missing from some surveys are listed with the
+    statistics.
+
+    Args:
+        surveys (dict): Survey name -> cleaned survey.
+        detected_images_folder (str): Path to the folder containing detected images.
+        max_images (int | None): Number of disagreeing images to render, None for all of them.
+        **render_options: map_workers, incremental, map_mode, thumbnail_widths and thumbnail_workers
+            of iter_report_parts.
+    """
+    names = list(surveys)
+    with stage("align_surveys", rows=sum(len(df) for df in surveys.values())):
+        aligned = align_surveys(surveys)
+        stats = agreement_stats(aligned)
+        by_image = disagreeing_images(aligned)
+        partial = partial_images(surveys)
+    n_images = aligned.index.get_level_values('file_name').nunique()
+    print(f"{len(by_image)}/{n_images} images with disagreements")
+    if len(partial):
+        print(f"{len(partial)} images missing from some surveys, not compared")
+    print(stats.to_string(index=False))
+    yield "script", agreement_stats_html(stats, n_images, len(by_image), partial)
+
+    file_names = list(by_image)[:max_images]
+    with stage("group_cases", rows=len(file_names)):
+        by_survey = {name: partition_by_file_name(df[df['file_name'].isin(file_names)])
+                     for name, df in surveys.items()}
+        cases = [(file_name, [(f"survey{i}", by_survey[name][file_name]) for i, name in enumerate(names)])
+                 for file_name in file_names]
+
+    def render_section(file_name, columns, map_paths, map_payloads, thumbnails):
+        named_columns = [(name, rows) for name, (_, rows) in zip(names, columns)]
+        return render_comparison_section(file_name, named_columns, by_image[file_name], detected_images_folder,
+                                         map_paths, map_payloads, thumbnails)
+
+    yield from iter_case_parts(cases, render_section, detected_images_folder, **render_options)
+
+
+def create_comparison_report(surveys, detected_images_folder, output_html_file, max_images=None, shard_size=None,
+                             **render_options):
+    """
+    Write the multi-survey comparison report (see iter_comparison_parts), as a single page or
+    sharded like create_html_with_images_and_details.
+    """
+    parts = iter_comparison_parts(surveys, detected_images_folder, max_images=max_images, **render_options)
+    if shard_size:
+        write_sharded_report(parts, output_html_file, shard_size=shard_size)
+        return
 
-    # Write out
     with open(output_html_file, 'w', encoding='utf-8') as f:
-        f.write(html)
+        f.write(report_header_html)
+        for _, html in parts:
+            with stage("write_html"):
+                f.write(html)
+                f.flush()
+        f.write("</body></html>")
+
+
+def shard_dir_for(output_html_file):
+    """
+    Folder of the shards of a sharded report, next to its index page.
+    """
+    return Path(output_html_file).with_name(f"{Path(output_html_file).stem}_shards")
+
+
+def write_sharded_report(parts, output_html_file, shard_size=500):
+    """
+    Write report parts (see iter_report_parts) as an index page plus shard files of shard_size
+    file-sections each, loaded on demand by the page's Prev/Next navigation.
+
+    Shards are written as soon as they fill up. The shard list is saved in
+    <stem>_shards/manifest.json and embedded in the index page, which is written last.
+
+    Returns:
+        dict: The shard manifest ({'total': cases, 'shards': [{'src': ..., 'count': ...}]}).
+    """
+    shard_dir = shard_dir_for(output_html_file)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    scripts = []
+    shard_manifest = {"total": 0, "shards": []}
+    sections = []
+
+    def flush_shard():
+        number = len(shard_manifest["shards"])
+        name = f"shard_{number:05d}.js"
+        html = json.dumps("".join(sections), ensure_ascii=False)
+        with open(shard_dir / name, 'w', encoding='utf-8') as f:
+            f.write(f"reportShardLoaded({number}, {html});\n")
+        shard_manifest["shards"].append({"src": f"{shard_dir.name}/{name}", "count": len(sections)})
+        shard_manifest["total"] += len(sections)
+        sections.clear()
+
+    for kind, html in parts:
+        if kind == "script":
+            scripts.append(html)
+            continue
+        sections.append(html)
+        if len(sections) == shard_size:
+            flush_shard()
+    if sections:
+        flush_shard()
+
+    # Drop the shards of an earlier, longer run
+    current = {Path(shard["src"]).name for shard in shard_manifest["shards"]}
+    for stale in shard_dir.glob("shard_*.js"):
+        if stale.name not in current:
+            stale.unlink()
+    with open(shard_dir / "manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(shard_manifest, f)
+
+    manifest_json = json.dumps(shard_manifest, ensure_ascii=False).replace("</", "<\\/")
+    with open(output_html_file, 'w', encoding='utf-8') as f:
+        f.write(report_head_html + sharded_navigation_script_html + report_body_start_html)
+        f.writelines(scripts)
+        f.write(f"<script type='application/json' id='shardManifest'>{manifest_json}</script>")
+        f.write("<div id='cases'></div>")
+        f.write("</body></html>")
+    return shard_manifest
+
+
+def create_html_with_images_and_details(df_tlv_survey, detected_images_folder, output_html_file,
+                                        df_small_survey=pd.DataFrame(), max_images=200, map_workers=None,
+                                        incremental=True, map_mode="iframe", thumbnail_widths=None,
+                                        thumbnail_workers=None, shard_size=None, tlv_summary=None,
+                                        small_summary=None):
+    """
+    Generate an HTML file displaying image details and maps for each file_name in the dataframe.
+
+    Sections are written and flushed as soon as they are rendered, so memory stays flat
+    and an interrupted run still leaves a viewable partial report. With shard_size the
+    sections go to shard files instead, see write_sharded_report.
+
+    Args:
+        df_tlv_survey (pd.DataFrame): DataFrame containing the necessary details.
+        detected_images_folder (str): Path to the folder containing detected images.
+        output_html_file (str): Path to save the generated HTML file.
+        df_small_survey (pd.DataFrame)
+        max_images (int | None): Number of file_names to consider, None for all of them.
+        map_workers (int | None): Processes rendering the maps, None for one per CPU and 1 to render in-process.
+        incremental (bool): Only re-render maps whose input rows changed since the last run.
+        map_mode (str): "iframe" (one folium page per map) or "shared" (one Leaflet map redrawn per case).
+        thumbnail_widths (tuple | None): Widths of the downscaled image variants to embed, e.g.
+            THUMBNAIL_WIDTHS, None for the full images.
+        thumbnail_workers (int | None): Processes resizing the images, None for one per CPU.
+        shard_size (int | None): Cases per shard file for very large reports, None for a single page.
+        tlv_summary (pd.DataFrame | None): Per-image summary of df_tlv_survey, see iter_report_cases.
+        small_summary (pd.DataFrame | None): Per-image summary of df_small_survey.
+    """
+    if shard_size:
+        parts = iter_report_parts(df_tlv_survey, detected_images_folder, df_small_survey=df_small_survey,
+                                  max_images=max_images, map_workers=map_workers, incremental=incremental,
+                                  map_mode=map_mode, thumbnail_widths=thumbnail_widths,
+                                  thumbnail_workers=thumbnail_workers, tlv_summary=tlv_summary,
+                                  small_summary=small_summary)
+        write_sharded_report(parts, output_html_file, shard_size=shard_size)
+        return
+
+    with open(output_html_file, 'w', encoding='utf-8') as f:
+        for chunk in iter_report_html(df_tlv_survey, detected_images_folder, df_small_survey=df_small_survey,
+                                      max_images=max_images, map_workers=map_workers,
+                                      incremental=incremental, map_mode=map_mode,
+                                      thumbnail_widths=thumbnail_widths, thumbnail_workers=thumbnail_workers,
+                                      tlv_summary=tlv_summary, small_summary=small_summary):
+            with stage("write_html"):
+                f.write(chunk)
+                f.flush()
+
+
+# The columns a map is drawn from (see generate_map and map_features)
+MAP_COLUMNS = ['file_name', 'y_tree_image', 'x_tree_image', 'tree_id', 'x_tree', 'y_tree', 'tree_name', 'real_angle',
+               'tree_index', 'additional_matches', 'x_image', 'y_image', 'heading']
+
+
+def canonical_values(values):
+    """
+    A column's values as plain Python scalars, with None for every missing value (NaN, pd.NA and
+    the "None" sentinel), so the same rows give the same values in any dtype (e.g. int64 or Int32,
+    object or category, see compact_dtypes).
+    """
+    return [None if item is None or item is pd.NA or item == "None" or (isinstance(item, float) and math.isnan(item))
+            else item for item in values.tolist()]
+
+
+def rows_fingerprint(filtered_df, *extra):
+    """
+    Content hash of one image's MAP_COLUMNS, any extra rendering inputs and RENDER_VERSION.
+    """
+    columns = [canonical_values(filtered_df[column]) for column in MAP_COLUMNS]
+    payload = json.dumps([RENDER_VERSION, list(extra), columns], default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 
+def load_render_manifest(path=maps_manifest_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
 
-def generate_map(filtered_df, left_or_right=""):
+
+def save_render_manifest(manifest, path=maps_manifest_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=0)
+    os.replace(tmp_path, path)
+
+
+def case_rows(filtered_df, columns):
+    """
+    The rows of one case as tuples of the given columns' values (Python scalars, as iterrows
+    gives them), without building a Series per row.
+    """
+    return list(zip(*(filtered_df[column].tolist() for column in columns)))
+
+
+def map_features(filtered_df):
+    """
+    What the map of one file_name shows, every marker once: the car (one per image), the best
+    matches and the additional matches that aren't a best match of the image.
+
+    Returns:
+        tuple: (markers [lat, lon, kind, popup] with kind car/best/additional, detection
+        direction lines [[lat, lon], [lat, lon], popup]), in row order.
+    """
+    line_length = 0.0001  # Approx ~10 meters
+    best_match_ids = set(filtered_df['tree_id'].dropna().tolist())
+    markers = []
+    lines = []
+    seen = set()
+
+    def add_marker(lat, lon, kind, popup):
+        key = (lat, lon, kind, popup)
+        if key not in seen:
+            seen.add(key)
+            markers.append([lat, lon, kind, popup])
+
+    cars = set()
+    rows = case_rows(filtered_df, ['tree_id', 'x_tree', 'y_tree', 'tree_name', 'real_angle', 'tree_index',
+                                   'additional_matches', 'x_image', 'y_image', 'heading'])
+    for tree_id, x_tree, y_tree, tree_name, real_angle, tree_index, additional_matches, x_car, y_car, heading in rows:
+        if pd.notna(tree_id):
+            add_marker(y_tree, x_tree, "best", f"Best Match: {tree_name} (ID: {tree_id})")
+            x_end = x_tree + line_length * math.cos(real_angle)
+            y_end = y_tree + line_length * math.sin(real_angle)
+            lines.append([[y_tree, x_tree], [y_end, x_end], f"Detection: Tree Index {tree_index}, angle: {real_angle}"])
+
+        if additional_matches:
+            for match in additional_matches:
+                if match['id'] not in best_match_ids:
+                    add_marker(match['location_y'], match['location_x'], "additional",
+                               f"Additional Match: {match['tree_name']} (ID: {match['id']})")
+
+        # Every detection of an image has the same car location
+        if (x_car, y_car, heading) not in cars:
+            cars.add((x_car, y_car, heading))
+            current_tree_streetview_url = f"https://www.google.com/maps?q={y_car},{x_car}&layer=c&cbll={y_car},{x_car}&cbp=12,{heading},0,0,0"
+            add_marker(y_car, x_car, "car",
+                       f"Car location<br><a href='{current_tree_streetview_url}' target='_blank'>View on Google Street View</a>")
+
+    return markers, lines
+
+
+def json_safe(value):
+    """
+    value with every NaN or infinite float (nested in lists, tuples and dicts) replaced by None,
+    which JSON encodes as null - json.dumps would write bare NaN, which JSON.parse rejects.
+    """
+    if isinstance(value, (float, np.floating)):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def build_map_payload(filtered_df):
+    """
+    Compact JSON-ready version of what generate_map draws for one file_name, for the shared report map.
+
+    Returns:
+        dict: center [lat, lon], markers [lat, lon, kind, popup] with kind car/best/additional,
+        and detection direction lines [[lat, lon], [lat, lon], popup] (see map_features).
+    """
+    markers, lines = map_features(filtered_df)
+    first = filtered_df.iloc[0]
+    return {"center": [first['y_tree_image'], first['x_tree_image']], "markers": markers, "lines": lines}
+
+
+# folium marker colors of the map_features kinds
+map_marker_colors = {"car": "orange", "best": "green", "additional": "blue"}
+
+
+def map_path_for(filtered_df, left_or_right=""):
+    maps_repo = "maps"
+    direction = "" if left_or_right == "" else f"{left_or_right}_"
+    return f"./{maps_repo}/{direction}map_{filtered_df.iloc[0]['file_name']}.html"
+
+
+def is_map_current(map_path, fingerprint, manifest):
+    return manifest.get(map_path) == fingerprint and os.path.exists(map_path)
+
+
+@timed_stage(rows_from="filtered_df")
+def generate_map(filtered_df, left_or_right="", manifest=None):
     """
     Generate a map for the given file_name using filtered DataFrame rows.
 
     Args:
         filtered_df (pd.DataFrame): Filtered rows for a specific file_name.
+        manifest (dict | None): Render manifest (see load_render_manifest). When given, the map is only
+            rendered if the saved one was built from different rows, and the manifest is updated.
 
     Returns:
         str: Path to the saved map HTML file.
     """
+    map_path = map_path_for(filtered_df, left_or_right)
+    if manifest is not None:
+        fingerprint = rows_fingerprint(filtered_df, left_or_right)
+        if is_map_current(map_path, fingerprint, manifest):
+            return map_path
+
     # Create a map centered on the first detection
     initial_coords = [filtered_df.iloc[0]['y_tree_image'], filtered_df.iloc[0]['x_tree_image']]
     map_obj = folium.Map(location=initial_coords, zoom_start=15)
-    # Line length (adjust for visibility)
-    line_length = 0.0001  # Approx ~10 meters
-    best_match_ids = filtered_df['tree_id'].unique()
-
-    # Add markers for best matches, detections directions and additional matches
-    for _, row in filtered_df.iterrows():
-        # Best match not nan
-        if pd.notna(row['tree_id']):
-            folium.Marker(
-                location=[row['y_tree'], row['x_tree']],
-                popup=f"Best Match: {row['tree_name']} (ID: {row['tree_id']})",
-                icon=folium.Icon(color='green')
-            ).add_to(map_obj)
-            # Detection location
-            # Compute endpoint using trigonometry
-            x_end = row['x_tree'] + line_length * math.cos(row['real_angle'])
-            y_end = row['y_tree'] + line_length * math.sin(row['real_angle'])
-            # Add a line representing detection direction
-            folium.PolyLine(
-                locations=[(row['y_tree'], row['x_tree']), (y_end, x_end)],
-                popup=f"Detection: Tree Index {row['tree_index']}, angle: {row['real_angle']}",
-                color="black",
-                weight=2
-            ).add_to(map_obj)
-            # # Draw a line between the detection tree and the matched seker tree
-            # folium.PolyLine(
-            #     locations=[[row['y_tree_image'], row['x_tree_image']], [row['y_tree'], row['x_tree']]],
-            #     color='black',  # Color for the connection line
-            #     weight=2  # Line thickness
-            # ).add_to(map_obj)
-
-        # Additional matches
-        # if pd.notna(row['additional_matches']):
-        # if len(row['additional_matches']) > 0:
-        if row['additional_matches']:
-            for match in row['additional_matches']:
-                id = match['id']
-                if id not in best_match_ids:
-                    folium.Marker(
-                        location=[match['location_y'], match['location_x']],
-                        popup=f"Additional Match: {match['tree_name']} (ID: {match['id']})",
-                        icon=folium.Icon(color='blue')
-                    ).add_to(map_obj)
-
-        # Detection location
-        # # Create Google Street View URL for the current tree
-        # x_tree_image = row['x_tree_image']
-        # y_tree_image = row['y_tree_image']
-        # current_tree_streetview_url = f"https://www.google.com/maps?q={y_tree_image},{x_tree_image}&layer=c&cbll={y_tree_image},{x_tree_image}"
-        # folium.Marker(
-        #     location=[y_tree_image, x_tree_image],
-        #     popup=f"Detection: Tree Index {row['tree_index']}<br><a href='{current_tree_streetview_url}' target='_blank'>View on Google Street View</a>",
-        #     icon=folium.Icon(color='red')
-        # ).add_to(map_obj)
-
-        # Car location
-        x_car = row['x_image']
-        y_car = row['y_image']
-        heading = row['heading']
-        current_tree_streetview_url = f"https://www.google.com/maps?q={y_car},{x_car}&layer=c&cbll={y_car},{x_car}&cbp=12,{heading},0,0,0"
-        folium.Marker(
-            location=[y_car, x_car],
-            popup=f"Car location<br><a href='{current_tree_streetview_url}' target='_blank'>View on Google Street View</a>",
-            icon=folium.Icon(color='orange')
-        ).add_to(map_obj)
+
+    # Markers for the car, best matches and additional matches, and the detection directions
+    markers, lines = map_features(filtered_df)
+    for lat, lon, kind, popup in markers:
+        folium.Marker(location=[lat, lon], popup=popup, icon=folium.Icon(color=map_marker_colors[kind])).add_to(map_obj)
+    for start_point, end_point, popup in lines:
+        folium.PolyLine(locations=[tuple(start_point), tuple(end_point)], popup=popup, color="black",
+                        weight=2).add_to(map_obj)
 
     map_obj.get_root().html.add_child(Element(legend_html))
 
     # Save the map to an HTML file
-    maps_repo = "maps"
-    direction = "" if left_or_right == "" else f"{left_or_right}_"
-    map_path = f"./{maps_repo}/{direction}map_{filtered_df.iloc[0]['file_name']}.html"
     os.makedirs(os.path.dirname(map_path), exist_ok=True)
     map_obj.save(map_path)
+    if manifest is not None:
+        manifest[map_path] = fingerprint
 
     return map_path
 
 
-def main():
-    small_survey = "tree_small_survey_output_meters_divide=100000_angle_divide=3_y_times=12_y_exponent=2_count_distinct_trees=0.xlsx"
-    df_small_survey = pd.read_excel(small_survey)
+def _generate_map_job(job):
+    filtered_df, left_or_right = job
+    return generate_map(filtered_df, left_or_right)
+
+
+def render_maps(jobs, workers=None, progress_every=50, manifest=None):
+    """
+    Render many maps with generate_map in a process pool.
+
+    Args:
+        jobs (list): (filtered_df, left_or_right) pairs, one per map, rows already grouped by file_name and cleaned.
+        workers (int | None): Number of worker processes, None for one per CPU and 1 to render in-process.
+        progress_every (int): Print progress after this many maps, 0 to stay silent.
+        manifest (dict | None): Render manifest. Maps whose rows didn't change since they were saved are
+            skipped, and the fingerprints of re-rendered maps are recorded in it.
+
+    Returns:
+        iterator: The map paths, in the order of jobs.
+    """
+    # Only maps that are missing or out of date go to the workers
+    fingerprints = [None] * len(jobs)
+    stale = list(range(len(jobs)))
+    if manifest is not None:
+        fingerprints = [rows_fingerprint(filtered_df, left_or_right) for filtered_df, left_or_right in jobs]
+        stale = [i for i, (job, fingerprint) in enumerate(zip(jobs, fingerprints))
+                 if not is_map_current(map_path_for(*job), fingerprint, manifest)]
+        if progress_every:
+            print(f"{len(jobs) - len(stale)}/{len(jobs)} maps are up to date")
+
+    total = len(stale)
+    stale_jobs = [jobs[i] for i in stale]
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    if workers == 1 or total <= 1:
+        results = map(_generate_map_job, stale_jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, total))
+        results = executor.map(_generate_map_job, stale_jobs, chunksize=max(1, min(8, total // (workers * 4))))
+
+    try:
+        stale = set(stale)
+        done = 0
+        for i, job in enumerate(jobs):
+            if i not in stale:
+                yield map_path_for(*job)
+                continue
+            map_path = next(results)
+            if manifest is not None:
+                manifest[map_path] = fingerprints[i]
+            done += 1
+            if progress_every and (done % progress_every == 0 or done == total):
+                print(f"Rendered {done}/{total} maps")
+            yield map_path
+    finally:
+        # Also when the caller stops early or a map failed: don't render the rest in the background
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def iter_file_name_partitions(chunks):
+    """
+    Regroup survey chunks so every file_name's rows are in a single partition.
+
+    Survey outputs list the detections of an image together, so only the last image of a
+    chunk can continue in the next one; its rows are carried over. A file_name showing up
+    again in a later partition (not grouped in the file) is reported, its detections are then
+    deduplicated per partition only.
+    """
+    carry = None
+    seen = set()
+    warned = False
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if chunk.empty:
+            continue
+        names = chunk['file_name'].to_numpy()
+        others = np.flatnonzero(names != names[-1])
+        tail_start = others[-1] + 1 if len(others) else 0
+        carry = chunk.iloc[tail_start:]
+        if tail_start == 0:
+            continue
+
+        partition = chunk.iloc[:tail_start]
+        partition_names = set(partition['file_name'].unique())
+        if not warned and not seen.isdisjoint(partition_names):
+            print("Warning: the survey isn't grouped by file_name, some images are split across chunks")
+            warned = True
+        seen |= partition_names
+        yield partition
+
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def is_small_survey_columns(columns):
+    # The small survey's Seker fields come from the small inventory (tree_name_code, tree_name_big_csv)
+    return 'tree_name_big_csv' in columns
+
 
-    tlv_survey = "nadav_output_meters_divide=100000_angle_divide=3_y_times=12_y_exponent=2_count_distinct_trees=608.xlsx"
-    df_tlv_survey = pd.read_excel(tlv_survey)
+def _survey_stamp(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
 
-    clean_df_small_survey = clean_df(df=df_small_survey, is_small_survey=True)
-    clean_df_tlv_survey = clean_df(df=df_tlv_survey, is_small_survey=False)
 
-    detected_images_folder = "detected_images/tree_nadav_merged"
-    output_html_file = "index.html"
-    create_html_with_images_and_details(df_tlv_survey=clean_df_tlv_survey,
-                                        detected_images_folder=detected_images_folder,
-                                        output_html_file=output_html_file, df_small_survey=clean_df_small_survey)
+def _load_progress(progress_path, run_key):
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path, encoding='utf-8') as f:
+        progress = json.load(f)
+    return progress if progress.get("run_key") == run_key else None
+
+
+def _save_progress(progress, progress_path):
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def _timed_chunks(chunks):
+    """
+    Yield the chunks, recording the reading (and type coercion) of every chunk as a read_chunks stage.
+    """
+    chunks = iter(chunks)
+    while True:
+        with stage("read_chunks") as info:
+            chunk = next(chunks, None)
+            info["rows"] = None if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def iter_streamed_parts(survey_path, detected_images_folder, df_compare_survey=pd.DataFrame(), chunk_rows=50000,
+                        max_images=None, skip_partitions=0, compact=False, compare_summary=None, **render_options):
+    """
+    Clean and render a survey one file_name partition at a time (see iter_file_name_partitions).
+
+    Args:
+        max_images (int | None): Number of file_names to consider, as in iter_report_cases.
+        compact (bool): Clean the partitions into compact dtypes (see clean_df).
+        compare_summary (pd.DataFrame | None): Per-image summary of df_compare_survey (see
+            load_whole_survey), computed per partition when None.
+
+    Yields:
+        tuple: (partition number, parts of the partition as in iter_report_parts, number of
+        file_names considered). Partitions before skip_partitions are read but neither cleaned
+        nor rendered.
+    """
+    chunks = _timed_chunks(iter_survey_chunks(survey_path, chunk_rows=chunk_rows, columns=REPORT_COLUMNS))
+    is_small_survey = None
+    images = 0
+    for number, partition in enumerate(iter_file_name_partitions(chunks)):
+        if number < skip_partitions:
+            continue
+        if max_images is not None and images >= max_images:
+            break
+        if is_small_survey is None:
+            is_small_survey = is_small_survey_columns(partition.columns)
+
+        cleaned, summary = clean_df(partition.copy(), is_small_survey=is_small_survey, compact=compact,
+                                    with_summary=True)
+        compare, compare_images = df_compare_survey, compare_summary
+        if not compare.empty:
+            file_names = cleaned['file_name'].unique()
+            compare = compare[compare['file_name'].isin(file_names)]
+            if compare_images is not None:
+                compare_images = compare_images[compare_images['file_name'].isin(file_names)]
+
+        remaining = None if max_images is None else max_images - images
+        parts = list(iter_report_parts(cleaned, detected_images_folder, df_small_survey=compare,
+                                       max_images=remaining, tlv_summary=summary, small_summary=compare_images,
+                                       **render_options))
+        considered = cleaned['file_name'].nunique()
+        considered = considered if remaining is None else min(considered, remaining)
+        images += considered
+        yield number, parts, considered
+
+
+def load_whole_survey(path, compact=False, with_summary=False):
+    """
+    Load and clean a whole survey (xlsx through the Parquet cache, csv or parquet). With
+    with_summary=True, (cleaned survey, per-image summary) is returned, the summary persisted
+    next to the xlsx cache (see load_clean_survey).
+    """
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xls"):
+        is_small_survey = is_small_survey_columns(load_raw_survey(path).columns)
+        return load_clean_survey(path, is_small_survey=is_small_survey, compact=compact, with_summary=with_summary)
+    df = pd.concat(list(iter_survey_chunks(path, columns=REPORT_COLUMNS)))
+    return clean_df(df, is_small_survey=is_small_survey_columns(df.columns), compact=compact,
+                    with_summary=with_summary)
+
+
+def stream_report(survey_path, detected_images_folder, output_html_file="index.html", compare_survey_path=None,
+                  chunk_rows=50000, max_images=None, resume=False, shard_size=None, compact=False,
+                  compare_survey=None, **render_options):
+    """
+    Build the report of a survey of any size, streaming it by file_name partitions through
+    clean_df and the rendering so only one partition is in memory at a time.
+
+    The single-page report records its progress after every partition in
+    <output_html_file>.progress.json; with resume=True an interrupted run continues from the
+    last finished partition instead of starting over.
+
+    Args:
+        survey_path (str): Survey output (xlsx, csv or parquet).
+        detected_images_folder (str): Folder of the images-with-detections, relative to the report.
+        output_html_file (str): Report path.
+        compare_survey_path (str | None): Survey shown in the right column, loaded whole.
+        chunk_rows (int): Rows read per chunk.
+        max_images (int | None): Number of file_names to consider, None for all of them.
+        resume (bool): Continue an interrupted run of the same survey and options.
+        shard_size (int | None): Write a sharded report instead (see write_sharded_report), not resumable.
+        compact (bool): Clean both surveys into compact dtypes (see clean_df).
+        compare_survey (tuple | None): (cleaned survey, per-image summary) of compare_survey_path,
+            as load_whole_survey(..., with_summary=True) returns it, loaded here when None.
+        **render_options: map_workers, incremental, map_mode, thumbnail_widths and thumbnail_workers
+            of iter_report_parts.
+    """
+    df_compare_survey, compare_summary = pd.DataFrame(), None
+    if compare_survey is not None:
+        df_compare_survey, compare_summary = compare_survey
+    elif compare_survey_path:
+        with stage("load_compare_survey"):
+            df_compare_survey, compare_summary = load_whole_survey(compare_survey_path, compact=compact,
+                                                                   with_summary=True)
+
+    if shard_size:
+        if resume:
+            raise ValueError("resume is only supported for single-page reports")
+
+        def sharded_parts():
+            scripts_written = False
+            for _, parts, _ in iter_streamed_parts(survey_path, detected_images_folder, df_compare_survey,
+                                                chunk_rows=chunk_rows, max_images=max_images, compact=compact,
+                                                compare_summary=compare_summary, **render_options):
+                for kind, html in parts:
+                    if kind == "section" or not scripts_written:
+                        yield kind, html
+                scripts_written = True
+
+        write_sharded_report(sharded_parts(), output_html_file, shard_size=shard_size)
+        return
+
+    progress_path = f"{output_html_file}.progress.json"
+    run_key = {"survey": _survey_stamp(survey_path), "compare": compare_survey_path and _survey_stamp(compare_survey_path),
+               "detected_images_folder": detected_images_folder, "chunk_rows": chunk_rows, "max_images": max_images,
+               "compact": compact, "render_options": render_options}
+    run_key = json.loads(json.dumps(run_key, default=str))
+    progress = _load_progress(progress_path, run_key) if resume else None
+    if progress is not None and progress["complete"]:
+        print(f"{output_html_file} is already complete")
+        return
+    if progress is not None and os.path.exists(output_html_file):
+        print(f"Resuming {output_html_file} after {progress['partitions']} partitions ({progress['cases']} cases)")
+        f = open(output_html_file, 'r+b')
+        f.truncate(progress["offset"])
+        f.seek(progress["offset"])
+    else:
+        progress = {"run_key": run_key, "partitions": 0, "images": 0, "cases": 0, "offset": 0, "complete": False}
+        f = open(output_html_file, 'wb')
+        f.write(report_header_html.encode('utf-8'))
+
+    with f:
+        for number, parts, images in iter_streamed_parts(survey_path, detected_images_folder, df_compare_survey,
+                                                         chunk_rows=chunk_rows,
+                                                         max_images=None if max_images is None
+                                                         else max_images - progress["images"],
+                                                         skip_partitions=progress["partitions"], compact=compact,
+                                                         compare_summary=compare_summary, **render_options):
+            with stage("write_html"):
+                for kind, html in parts:
+                    # Scripts are the same for every partition
+                    if kind == "section" or progress["offset"] == 0:
+                        f.write(html.encode('utf-8'))
+                f.flush()
+            progress["partitions"] = number + 1
+            progress["images"] += images
+            progress["cases"] += sum(kind == "section" for kind, _ in parts)
+            progress["offset"] = f.tell()
+            _save_progress(progress, progress_path)
+            print(f"Partition {number + 1}: {progress['cases']} cases written")
+
+        f.write("</body></html>".encode('utf-8'))
+    progress["complete"] = True
+    _save_progress(progress, progress_path)
+
+
+@contextmanager
+def _working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the detections and matches review report of one or more surveys.")
+    parser.add_argument("surveys", nargs="*",
+                        help="Survey outputs (xlsx, csv or parquet). Defaults to the TLV survey compared with the "
+                             "small survey.")
+    parser.add_argument("--images", help="Folder of the images-with-detections.")
+    parser.add_argument("--compare", help="Survey shown next to every survey, in the right column.")
+    parser.add_argument("--disagreements", action="store_true",
+                        help="Compare the surveys with each other in one report of the images they disagree on.")
+    parser.add_argument("--output-dir", default=".",
+                        help="Where the report goes; with several surveys each gets a sub-folder named after it.")
+    parser.add_argument("--output", default="index.html", help="Report file name.")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="Rows read per chunk.")
+    parser.add_argument("--max-images", type=int, help="Images to consider per report, all of them by default.")
+    parser.add_argument("--map-mode", choices=["iframe", "shared"], default="iframe")
+    parser.add_argument("--map-workers", type=int, help="Processes rendering the maps, one per CPU by default.")
+    parser.add_argument("--full-images", action="store_true", help="Embed the full images instead of thumbnails.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Clean into compact dtypes (categoricals, nullable ints, float32), for city-wide surveys.")
+    parser.add_argument("--shard-size", type=int, help="Cases per shard file, for very large reports.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run.")
+    parser.add_argument("--profile-stage", help="Stage to run under cProfile, e.g. clean_df or render_maps.")
+    parser.add_argument("--run-log", help="Path of the JSON run log, run_logs/run_<start time>.json by default.")
+    args = parser.parse_args(argv)
+
+    if not args.surveys:
+        args.surveys = [DEFAULT_TLV_SURVEY]
+        args.compare = args.compare or DEFAULT_SMALL_SURVEY
+        args.images = args.images or DEFAULT_IMAGES_FOLDER
+    if not args.images:
+        parser.error("--images is required with explicit surveys")
+    if args.disagreements and (len(args.surveys) < 2 or args.compare or args.resume):
+        parser.error("--disagreements compares two or more surveys, without --compare or --resume")
+    return args
+
+
+def compare_surveys(args, stems):
+    """
+    The --disagreements report: every survey loaded whole and compared with the others (see
+    create_comparison_report), in <output-dir>/<output>.
+    """
+    surveys = {}
+    for survey, stem in zip(args.surveys, stems):
+        name = Path(survey).name if stems.count(stem) > 1 else stem
+        with stage("load_survey"):
+            surveys[name] = load_whole_survey(survey, compact=args.compact)
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"{', '.join(surveys)} -> {os.path.join(args.output_dir, args.output)}")
+
+    images_folder = Path(os.path.relpath(args.images, args.output_dir)).as_posix()
+    with _working_directory(args.output_dir), stage("comparison_report"):
+        create_comparison_report(surveys, images_folder, args.output, max_images=args.max_images,
+                                 shard_size=args.shard_size, map_workers=args.map_workers, map_mode=args.map_mode,
+                                 thumbnail_widths=None if args.full_images else THUMBNAIL_WIDTHS)
+
+
+def main(argv=None):
+    """
+    Command-line entry point, see parse_args. Every stage is recorded in a JSON run log
+    (see profiling.RunLog).
+    """
+    args = parse_args(argv)
+    run_log = RunLog(profile_stage=args.profile_stage)
+    # Surveys sharing a file stem (e.g. a .csv and an .xlsx export) get their extension appended
+    stems = [Path(survey).stem for survey in args.surveys]
+    with recording(run_log), stage("main"):
+        if args.disagreements:
+            compare_surveys(args, stems)
+        else:
+            # The compare survey and its per-image summary are loaded once for all the reports
+            compare_path = os.path.abspath(args.compare) if args.compare else None
+            compare_survey = None
+            if compare_path:
+                with stage("load_compare_survey"):
+                    compare_survey = load_whole_survey(compare_path, compact=args.compact, with_summary=True)
+            for survey, stem in zip(args.surveys, stems):
+                output_dir = args.output_dir
+                if len(args.surveys) > 1:
+                    if stems.count(stem) > 1:
+                        stem = Path(survey).name.replace(".", "_")
+                    output_dir = os.path.join(output_dir, stem)
+                os.makedirs(output_dir, exist_ok=True)
+                print(f"{survey} -> {os.path.join(output_dir, args.output)}")
+
+                # Maps and thumbnails are written next to the report, which links them relatively
+                survey_path = os.path.abspath(survey)
+                images_folder = Path(os.path.relpath(args.images, output_dir)).as_posix()
+                with _working_directory(output_dir), stage("stream_report"):
+                    stream_report(survey_path, images_folder, output_html_file=args.output,
+                                  compare_survey_path=compare_path, chunk_rows=args.chunk_rows,
+                                  max_images=args.max_images, resume=args.resume, shard_size=args.shard_size,
+                                  compact=args.compact, compare_survey=compare_survey,
+                                  map_workers=args.map_workers, map_mode=args.map_mode,
+                                  thumbnail_widths=None if args.full_images else THUMBNAIL_WIDTHS)
+    print(run_log.summary())
+    print(f"Run log saved to {run_log.save(args.run_log)}")
 
 
 if __name__ == '__main__':
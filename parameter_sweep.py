@@ -0,0 +1,155 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from angle_matching import METERS_DIVIDE, candidate_pairs, pair_angles, select_matches
+
+# Angle-diff quantiles reported per parameter combination
+SUMMARY_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Precomputed arrays of the running sweep, set once per worker process
+_sweep_data = None
+
+
+def prepare_sweep(df, candidates=None, meters_divide=METERS_DIVIDE):
+    """
+    Compute the parameter-independent part of matching once: the detection x candidate pairs,
+    their angle differences and distances, and the per-image codes used for deduplication.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey rows (x_image, y_image, real_angle, file_name, additional_matches).
+        candidates (pd.DataFrame | None): Flat candidate table, defaults to additional_matches.
+        meters_divide (float): Degrees -> meters factor.
+
+    Returns:
+        dict: Arrays shared by every combination of the sweep.
+    """
+    pairs = candidate_pairs(df, candidates)
+    file_codes, _ = pd.factorize(df['file_name'])
+    return _sweep_arrays(df, pairs, file_codes, meters_divide)
+
+
+def prepare_store_sweep(store, meters_divide=METERS_DIVIDE):
+    """
+    prepare_sweep from a coordinate_store.CoordinateStore instead of a survey frame, the
+    candidates being the store's additional_matches.
+    """
+    return _sweep_arrays(store, store.candidate_pairs(), store['file_code'], meters_divide)
+
+
+def _sweep_arrays(rows, pairs, file_codes, meters_divide):
+    angle_diff, distance = pair_angles(rows, pairs, meters_divide=meters_divide)
+    return {
+        'n_rows': len(rows),
+        'position': pairs['position'],
+        'tree_id': pd.to_numeric(pd.Series(pairs['id']), errors='coerce').to_numpy(dtype=np.float64),
+        'angle_diff': angle_diff,
+        'distance': distance,
+        'file_code': file_codes,
+    }
+
+
+def evaluate_combination(data, params):
+    """
+    Match with one parameter combination and summarize the result.
+
+    Returns:
+        dict: The parameters plus matched_detections, matches_after_dedupe (one detection per
+        (file_name, tree_id), as clean_df keeps), distinct_trees, with_second_best and angle-diff
+        mean/quantiles of the kept matches.
+    """
+    best, second = select_matches(data['n_rows'], data['position'], data['angle_diff'], data['distance'], **params)
+    diffs = data['angle_diff'][best]
+    tree_ids = data['tree_id'][best]
+    image_tree = np.unique(np.stack([data['file_code'][data['position'][best]].astype(np.float64), tree_ids]),
+                           axis=1)
+
+    summary = dict(params)
+    summary['matched_detections'] = len(best)
+    summary['matches_after_dedupe'] = image_tree.shape[1]
+    summary['distinct_trees'] = len(np.unique(tree_ids))
+    summary['with_second_best'] = len(second)
+    summary['angle_diff_mean'] = float(diffs.mean()) if len(diffs) else np.nan
+    quantiles = np.quantile(diffs, SUMMARY_QUANTILES) if len(diffs) else [np.nan] * len(SUMMARY_QUANTILES)
+    for q, value in zip(SUMMARY_QUANTILES, quantiles):
+        summary[f'angle_diff_p{int(q * 100)}'] = float(value)
+    return summary
+
+
+def _init_worker(data):
+    global _sweep_data
+    _sweep_data = data
+
+
+def _init_store_worker(store, meters_divide):
+    global _sweep_data
+    _sweep_data = prepare_store_sweep(store, meters_divide=meters_divide)
+
+
+def _evaluate_in_worker(params):
+    return evaluate_combination(_sweep_data, params)
+
+
+def parameter_grid(grid):
+    """
+    Expand {'param': [values, ...]} into a list of parameter dicts (cartesian product).
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_sweep(df, grid, candidates=None, workers=None, meters_divide=METERS_DIVIDE):
+    """
+    Evaluate a grid of matching parameters over one survey, sharing all precomputation.
+
+    Args:
+        df (pd.DataFrame): Cleaned survey rows, loaded once by the caller.
+        grid (dict): Lists of values for any of select_matches' parameters (max_angle_diff,
+            max_distance, min_threshold, second_threshold), e.g. {'max_angle_diff': [10, 20, None]}.
+        candidates (pd.DataFrame | None): Flat candidate table, defaults to additional_matches.
+        workers (int | None): Worker processes, None for one per CPU and 1 to run in-process.
+        meters_divide (float): Degrees -> meters factor.
+
+    Returns:
+        pd.DataFrame: One summary row per parameter combination, see evaluate_combination.
+    """
+    data = prepare_sweep(df, candidates=candidates, meters_divide=meters_divide)
+    combinations = parameter_grid(grid)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(combinations) <= 1:
+        summaries = [evaluate_combination(data, params) for params in combinations]
+    else:
+        # The arrays are sent to every worker once, not once per combination
+        with ProcessPoolExecutor(max_workers=min(workers, len(combinations)), initializer=_init_worker,
+                                 initargs=(data,)) as executor:
+            summaries = list(executor.map(_evaluate_in_worker, combinations))
+
+    return pd.DataFrame(summaries)
+
+
+def run_store_sweep(store, grid, workers=None, meters_divide=METERS_DIVIDE):
+    """
+    run_sweep over a coordinate_store.CoordinateStore. Worker processes open the store
+    themselves (memory-mapped, shared through the OS cache) instead of receiving the pair
+    arrays.
+
+    Returns:
+        pd.DataFrame: One summary row per parameter combination, see evaluate_combination.
+    """
+    combinations = parameter_grid(grid)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(combinations) <= 1:
+        data = prepare_store_sweep(store, meters_divide=meters_divide)
+        summaries = [evaluate_combination(data, params) for params in combinations]
+    else:
+        # Only the store's path is sent to the workers
+        with ProcessPoolExecutor(max_workers=min(workers, len(combinations)), initializer=_init_store_worker,
+                                 initargs=(store, meters_divide)) as executor:
+            summaries = list(executor.map(_evaluate_in_worker, combinations))
+
+    return pd.DataFrame(summaries)
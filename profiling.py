@@ -0,0 +1,180 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+RUN_LOG_DIR = "run_logs"
+
+# Run log the stages below report to, None when instrumentation is off
+_active_run = None
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+class RunLog:
+    """
+    Per-stage wall time, row counts and memory of one pipeline run.
+
+    Stages are recorded by name path ("main/clean_df/update_df_with_min_angle_diff"); a stage
+    entered several times (e.g. once per image) is aggregated into one record with its number
+    of calls. Memory is the process' resident-set high-water mark after the stage, which is
+    cheap enough to take around every stage.
+
+    Args:
+        profile_stage (str | None): Name (last path component) of one stage to run under cProfile.
+        profile_dir (str): Where the profiled stage's .prof file is written.
+        top_functions (int): Functions of the cProfile summary kept in the log.
+    """
+
+    def __init__(self, profile_stage=None, profile_dir=RUN_LOG_DIR, top_functions=25):
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.top_functions = top_functions
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.stages = {}
+        self.path = []
+        self.profile = None
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Record the enclosed block as a stage. The yielded dict's "rows" can be set inside the
+        block when the row count is only known there.
+        """
+        self.path.append(name)
+        key = "/".join(self.path)
+        info = {"rows": rows}
+        profiler = None
+        if name == self.profile_stage and self.profile is None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._save_profile(key, profiler)
+            self.path.pop()
+            self._add(key, seconds, info["rows"])
+
+    def _add(self, key, seconds, rows):
+        record = self.stages.setdefault(key, {"stage": key, "calls": 0, "seconds": 0.0, "rows": None})
+        record["calls"] += 1
+        record["seconds"] += seconds
+        if rows is not None:
+            record["rows"] = (record["rows"] or 0) + int(rows)
+        record["rows_per_sec"] = record["rows"] / record["seconds"] if record["rows"] and record["seconds"] else None
+        record["max_rss_mb"] = _max_rss_mb()
+
+    def _save_profile(self, key, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = self.started_at.replace(":", "-")
+        path = os.path.join(self.profile_dir, f"{stamp}_{key.replace('/', '.')}.prof")
+        profiler.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(self.top_functions)
+        self.profile = {"stage": key, "path": path, "summary": summary.getvalue()}
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at,
+            "argv": sys.argv,
+            "max_rss_mb": _max_rss_mb(),
+            "stages": list(self.stages.values()),
+            "profile": self.profile,
+        }
+
+    def save(self, path=None):
+        """
+        Write the run log as JSON, by default to run_logs/run_<start time>.json.
+
+        Returns:
+            str: The path written.
+        """
+        if path is None:
+            path = os.path.join(RUN_LOG_DIR, f"run_{self.started_at.replace(':', '-')}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        return path
+
+    def summary(self):
+        """
+        One line per stage, for printing at the end of a run.
+        """
+        lines = []
+        for record in self.stages.values():
+            rows = f", {record['rows']} rows ({record['rows_per_sec']:.0f}/s)" if record["rows_per_sec"] else ""
+            calls = f" x{record['calls']}" if record["calls"] > 1 else ""
+            lines.append(f"{record['stage']}{calls}: {record['seconds']:.3f}s{rows}, "
+                         f"max RSS {record['max_rss_mb']:.0f} MB")
+        return "\n".join(lines)
+
+
+@contextmanager
+def recording(run_log):
+    """
+    Make run_log the one the stages report to while the block runs.
+    """
+    global _active_run
+    previous, _active_run = _active_run, run_log
+    try:
+        yield run_log
+    finally:
+        _active_run = previous
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Record the enclosed block as a stage of the active run log, a no-op when none is recording.
+    """
+    if _active_run is None:
+        yield {"rows": rows}
+        return
+    with _active_run.stage(name, rows=rows) as info:
+        yield info
+
+
+def timed_stage(name=None, rows_from=None):
+    """
+    Decorator recording every call of a function as a stage.
+
+    Args:
+        name (str | None): Stage name, defaults to the function's name.
+        rows_from (str | None): Argument (name) whose len() is the stage's row count.
+    """
+
+    def decorator(func):
+        stage_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active_run is None:
+                return func(*args, **kwargs)
+            rows = None
+            if rows_from is not None:
+                value = signature.bind_partial(*args, **kwargs).arguments.get(rows_from)
+                rows = len(value) if value is not None else None
+            with _active_run.stage(stage_name, rows=rows):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
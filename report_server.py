@@ -0,0 +1,160 @@
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from extract_needed_images import UNREADABLE_MEMBER_ERRORS, build_zip_index, read_member_with_fallback
+
+
+class LRUBytesCache:
+    """
+    Thread-safe LRU cache of byte strings, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key))
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class ZipImageStore:
+    """
+    Random-access reads of images out of a zip by basename, through the zip's member index
+    (see build_zip_index) and an in-memory LRU cache of hot images.
+    """
+
+    def __init__(self, zip_path, cache_bytes=256 * 1024 * 1024):
+        self.zip_path = zip_path
+        self.index = build_zip_index(zip_path)
+        self.cache = LRUBytesCache(cache_bytes)
+        self.local = threading.local()
+
+    def _zip_file(self):
+        # One handle per server thread, reads seek around the archive
+        if not hasattr(self.local, "zip_file"):
+            self.local.zip_file = open(self.zip_path, "rb")
+        return self.local.zip_file
+
+    def get(self, basename):
+        """
+        Return (data, etag) for the first member with this basename, None if there is none or
+        it can't be read.
+        """
+        entries = self.index.get(basename)
+        if not entries:
+            return None
+        entry = entries[0]
+        etag = f'"{entry[5]:08x}-{entry[4]}"'  # CRC and size
+        data = self.cache.get(basename)
+        if data is None:
+            try:
+                data = read_member_with_fallback(self._zip_file(), self.zip_path, entry)
+            except UNREADABLE_MEMBER_ERRORS as e:
+                print(f"❌ Can't read {entry[0]}: {e}")
+                return None
+            self.cache.put(basename, data)
+        return data, etag
+
+
+class ReportRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the report folder (index.html, maps, ...) from disk, and the images under
+    images_prefix that weren't extracted straight from the zip store.
+    """
+
+    def __init__(self, *args, store=None, images_prefix="detected_images", max_age=86400, **kwargs):
+        self.store = store
+        self.images_prefix = images_prefix.strip("/")
+        self.max_age = max_age
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if not self._send_zip_image(head_only=False):
+            super().do_GET()
+
+    def do_HEAD(self):
+        if not self._send_zip_image(head_only=True):
+            super().do_HEAD()
+
+    def _send_zip_image(self, head_only):
+        path = unquote(urlsplit(self.path).path).lstrip("/")
+        if self.store is None or not path.startswith(f"{self.images_prefix}/"):
+            return False
+        if os.path.exists(self.translate_path(self.path)):
+            return False  # an extracted copy wins
+
+        found = self.store.get(os.path.basename(path))
+        if found is None:
+            return False
+        data, etag = found
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return True
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(data)
+        return True
+
+
+def serve_report(report_dir=".", zip_path=None, images_prefix="detected_images", host="127.0.0.1", port=8000,
+                 cache_bytes=256 * 1024 * 1024):
+    """
+    Serve a generated report locally, reading its images directly out of zip_path so nothing
+    has to be extracted first.
+
+    Args:
+        report_dir (str): Folder holding index.html and maps/.
+        zip_path (str | None): Zip with the detected images, None to serve from disk only.
+        images_prefix (str): URL prefix of the images in the report (e.g. detected_images).
+        host (str): Interface to bind.
+        port (int): Port to listen on.
+        cache_bytes (int): Memory budget of the hot-image cache.
+    """
+    store = ZipImageStore(zip_path, cache_bytes=cache_bytes) if zip_path else None
+    handler = partial(ReportRequestHandler, directory=report_dir, store=store, images_prefix=images_prefix)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving {report_dir} on http://{host}:{server.server_port}/index.html")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+if __name__ == '__main__':
+    serve_report(report_dir=".", zip_path="detected_images.zip", images_prefix="detected_images")
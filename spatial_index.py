@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+# Degrees -> meters, the survey outputs' meters_divide convention
+METERS_DIVIDE = 100000
+
+# Cell keys pack (cell_x, cell_y) into one int64, cell_y shifted to stay non-negative
+_KEY_SHIFT = np.int64(1 << 31)
+_KEY_BASE = np.int64(1 << 32)
+
+# Most (query, tree) pairs compared at once when a query covers the whole grid
+MAX_BRUTE_FORCE_PAIRS = 1 << 22
+
+
+def load_inventory(path="data_tree_with_wgs.csv"):
+    """
+    Load the Seker tree inventory: OBJECTID (the tree_id of the survey outputs) and its WGS x, y.
+    """
+    # The text columns aren't valid utf-8, and only the numeric ones are needed
+    inventory = pd.read_csv(path, usecols=["OBJECTID", "x", "y"], encoding="latin-1")
+    return inventory.dropna(subset=["x", "y"]).reset_index(drop=True)
+
+
+class TreeIndex:
+    """
+    Uniform grid over tree locations, projected to meters with the meters_divide convention.
+
+    Queries take whole arrays of WGS points and are answered with array operations; all
+    distances are in meters.
+
+    Args:
+        x (array-like): Tree longitudes.
+        y (array-like): Tree latitudes.
+        ids (array-like | None): Tree ids, defaults to the row positions.
+        cell_size (float): Grid cell size in meters, about the typical query radius works best.
+        meters_divide (float): Degrees -> meters factor.
+    """
+
+    def __init__(self, x, y, ids=None, cell_size=25.0, meters_divide=METERS_DIVIDE):
+        self.meters_divide = meters_divide
+        self.cell_size = float(cell_size)
+        self.x = np.asarray(x, dtype=np.float64) * meters_divide
+        self.y = np.asarray(y, dtype=np.float64) * meters_divide
+        self.ids = np.arange(len(self.x)) if ids is None else np.asarray(ids)
+        if len(self.x) == 0:
+            raise ValueError("TreeIndex needs at least one tree")
+
+        self.origin = np.array([self.x.min(), self.y.min()])
+        self.extent = np.array([self.x.max(), self.y.max()])
+        cells_x, cells_y = self._cells(self.x, self.y)
+        self.n_cells = int((cells_x.max() + 1) * (cells_y.max() + 1))
+
+        keys = self._keys(cells_x, cells_y)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    @classmethod
+    def from_inventory(cls, inventory, cell_size=25.0, meters_divide=METERS_DIVIDE):
+        return cls(inventory["x"], inventory["y"], ids=inventory["OBJECTID"], cell_size=cell_size,
+                   meters_divide=meters_divide)
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cells(self, px, py):
+        return (np.floor((px - self.origin[0]) / self.cell_size).astype(np.int64),
+                np.floor((py - self.origin[1]) / self.cell_size).astype(np.int64))
+
+    @staticmethod
+    def _keys(cells_x, cells_y):
+        return cells_x * _KEY_BASE + (cells_y + _KEY_SHIFT)
+
+    def _project(self, x, y):
+        return (np.atleast_1d(np.asarray(x, dtype=np.float64)) * self.meters_divide,
+                np.atleast_1d(np.asarray(y, dtype=np.float64)) * self.meters_divide)
+
+    def _covers_grid(self, radius):
+        """
+        Whether the cell neighbourhood of radius is at least the whole grid (queries are then
+        compared with every tree).
+        """
+        reach = int(np.ceil(radius / self.cell_size))
+        return (2 * reach + 1) ** 2 >= self.n_cells
+
+    def _radius_pairs(self, px, py, radius):
+        """
+        All (query, tree) pairs within radius, sorted by query then distance.
+        """
+        if self._covers_grid(radius):
+            # The neighbourhood covers the whole grid - compare with every tree
+            query_of = np.repeat(np.arange(len(px)), len(self))
+            tree_of = np.tile(np.arange(len(self)), len(px))
+        else:
+            reach = int(np.ceil(radius / self.cell_size))
+            steps = np.arange(-reach, reach + 1)
+            offsets_x, offsets_y = (a.ravel() for a in np.meshgrid(steps, steps, indexing="ij"))
+            cells_x, cells_y = self._cells(px, py)
+            keys = self._keys(cells_x[:, None] + offsets_x, cells_y[:, None] + offsets_y).ravel()
+            starts = np.searchsorted(self.sorted_keys, keys, side="left")
+            counts = np.searchsorted(self.sorted_keys, keys, side="right") - starts
+
+            # Expand every (query, cell) range of sorted positions
+            total = int(counts.sum())
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            query_of = np.repeat(np.repeat(np.arange(len(px)), len(offsets_x)), counts)
+            tree_of = self.order[np.repeat(starts, counts) + within]
+
+        distances = np.hypot(self.x[tree_of] - px[query_of], self.y[tree_of] - py[query_of])
+        keep = distances <= radius
+        query_of, tree_of, distances = query_of[keep], tree_of[keep], distances[keep]
+        by_query = np.lexsort((distances, query_of))
+        return query_of[by_query], tree_of[by_query], distances[by_query]
+
+    def query_radius(self, x, y, radius, chunk_size=100000):
+        """
+        Find every tree within radius meters of each query point.
+
+        Args:
+            x (array-like): Query longitudes, e.g. x_tree_image.
+            y (array-like): Query latitudes, e.g. y_tree_image.
+            radius (float): Search radius in meters.
+            chunk_size (int): Queries processed per batch, bounds the memory of the pair arrays.
+
+        Returns:
+            tuple: (query_index, tree_index, distance) arrays, one entry per pair, sorted by
+            query then distance. tree_index points into the index, use ids[tree_index] for tree ids.
+        """
+        return self._query_radius_projected(*self._project(x, y), radius, chunk_size)
+
+    def _query_radius_projected(self, px, py, radius, chunk_size):
+        if self._covers_grid(radius):
+            chunk_size = min(chunk_size, max(1, MAX_BRUTE_FORCE_PAIRS // len(self)))
+        # Non-finite query points have no trees around them
+        finite = np.flatnonzero(np.isfinite(px) & np.isfinite(py))
+        parts = []
+        for start in range(0, len(finite), chunk_size):
+            queries = finite[start:start + chunk_size]
+            query_of, tree_of, distances = self._radius_pairs(px[queries], py[queries], radius)
+            parts.append((queries[query_of], tree_of, distances))
+        if not parts:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def query_knn(self, x, y, k=1, chunk_size=100000):
+        """
+        Find the k nearest trees of each query point.
+
+        Args:
+            x (array-like): Query longitudes.
+            y (array-like): Query latitudes.
+            k (int): Number of neighbours.
+            chunk_size (int): Queries processed per batch.
+
+        Returns:
+            tuple: (tree_index, distance) arrays of shape (n_queries, k), nearest first. Missing
+            neighbours (fewer than k trees) are -1 / inf, non-finite query points get -1 / NaN.
+        """
+        px, py = self._project(x, y)
+        tree_index = np.full((len(px), k), -1, dtype=np.int64)
+        distance = np.full((len(px), k), np.inf)
+        finite = np.isfinite(px) & np.isfinite(py)
+        distance[~finite] = np.nan
+
+        # Grow the radius until it holds k trees; the k nearest are then exactly the first k.
+        # Once the radius reaches across the whole grid the rest are compared with every tree.
+        pending = np.flatnonzero(finite)
+        radius = self.cell_size
+        while len(pending):
+            if self._covers_grid(radius):
+                self._knn_brute_force(px, py, pending, tree_index, distance)
+                break
+            query_of, tree_of, distances = self._query_radius_projected(px[pending], py[pending], radius, chunk_size)
+            counts = np.bincount(query_of, minlength=len(pending))
+            done = counts >= k
+
+            rank = np.arange(len(query_of)) - np.repeat(np.cumsum(counts) - counts, counts)
+            take = done[query_of] & (rank < k)
+            rows = pending[query_of[take]]
+            tree_index[rows, rank[take]] = tree_of[take]
+            distance[rows, rank[take]] = distances[take]
+
+            pending = pending[~done]
+            radius *= 2
+
+        return tree_index, distance
+
+    def _knn_brute_force(self, px, py, queries, tree_index, distance):
+        """
+        Fill the k nearest trees of the given queries by comparing them with every tree, at
+        most MAX_BRUTE_FORCE_PAIRS pairs at a time.
+        """
+        k = min(tree_index.shape[1], len(self))
+        chunk_size = max(1, MAX_BRUTE_FORCE_PAIRS // len(self))
+        for start in range(0, len(queries), chunk_size):
+            rows = queries[start:start + chunk_size]
+            distances = np.hypot(self.x[None, :] - px[rows, None], self.y[None, :] - py[rows, None])
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind="stable")
+            tree_index[rows, :k] = np.take_along_axis(nearest, order, axis=1)
+            distance[rows, :k] = np.take_along_axis(nearest_distances, order, axis=1)
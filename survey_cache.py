@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+
+from clean_data_before_json import clean_df, coerce_survey_types
+from image_summary import group_rows_by_image, summarize_images
+from profiling import stage
+
+# Bump when clean_df changes its output so stale cleaned files are not reused
+CLEAN_DF_VERSION = 3
+
+CACHE_DIR = ".survey_cache"
+
+SURVEY_ROW_GROUP_SIZE = 65536
+
+# Columns clean_df and the report read, of both the TLV and the small survey outputs. Survey
+# exports have ~35 columns, loading only these saves memory and parsing time.
+REPORT_COLUMNS = ['file_name', 'file_name_with_detections', 'x_image', 'y_image', 'heading', 'possible_trees',
+                  'additional_matches', 'tree_index', 'real_angle', 'x_tree_image', 'y_tree_image', 'tree_id',
+                  'tree_name', 'name_eng', 'name_heb', 'type_1', 'type_2', 'type_3', 'tree_name_code',
+                  'tree_name_big_csv', 'x_tree', 'y_tree', 'best_angle_diff']
+
+# Schema metadata key listing columns stored as JSON text (nested and mixed-type object columns)
+JSON_COLUMNS_KEY = b"survey_cache.json_columns"
+
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """
+    Return the sha256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _to_arrow_column(values):
+    try:
+        # Nested values (additional_matches' lists of dicts) would become list<struct>, which
+        # adds the keys other dicts have as None and turns ints mixed with floats into floats
+        as_json = pa.types.is_nested(pa.array(values, from_pandas=True).type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed types (e.g. ints and the "None" sentinel)
+        as_json = True
+    if not as_json:
+        return values, False
+    # Keep them exact as JSON text
+    return values.map(lambda x: None if x is None else json.dumps(x, ensure_ascii=False)), True
+
+
+def write_cached_frame(df, path):
+    """
+    Write a survey dataframe to Parquet. Object columns of nested values (additional_matches
+    lists) or of types Arrow can't type are stored as JSON text, so they read back exactly.
+    """
+    encoded = df.copy()
+    json_columns = []
+    for column in encoded.columns[encoded.dtypes == object]:
+        encoded[column], as_json = _to_arrow_column(encoded[column])
+        if as_json:
+            json_columns.append(column)
+
+    table = pa.Table.from_pandas(encoded, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[JSON_COLUMNS_KEY] = json.dumps(json_columns).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # Row groups small enough to stream the file in chunks, see iter_survey_chunks
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path, row_group_size=SURVEY_ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+
+def read_cached_frame(path):
+    """
+    Read a dataframe written by write_cached_frame, memory-mapping the Parquet file.
+    """
+    return _table_to_frame(pq.read_table(path, memory_map=True))
+
+
+def _table_to_frame(table):
+    json_columns = json.loads((table.schema.metadata or {}).get(JSON_COLUMNS_KEY, b"[]"))
+
+    nested = [name for name in table.column_names
+              if name not in json_columns and pa.types.is_list(table.schema.field(name).type)]
+    # Parquet only restores string dictionaries, the other categoricals (compact mode's numeric
+    # name_eng/name_heb) come back as plain values and are encoded again
+    pandas_columns = json.loads((table.schema.metadata or {}).get(b"pandas", b"{}")).get("columns", [])
+    categorical = [column["name"] for column in pandas_columns if column["pandas_type"] == "categorical"
+                   and column["name"] in table.column_names
+                   and not pa.types.is_dictionary(table.schema.field(column["name"]).type)]
+    for name in categorical:
+        position = table.column_names.index(name)
+        table = table.set_column(position, name, pc.dictionary_encode(table.column(name)))
+    df = table.drop_columns(nested).to_pandas()
+    for name in categorical:
+        # As astype("category") orders them
+        df[name] = df[name].cat.reorder_categories(sorted(df[name].cat.categories))
+    # Arrow has one null, which to_pandas gives as None in object columns; the frames written
+    # (as read_excel and clean_df make them) hold NaN there
+    for column in df.columns[df.dtypes == object]:
+        if column in json_columns:
+            continue
+        values = df[column].to_numpy()
+        missing = pd.isna(values)
+        if missing.any():
+            values = values.copy()
+            values[missing] = np.nan
+            df[column] = values
+    for column in json_columns:
+        df[column] = df[column].map(lambda x: None if x is None else json.loads(x))
+    for column in nested:
+        position = table.column_names.index(column)
+        values = pd.Series(table.column(column).to_pylist(), index=df.index, dtype=object)
+        df.insert(min(position, len(df.columns)), column, values)
+
+    return df
+
+
+def load_raw_survey(path, cache_dir=CACHE_DIR):
+    """
+    Load a survey output workbook, converting it to Parquet once per file content.
+
+    Args:
+        path (str): Path to the survey xlsx.
+        cache_dir (str): Folder holding the cached Parquet files.
+
+    Returns:
+        pd.DataFrame: The raw survey rows, as pd.read_excel would return them.
+    """
+    return _load_raw_survey(path, file_content_hash(path), cache_dir)
+
+
+def raw_survey_parquet(path, cache_dir=CACHE_DIR):
+    """
+    Path of the raw Parquet copy of a survey workbook, converting it first if needed.
+    """
+    content_hash = file_content_hash(path)
+    cache_path = os.path.join(cache_dir, f"{content_hash}_raw.parquet")
+    if not os.path.exists(cache_path):
+        _load_raw_survey(path, content_hash, cache_dir)
+    return cache_path
+
+
+def iter_survey_chunks(path, chunk_rows=50000, columns=None, cache_dir=CACHE_DIR):
+    """
+    Read a survey output in chunks of about chunk_rows rows, as read_excel/read_csv would return them.
+
+    CSV and Parquet files are streamed directly. Workbooks are streamed from their raw Parquet
+    cache when there is one (see load_raw_survey), and otherwise from the workbook itself.
+
+    Args:
+        path (str): Survey output (xlsx, csv or parquet).
+        chunk_rows (int): Rows per chunk.
+        columns (list | None): Columns to read, in the file's order. The ones missing from the
+            file are skipped.
+            With a projection, chunks go through clean_df's type coercions (coerce_survey_types).
+            None reads every column, as is.
+        cache_dir (str): Folder holding the cached Parquet files.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        usecols = None if columns is None else (lambda column: column in columns)
+        chunks = pd.read_csv(path, chunksize=chunk_rows, usecols=usecols)
+    elif extension == ".parquet":
+        chunks = _iter_parquet_chunks(path, chunk_rows, columns)
+    elif columns is None:
+        chunks = _iter_parquet_chunks(raw_survey_parquet(path, cache_dir), chunk_rows, columns)
+    else:
+        cache_path = os.path.join(cache_dir, f"{file_content_hash(path)}_raw.parquet")
+        chunks = _iter_parquet_chunks(cache_path, chunk_rows, columns) if os.path.exists(cache_path) else \
+            _iter_xlsx_chunks(path, chunk_rows, columns)
+
+    for chunk in chunks:
+        yield chunk if columns is None else coerce_survey_types(chunk)
+
+
+def _iter_parquet_chunks(path, chunk_rows, columns):
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    schema = parquet_file.schema_arrow
+    if columns is not None:
+        columns = [column for column in schema.names if column in columns]
+        schema = pa.schema([schema.field(column) for column in columns], metadata=schema.metadata)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield _table_to_frame(pa.Table.from_batches([batch], schema=schema))
+
+
+def _iter_xlsx_chunks(path, chunk_rows, columns):
+    """
+    Stream the first sheet of a workbook with openpyxl's read-only mode, keeping only columns.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        # Unnamed header cells are named like read_excel names them
+        header = [f"Unnamed: {position}" if name is None else str(name)
+                  for position, name in enumerate(next(rows, ()))]
+        positions = [position for position, column in enumerate(header) if column in columns]
+        names = [header[position] for position in positions]
+
+        chunk = []
+        for row in rows:
+            # Empty cells are "" like in read_excel, the parser below makes them NaN
+            chunk.append(["" if position >= len(row) or row[position] is None else row[position]
+                          for position in positions])
+            if len(chunk) == chunk_rows:
+                yield _records_to_frame(chunk, names)
+                chunk = []
+        if chunk:
+            yield _records_to_frame(chunk, names)
+    finally:
+        workbook.close()
+
+
+def _records_to_frame(records, names):
+    # The parser read_excel runs on the cell values (numbers stored as text, "None" -> NaN, ...)
+    with TextParser([names] + records, header=0) as parser:
+        return parser.read()
+
+
+def _load_raw_survey(path, content_hash, cache_dir):
+    cache_path = os.path.join(cache_dir, f"{content_hash}_raw.parquet")
+    if os.path.exists(cache_path):
+        with stage("read_raw_cache") as info:
+            df = read_cached_frame(cache_path)
+            info["rows"] = len(df)
+        return df
+
+    with stage("read_excel") as info:
+        df = pd.read_excel(path)
+        info["rows"] = len(df)
+    with stage("write_raw_cache", rows=len(df)):
+        write_cached_frame(df, cache_path)
+    return df
+
+
+def load_clean_survey(path, is_small_survey=False, compact=False, with_summary=False, cache_dir=CACHE_DIR):
+    """
+    Load a survey output workbook and run clean_df on it, caching both the raw and cleaned
+    frames as Parquet, with the cleaned frame's per-image summary next to it. The cleaned
+    cache is keyed by the file content, the cleaning parameters and CLEAN_DF_VERSION.
+
+    Args:
+        path (str): Path to the survey xlsx.
+        is_small_survey (bool): Passed to clean_df.
+        compact (bool): Passed to clean_df.
+        with_summary (bool): Also return the per-image summary (see summarize_images).
+        cache_dir (str): Folder holding the cached Parquet files.
+
+    Returns:
+        pd.DataFrame: The cleaned survey, with additional_matches as lists of dicts, or
+        (cleaned survey, summary) with with_summary=True.
+    """
+    with stage("hash_file"):
+        content_hash = file_content_hash(path)
+    params = {"is_small_survey": is_small_survey, "compact": compact, "clean_df_version": CLEAN_DF_VERSION}
+    cache_path = os.path.join(cache_dir, f"{content_hash}_clean_{_params_hash(params)}.parquet")
+    summary_path = image_summary_path(cache_path)
+    if os.path.exists(cache_path):
+        with stage("read_clean_cache") as info:
+            df = read_cached_frame(cache_path)
+            info["rows"] = len(df)
+        if not with_summary:
+            return df
+        if os.path.exists(summary_path):
+            with stage("read_image_summary"):
+                return df, pd.read_parquet(summary_path)
+        df = group_rows_by_image(df)
+        summary = summarize_images(df)
+    else:
+        df, summary = clean_df(df=_load_raw_survey(path, content_hash, cache_dir), is_small_survey=is_small_survey,
+                               compact=compact, with_summary=True)
+        with stage("write_clean_cache", rows=len(df)):
+            write_cached_frame(df, cache_path)
+
+    with stage("write_image_summary", rows=len(summary)):
+        write_image_summary(summary, summary_path)
+    return (df, summary) if with_summary else df
+
+
+def image_summary_path(cache_path):
+    """
+    Path of the per-image summary stored next to a cleaned survey's Parquet file.
+    """
+    return f"{os.path.splitext(cache_path)[0]}_images.parquet"
+
+
+def write_image_summary(summary, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    summary.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
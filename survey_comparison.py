@@ -0,0 +1,160 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# Columns a detection is identified by across survey outputs
+DETECTION_KEYS = ['file_name', 'tree_index']
+
+# Agreement of two surveys on one detection
+SAME_TREE, DIFFERENT_TREE, ONE_UNMATCHED, BOTH_UNMATCHED = 0, 1, 2, 3
+AGREEMENT_LABELS = {SAME_TREE: "same tree", DIFFERENT_TREE: "different tree", ONE_UNMATCHED: "one side unmatched",
+                    BOTH_UNMATCHED: "both unmatched"}
+
+
+def common_images(surveys):
+    """
+    file_names present in every survey, in the first survey's order.
+    """
+    frames = list(surveys.values())
+    names = pd.Index(frames[0]['file_name'].unique())
+    for df in frames[1:]:
+        names = names.intersection(pd.Index(df['file_name'].unique()), sort=False)
+    return names
+
+
+def partial_images(surveys):
+    """
+    Images present in some of the surveys but not in all of them, which common_images leaves
+    out of the comparison.
+
+    Returns:
+        pd.DataFrame: Indexed by file_name in order of first appearance, one bool column per
+        survey telling whether it has the image.
+    """
+    present = {name: pd.Index(df['file_name'].unique()) for name, df in surveys.items()}
+    names = pd.Index(pd.unique(np.concatenate([index.to_numpy(dtype=object) for index in present.values()])),
+                     name='file_name')
+    coverage = pd.DataFrame({name: names.isin(index) for name, index in present.items()}, index=names)
+    return coverage[~coverage.all(axis=1)]
+
+
+def _detection_rows(name, df):
+    """
+    The file_name, tree_index and tree_id of a survey's detections, without the rows missing a
+    key (reported, they can't be aligned).
+
+    Raises:
+        ValueError: When rows share their (file_name, tree_index), which detection the other
+            surveys' rows align with would be ambiguous.
+    """
+    rows = df[DETECTION_KEYS + ['tree_id']]
+    missing = rows[DETECTION_KEYS].isna().any(axis=1).to_numpy()
+    if missing.any():
+        print(f"⚠️ {name}: {missing.sum()} detections without a file_name or tree_index left out of the comparison")
+        rows = rows[~missing]
+    duplicated = rows.duplicated(DETECTION_KEYS, keep=False).to_numpy()
+    if duplicated.any():
+        examples = rows.loc[duplicated, DETECTION_KEYS].drop_duplicates().head(3).itertuples(index=False)
+        raise ValueError(f"{name} has {duplicated.sum()} rows sharing their (file_name, tree_index), e.g. "
+                         + ", ".join(f"({file_name}, {tree_index})" for file_name, tree_index in examples))
+    return rows
+
+
+def align_surveys(surveys, images=None):
+    """
+    Align the detections of any number of surveys on (file_name, tree_index), in one outer join.
+    Rows without a file_name or tree_index are left out (and reported), rows sharing their key
+    raise a ValueError.
+
+    Args:
+        surveys (dict): Survey name -> cleaned survey (see clean_data_before_json.clean_df).
+        images (pd.Index | None): file_names to align, common_images(surveys) by default. Images
+            missing from a survey would make all of their detections disagree, see
+            partial_images for them.
+
+    Returns:
+        pd.DataFrame: One row per detection of any survey, indexed by (file_name, tree_index) in
+        order of first appearance, with one column per survey holding the tree_id it matched
+        the detection to (float, NaN when unmatched or not detected by that survey).
+    """
+    if images is None:
+        images = common_images(surveys)
+    columns = []
+    for name, df in surveys.items():
+        rows = _detection_rows(name, df)
+        rows = rows[rows['file_name'].isin(images)]
+        index = pd.MultiIndex.from_arrays([rows['file_name'].astype(object).to_numpy(),
+                                           pd.to_numeric(rows['tree_index']).to_numpy(dtype=np.int64)],
+                                          names=DETECTION_KEYS)
+        tree_ids = pd.to_numeric(rows['tree_id'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        columns.append(pd.Series(tree_ids, index=index, name=name))
+    return pd.concat(columns, axis=1, join='outer', sort=False)
+
+
+def pair_agreement(tree_ids_a, tree_ids_b):
+    """
+    Agreement of two surveys on every detection: SAME_TREE, DIFFERENT_TREE, ONE_UNMATCHED or
+    BOTH_UNMATCHED, from two aligned tree_id arrays (NaN when unmatched).
+    """
+    matched_a = ~np.isnan(tree_ids_a)
+    matched_b = ~np.isnan(tree_ids_b)
+    agreement = np.full(len(tree_ids_a), BOTH_UNMATCHED, dtype=np.int8)
+    agreement[matched_a != matched_b] = ONE_UNMATCHED
+    both = matched_a & matched_b
+    agreement[both] = np.where(tree_ids_a[both] == tree_ids_b[both], SAME_TREE, DIFFERENT_TREE)
+    return agreement
+
+
+def agreement_stats(aligned):
+    """
+    Agreement statistics of every pair of surveys.
+
+    Args:
+        aligned (pd.DataFrame): Aligned detections (see align_surveys).
+
+    Returns:
+        pd.DataFrame: survey_a, survey_b, detections, same_tree, different_tree, one_unmatched,
+        both_unmatched and agreement (share of same_tree among the detections matched by
+        either survey).
+    """
+    stats = []
+    for survey_a, survey_b in itertools.combinations(aligned.columns, 2):
+        agreement = pair_agreement(aligned[survey_a].to_numpy(), aligned[survey_b].to_numpy())
+        counts = np.bincount(agreement, minlength=len(AGREEMENT_LABELS))
+        matched = counts[SAME_TREE] + counts[DIFFERENT_TREE] + counts[ONE_UNMATCHED]
+        stats.append({'survey_a': survey_a, 'survey_b': survey_b, 'detections': len(agreement),
+                      'same_tree': counts[SAME_TREE], 'different_tree': counts[DIFFERENT_TREE],
+                      'one_unmatched': counts[ONE_UNMATCHED], 'both_unmatched': counts[BOTH_UNMATCHED],
+                      'agreement': counts[SAME_TREE] / matched if matched else np.nan})
+    return pd.DataFrame(stats, columns=['survey_a', 'survey_b', 'detections', 'same_tree', 'different_tree',
+                                        'one_unmatched', 'both_unmatched', 'agreement'])
+
+
+def disagreeing_detections(aligned):
+    """
+    Mask of the detections the surveys disagree on: matched by some surveys and not by others,
+    or matched to different trees.
+    """
+    tree_ids = aligned.to_numpy(dtype=np.float64)
+    matched = ~np.isnan(tree_ids)
+    # fmin/fmax skip the NaNs, all matched ids are equal when the lowest is the highest
+    lowest = np.fmin.reduce(tree_ids, axis=1)
+    highest = np.fmax.reduce(tree_ids, axis=1)
+    return matched.any(axis=1) & (~matched.all(axis=1) | (lowest != highest))
+
+
+def disagreeing_images(aligned):
+    """
+    Aligned detections (see align_surveys) of the images with at least one disagreeing
+    detection, with an agreement column per survey pair ("<a> vs <b>", see pair_agreement).
+
+    Returns:
+        dict: file_name -> its aligned detections, all of them, in the aligned order.
+    """
+    disagree = disagreeing_detections(aligned)
+    file_names = aligned.index.get_level_values('file_name')
+    rows = aligned[file_names.isin(pd.unique(file_names[disagree]))].copy()
+    for survey_a, survey_b in itertools.combinations(aligned.columns, 2):
+        rows[f"{survey_a} vs {survey_b}"] = pair_agreement(rows[survey_a].to_numpy(), rows[survey_b].to_numpy())
+    return {file_name: group for file_name, group in rows.groupby(level='file_name', sort=False)}
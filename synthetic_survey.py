@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+# Column order of the survey output workbooks (e.g. images_rerun_...xlsx)
+SURVEY_COLUMNS = ['Unnamed: 0', 'row_id', 'file_name', 'file_name_with_detections', 'x_image', 'y_image', 'heading',
+                  'possible_trees', 'additional_matches', 'tree_index', 'tree_file_name', 'x_box', 'y_box',
+                  'width_box', 'height_box', 'x_bottom', 'y_bottom', 'meters_to_tree', 'distance_to_tree',
+                  'angle_to_tree', 'real_angle', 'x_distance', 'y_distance', 'x_tree_image', 'y_tree_image',
+                  'tree_id', 'tree_name', 'name_eng', 'name_heb', 'type_1', 'type_2', 'type_3', 'x_tree', 'y_tree',
+                  'best_angle_diff']
+
+# (tree_name, Name_Heb, Name_Eng, Tree_Type_Hirar_1/2/3) of common species in the surveys
+TREE_SPECIES = [
+    ('פיקוס השדרות', 178, 98, 'עץ', 'רחב עלים', 'רחב'),
+    ('אשל הפרקים', 20, 230, 'עץ', 'מחטני', 'רחב'),
+    ('ברכיכיטון צפצפתי', 40, 74, 'עץ', 'רחב עלים', 'צריפי'),
+    ('סיסם הודי', 157, 63, 'עץ', 'רחב עלים', 'רחב'),
+    ('וושינגטוניה חסונה', 116, 259, 'דקל', 'כפני', 'גבוה'),
+    ('ברכיכטון אדרי', 79, 73, 'עץ', 'רחב עלים', 'צריפי'),
+    ('מיש - שונים', 138, 45, 'עץ', 'רחב עלים', 'רחב'),
+    ('סיגלון עלי-מימוסה', 154, 131, 'עץ', 'רחב עלים', 'רחב'),
+    ('תמר מצוי', 253, 192, 'דקל', 'מנוצה', 'גבוה'),
+]
+
+# Tel Aviv bounding box of the survey car locations (WGS)
+SURVEY_BOUNDS = ((34.74, 34.85), (32.03, 32.14))
+
+# Degrees -> meters, the survey outputs' meters_divide convention
+METERS_DIVIDE = 100000
+
+
+def _format_matches(ids, xs, ys, species, offsets):
+    """
+    additional_matches strings as written by the survey pipeline: Python reprs of lists of dicts.
+    """
+    entries = [
+        f"{{'id': {tree_id}, 'location_x': {x!r}, 'location_y': {y!r}, 'tree_name': '{TREE_SPECIES[s][0]}', "
+        f"'Name_Heb': {TREE_SPECIES[s][1]}, 'Name_Eng': {TREE_SPECIES[s][2]}, "
+        f"'Tree_Type_Hirar_1': '{TREE_SPECIES[s][3]}', 'Tree_Type_Hirar_2': '{TREE_SPECIES[s][4]}', "
+        f"'Tree_Type_Hirar_3': '{TREE_SPECIES[s][5]}'}}"
+        for tree_id, x, y, s in zip(ids.tolist(), xs.tolist(), ys.tolist(), species.tolist())
+    ]
+    return ["[" + ", ".join(entries[start:end]) + "]" for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def make_synthetic_survey(n_rows, seed=0, mean_detections=5, mean_candidates=4, unmatched_fraction=0.3,
+                          n_trees=50000):
+    """
+    Generate a survey output table with the real schema (SURVEY_COLUMNS), as read_excel returns it.
+
+    Every image has a geometric number of detections, every detection a Poisson number of
+    candidate trees around it (the additional_matches string) and, unless unmatched, one of
+    them as its best match with the matching angle difference. Unmatched detections have NaN
+    tree fields, like the survey workbooks.
+
+    Args:
+        n_rows (int): Number of detections (rows).
+        seed (int): Random seed, the same seed gives the same table.
+        mean_detections (float): Average detections per image.
+        mean_candidates (float): Average candidate trees per detection.
+        unmatched_fraction (float): Share of detections with candidates but no best match.
+        n_trees (int): Size of the synthetic tree id range.
+
+    Returns:
+        pd.DataFrame: The synthetic survey.
+    """
+    if n_rows < 1:
+        raise ValueError("n_rows must be positive")
+    rng = np.random.default_rng(seed)
+
+    # Images and their detections
+    per_image = rng.geometric(1 / mean_detections, size=n_rows)
+    n_images = int(np.searchsorted(np.cumsum(per_image), n_rows)) + 1
+    per_image = per_image[:n_images]
+    image_of = np.repeat(np.arange(n_images), per_image)[:n_rows]
+    per_image = np.bincount(image_of, minlength=n_images)
+    tree_index = np.arange(n_rows) - np.repeat(np.cumsum(per_image) - per_image, per_image) + 1
+
+    image_x = rng.uniform(*SURVEY_BOUNDS[0], size=n_images)
+    image_y = rng.uniform(*SURVEY_BOUNDS[1], size=n_images)
+    image_heading = rng.choice([180, 240], size=n_images, p=[0.1, 0.9])
+    file_names = np.array([f"tel aviv_heading={h}.0&fov=64.0&location={y!r},{x!r}&source=outdoor.jpg"
+                           for h, x, y in zip(image_heading.tolist(), image_x.tolist(), image_y.tolist())],
+                          dtype=object)
+    detections_names = np.array([f"/data/detected_images/{count}_segmented_{name}"
+                                 for count, name in zip(per_image.tolist(), file_names.tolist())], dtype=object)
+
+    x_image = image_x[image_of]
+    y_image = image_y[image_of]
+
+    # Detected tree location from the car
+    real_angle = rng.uniform(0, 2 * np.pi, size=n_rows)
+    meters_to_tree = rng.lognormal(mean=np.log(70), sigma=0.8, size=n_rows)
+    x_distance = np.sin(real_angle) * meters_to_tree / METERS_DIVIDE
+    y_distance = np.cos(real_angle) * meters_to_tree / METERS_DIVIDE
+    x_tree_image = x_image + x_distance
+    y_tree_image = y_image + y_distance
+
+    # Candidate trees, scattered a few meters around the detected location
+    possible_trees = rng.poisson(mean_candidates, size=n_rows)
+    offsets = np.concatenate([[0], np.cumsum(possible_trees)])
+    owner = np.repeat(np.arange(n_rows), possible_trees)
+    candidate_ids = rng.integers(1, n_trees + 1, size=len(owner))
+    candidate_species = candidate_ids % len(TREE_SPECIES)
+    candidate_x = x_tree_image[owner] + rng.normal(0, 8, size=len(owner)) / METERS_DIVIDE
+    candidate_y = y_tree_image[owner] + rng.normal(0, 8, size=len(owner)) / METERS_DIVIDE
+    additional_matches = _format_matches(candidate_ids, candidate_x, candidate_y, candidate_species, offsets)
+
+    # Best match: a random candidate of the matched detections
+    matched = (possible_trees > 0) & (rng.random(n_rows) >= unmatched_fraction)
+    pick = offsets[:-1] + (rng.random(n_rows) * np.maximum(possible_trees, 1)).astype(np.int64)
+    pick = np.where(matched, pick, 0)
+
+    def matched_values(values):
+        if not len(values):
+            return np.full(n_rows, np.nan)
+        return np.where(matched, values[pick].astype(np.float64), np.nan)
+
+    x_tree = matched_values(candidate_x)
+    y_tree = matched_values(candidate_y)
+    bearing = np.arctan2(x_tree - x_image, y_tree - y_image)
+    best_angle_diff = np.abs(np.degrees((bearing - real_angle + np.pi) % (2 * np.pi) - np.pi))
+    species = matched_values(candidate_species)
+    species_table = pd.DataFrame(TREE_SPECIES, columns=['tree_name', 'name_heb', 'name_eng', 'type_1', 'type_2',
+                                                        'type_3'])
+    species_rows = species_table.reindex(pd.Series(species).astype('Int64')).reset_index(drop=True)
+
+    x_box = rng.uniform(0, 1, size=n_rows)
+    y_box = rng.uniform(0.2, 0.8, size=n_rows)
+
+    df = pd.DataFrame({
+        'Unnamed: 0': np.arange(n_rows),
+        'row_id': np.arange(1, n_rows + 1),
+        'file_name': file_names[image_of],
+        'file_name_with_detections': detections_names[image_of],
+        'x_image': x_image,
+        'y_image': y_image,
+        'heading': image_heading[image_of],
+        'possible_trees': possible_trees,
+        'additional_matches': additional_matches,
+        'tree_index': tree_index,
+        'tree_file_name': [f"{index - 1}_{name}" for index, name in zip(tree_index.tolist(),
+                                                                         file_names[image_of].tolist())],
+        'x_box': x_box,
+        'y_box': y_box,
+        'width_box': rng.uniform(0.02, 0.5, size=n_rows),
+        'height_box': rng.uniform(0.1, 0.8, size=n_rows),
+        'x_bottom': x_box - 0.5,
+        'y_bottom': rng.uniform(0, 0.5, size=n_rows),
+        'meters_to_tree': meters_to_tree,
+        'distance_to_tree': meters_to_tree / METERS_DIVIDE,
+        'angle_to_tree': rng.uniform(-32, 32, size=n_rows),
+        'real_angle': real_angle,
+        'x_distance': x_distance,
+        'y_distance': y_distance,
+        'x_tree_image': x_tree_image,
+        'y_tree_image': y_tree_image,
+        'tree_id': matched_values(candidate_ids),
+        'tree_name': species_rows['tree_name'].to_numpy(),
+        'name_eng': species_rows['name_eng'].astype(np.float64).to_numpy(),
+        'name_heb': species_rows['name_heb'].astype(np.float64).to_numpy(),
+        'type_1': species_rows['type_1'].to_numpy(),
+        'type_2': species_rows['type_2'].to_numpy(),
+        'type_3': species_rows['type_3'].to_numpy(),
+        'x_tree': x_tree,
+        'y_tree': y_tree,
+        'best_angle_diff': np.where(matched, best_angle_diff, np.nan),
+    })
+    return df[SURVEY_COLUMNS]
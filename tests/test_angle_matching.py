@@ -0,0 +1,110 @@
+import math
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from angle_matching import METERS_DIVIDE, match_detections, rematch_df
+from clean_data_before_json import clean_df
+from synthetic_survey import make_synthetic_survey
+
+
+def reference_matches(df, max_angle_diff=None, max_distance=None, min_threshold=None, second_threshold=None):
+    """
+    match_detections with a per-candidate loop and a pandas sort/groupby: candidates ranked by
+    angle diff within each detection, ties kept in additional_matches order.
+    """
+    pairs = []
+    for position, (x_car, y_car, real_angle, matches) in enumerate(
+            zip(df['x_image'], df['y_image'], df['real_angle'], df['additional_matches'])):
+        for order, match in enumerate(matches or []):
+            dx, dy = match['location_x'] - x_car, match['location_y'] - y_car
+            bearing = math.atan2(dx, dy)
+            angle_diff = abs(math.degrees((bearing - real_angle + math.pi) % (2 * math.pi) - math.pi))
+            distance = math.hypot(dx, dy) * METERS_DIVIDE
+            if max_angle_diff is not None and angle_diff > max_angle_diff:
+                continue
+            if max_distance is not None and distance > max_distance:
+                continue
+            pairs.append({'position': position, 'order': order, 'id': match['id'], 'tree_name': match['tree_name'],
+                          'x_tree': match['location_x'], 'y_tree': match['location_y'], 'angle_diff': angle_diff})
+    pairs = pd.DataFrame(pairs, columns=['position', 'order', 'id', 'tree_name', 'x_tree', 'y_tree', 'angle_diff'])
+    pairs = pairs.sort_values(['position', 'angle_diff', 'order'], kind='stable')
+    pairs['rank'] = pairs.groupby('position').cumcount()
+    best = pairs[pairs['rank'] == 0].set_index('position')
+    second = pairs[pairs['rank'] == 1].set_index('position')
+
+    result = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    result['tree_id'] = best['id'].astype(np.float64)
+    result['tree_name'] = best['tree_name'].astype(object)
+    result['x_tree'] = best['x_tree'].astype(np.float64)
+    result['y_tree'] = best['y_tree'].astype(np.float64)
+    result['best_angle_diff'] = best['angle_diff'].astype(np.float64)
+    result['second_best_match_tree'] = second['id'].astype(np.float64)
+    result['second_best_angle_diff'] = second['angle_diff'].astype(np.float64)
+    if min_threshold is not None and second_threshold is not None:
+        runner_up = result['second_best_angle_diff'].fillna(np.inf)
+        drop = ~((result['best_angle_diff'] < min_threshold) & (runner_up > second_threshold))
+        result.loc[drop, ['tree_id', 'x_tree', 'y_tree', 'best_angle_diff']] = np.nan
+        result.loc[drop, 'tree_name'] = None
+    result['tree_name'] = result['tree_name'].astype(object).where(result['tree_name'].notna(), None)
+    result.index = df.index
+    return result
+
+
+@pytest.fixture(scope="module")
+def survey():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        df = clean_df(make_synthetic_survey(600, seed=14))
+    df = df.reset_index(drop=True)
+    matches = df['additional_matches'].tolist()
+    # Detections without candidates
+    matches[0] = []
+    matches[1] = []
+    # Ties: the same location under two ids, the first one listed wins
+    matches[2] = [dict(matches[2][0], id=111), dict(matches[2][0], id=222)]
+    matches[3] = [dict(matches[3][-1], id=333)] + matches[3]
+    df['additional_matches'] = matches
+    return df
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {'max_angle_diff': 10},
+    {'max_distance': 40},
+    {'max_distance': 0},
+    {'max_angle_diff': 30, 'max_distance': 80},
+    {'min_threshold': 15, 'second_threshold': 5},
+    {'max_distance': 60, 'min_threshold': 15, 'second_threshold': 5},
+])
+def test_matches_equal_the_reference(survey, params):
+    expected = reference_matches(survey, **params)
+    actual = match_detections(survey, **params)
+    pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-9)
+
+
+def test_ties_and_detections_without_candidates(survey):
+    matches = match_detections(survey)
+    assert matches['tree_id'].iloc[:2].isna().all()
+    assert matches['second_best_match_tree'].iloc[:2].isna().all()
+    assert (matches.loc[2, 'tree_id'], matches.loc[2, 'second_best_match_tree']) == (111, 222)
+    assert matches.loc[2, 'best_angle_diff'] == matches.loc[2, 'second_best_angle_diff']
+
+
+def test_max_distance_zero_matches_nothing(survey):
+    assert match_detections(survey, max_distance=0)['tree_id'].isna().all()
+
+
+def test_rematch_df(survey):
+    params = {'max_angle_diff': 20, 'min_threshold': 15, 'second_threshold': 5}
+    expected = reference_matches(survey, **params)
+    rematched = rematch_df(survey, **params)
+    assert rematched.columns.tolist() == survey.columns.tolist() + ['matched_details']
+    for column in ['tree_id', 'x_tree', 'y_tree', 'best_angle_diff']:
+        np.testing.assert_allclose(rematched[column], expected[column], rtol=1e-9)
+    second = [details['second_best_match_tree'] for details in rematched['matched_details']]
+    assert second == [None if np.isnan(tree) else int(tree) for tree in expected['second_best_match_tree']]
+    # Columns that aren't matched are untouched
+    pd.testing.assert_series_equal(rematched['file_name'], survey['file_name'])
@@ -0,0 +1,23 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from clean_data_before_json import clean_df
+from synthetic_survey import make_synthetic_survey
+
+
+def clean(df, compact):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return clean_df(df.copy(), compact=compact)
+
+
+def test_rendered_values_keep_full_precision():
+    df = make_synthetic_survey(2000, seed=5)
+    full, compact = clean(df, False), clean(df, True)
+    for column in ['real_angle', 'best_angle_diff', 'tree_id', 'x_tree', 'y_tree', 'x_image', 'x_tree_image']:
+        assert compact[column].dtype == np.float64, column
+        np.testing.assert_array_equal(compact[column].to_numpy(), full[column].to_numpy())
+    assert isinstance(compact['file_name'].dtype, pd.CategoricalDtype)
+    assert compact['x_box'].dtype == np.float32
@@ -0,0 +1,50 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+import coordinate_store
+from clean_data_before_json import clean_df
+from coordinate_store import load_coordinate_store, write_coordinate_store
+from parameter_sweep import run_store_sweep, run_sweep
+from synthetic_survey import make_synthetic_survey
+
+GRID = {'max_angle_diff': [10, None], 'max_distance': [50, None], 'min_threshold': [None, 15],
+        'second_threshold': [5]}
+
+
+@pytest.fixture(scope="module")
+def cleaned():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return clean_df(make_synthetic_survey(2000, seed=9))
+
+
+def test_store_sweep_matches_frame_sweep(cleaned, tmp_path):
+    path = str(tmp_path / "store")
+    write_coordinate_store(cleaned, path)
+    expected = run_sweep(cleaned, GRID, workers=1)
+    pd.testing.assert_frame_equal(run_store_sweep(coordinate_store.CoordinateStore(path), GRID, workers=1), expected)
+    # Workers open the store from its path
+    pd.testing.assert_frame_equal(run_store_sweep(coordinate_store.CoordinateStore(path), GRID, workers=2), expected)
+
+
+def test_second_load_hits_the_cache(tmp_path, monkeypatch):
+    survey_path = tmp_path / "survey.xlsx"
+    make_synthetic_survey(300, seed=10).to_excel(survey_path, index=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        store = load_coordinate_store(str(survey_path), inventory_path=None, cache_dir=str(tmp_path))
+    assert len(store) == 300
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the store was built again")
+
+    monkeypatch.setattr(coordinate_store, "write_coordinate_store", fail)
+    again = load_coordinate_store(str(survey_path), inventory_path=None, cache_dir=str(tmp_path))
+    assert again.path == store.path
+
+    # A new clean_df version builds a new store
+    monkeypatch.setattr(coordinate_store, "CLEAN_DF_VERSION", coordinate_store.CLEAN_DF_VERSION + 1)
+    with pytest.raises(AssertionError, match="built again"):
+        load_coordinate_store(str(survey_path), inventory_path=None, cache_dir=str(tmp_path))
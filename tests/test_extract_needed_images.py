@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+
+from extract_needed_images import (build_zip_index, extract_images_from_zip, extract_members, read_member,
+                                   read_member_with_fallback)
+from report_server import ZipImageStore
+
+CONTENT = {
+    "imgs/stored.jpg": (zipfile.ZIP_STORED, b"stored" * 100),
+    "imgs/deflated.jpg": (zipfile.ZIP_DEFLATED, b"deflated" * 100),
+    "imgs/bzip2.jpg": (zipfile.ZIP_BZIP2, b"bzip2" * 100),
+}
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    path = str(tmp_path / "images.zip")
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, (compression, data) in CONTENT.items():
+            zf.writestr(zipfile.ZipInfo(name), data, compress_type=compression)
+        zf.writestr(zipfile.ZipInfo("imgs/encrypted.jpg"), b"secret")
+        zf.writestr(zipfile.ZipInfo("imgs/corrupt.jpg"), b"corrupt")
+        infos = {info.filename: info for info in zf.infolist()}
+
+    with open(path, "r+b") as f:
+        archive = bytearray(f.read())
+        # Flag a member as encrypted in its local header and central directory entry (46 bytes
+        # before its name): zipfile then asks for a password (RuntimeError)
+        encrypted = infos["imgs/encrypted.jpg"]
+        archive[encrypted.header_offset + 6] |= 0x1
+        central_directory = archive.index(b"PK\x01\x02")
+        archive[archive.index(b"imgs/encrypted.jpg", central_directory) - 46 + 8] |= 0x1
+        # Corrupt the data of another one: its CRC no longer matches (BadZipFile)
+        corrupt = infos["imgs/corrupt.jpg"]
+        archive[corrupt.header_offset + 30 + len(corrupt.filename)] ^= 0xFF
+        f.seek(0)
+        f.write(archive)
+    return path
+
+
+def entry(index, name):
+    return index[os.path.basename(name)][0]
+
+
+def test_read_member_falls_back_to_zipfile(zip_path):
+    index = build_zip_index(zip_path, persist=False)
+    with open(zip_path, "rb") as zip_file:
+        with pytest.raises(NotImplementedError):
+            read_member(zip_file, entry(index, "imgs/bzip2.jpg"))
+        for name, (_, data) in CONTENT.items():
+            assert read_member_with_fallback(zip_file, zip_path, entry(index, name)) == data
+        with pytest.raises(RuntimeError):
+            read_member_with_fallback(zip_file, zip_path, entry(index, "imgs/encrypted.jpg"))
+        with pytest.raises(zipfile.BadZipFile):
+            read_member_with_fallback(zip_file, zip_path, entry(index, "imgs/corrupt.jpg"))
+
+
+def test_unreadable_members_are_skipped(zip_path, tmp_path, capsys):
+    index = build_zip_index(zip_path, persist=False)
+    entries = [entries[0] for entries in index.values()]
+    output_dir = tmp_path / "out"
+    assert extract_members(zip_path, entries, str(output_dir), workers=1) == (len(CONTENT), 2)
+    assert sorted(os.listdir(output_dir / "imgs")) == sorted(os.path.basename(name) for name in CONTENT)
+    out = capsys.readouterr().out
+    assert "Skipping imgs/encrypted.jpg" in out and "Skipping imgs/corrupt.jpg" in out
+
+
+def test_summary_counts_the_skipped_members(zip_path, tmp_path, capsys):
+    csv_path = tmp_path / "images.csv"
+    csv_path.write_text("filename\nstored.jpg\nencrypted.jpg\ncorrupt.jpg\n")
+    extract_images_from_zip(str(csv_path), zip_path, "filename", str(tmp_path / "out"), workers=1)
+    out = capsys.readouterr().out
+    assert "Extracted 1 files, 0 were already up to date" in out
+    assert "2 files were found but couldn't be read" in out
+    assert "All files were found and extracted" not in out
+
+    csv_path.write_text("filename\nstored.jpg\ndeflated.jpg\n")
+    extract_images_from_zip(str(csv_path), zip_path, "filename", str(tmp_path / "out"), workers=1)
+    out = capsys.readouterr().out
+    assert "Extracted 1 files, 1 were already up to date" in out
+    assert "All files were found and extracted" in out
+
+
+def test_zip_store_has_no_unreadable_members(zip_path):
+    store = ZipImageStore(zip_path)
+    assert store.get("bzip2.jpg")[0] == CONTENT["imgs/bzip2.jpg"][1]
+    assert store.get("encrypted.jpg") is None
+    assert store.get("corrupt.jpg") is None
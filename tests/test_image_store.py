@@ -0,0 +1,105 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from image_store import HttpFetcher, ImageCache, ImageKey, ImageNotFound, ImageStore, assemble_images, image_name
+
+KEY = ImageKey(32.07, 34.78, 240.0, 64.0)
+OTHER_KEY = ImageKey(32.08, 34.79, 180.0, 64.0)
+MISSING_KEY = ImageKey(32.09, 34.8, 240.0, 64.0)
+
+
+@pytest.fixture
+def server():
+    """
+    Stub Street View endpoint: serves b"<lat>,<lon>,<heading>" for every location but
+    MISSING_KEY's, failing the first failures[location] requests of a location with a 500.
+    """
+    requests = []
+    failures = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+            requests.append(query)
+            location = query["location"]
+            if location == f"{MISSING_KEY.lat},{MISSING_KEY.lon}":
+                self.send_error(404)
+                return
+            if failures.get(location, 0) > 0:
+                failures[location] -= 1
+                self.send_error(500)
+                return
+            body = f"{location},{query['heading']}".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.requests = requests
+    httpd.failures = failures
+    httpd.url_template = (f"http://127.0.0.1:{httpd.server_port}/streetview"
+                          "?location={lat},{lon}&heading={heading}&fov={fov}")
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_fetcher(server):
+    fetcher = HttpFetcher(server.url_template, timeout=5)
+    assert fetcher(KEY) == b"32.07,34.78,240.0"
+    with pytest.raises(ImageNotFound):
+        fetcher(MISSING_KEY)
+
+
+def test_store_retries_and_caches(server, tmp_path):
+    server.failures[f"{KEY.lat},{KEY.lon}"] = 2
+    with ImageStore(HttpFetcher(server.url_template, timeout=5), cache=ImageCache(str(tmp_path)), retries=2,
+                    backoff=0) as store:
+        paths = store.get_many([KEY, KEY, MISSING_KEY])
+        assert paths[MISSING_KEY] is None
+        with open(paths[KEY], "rb") as f:
+            assert f.read() == b"32.07,34.78,240.0"
+        assert len(server.requests) == 4
+
+    # A new store over the same cache folder fetches nothing
+    with ImageStore(HttpFetcher(server.url_template, timeout=5), cache=ImageCache(str(tmp_path))) as store:
+        assert store.get(KEY) == paths[KEY]
+    assert len(server.requests) == 4
+
+
+def test_store_gives_up_after_the_retries(server, tmp_path):
+    server.failures[f"{KEY.lat},{KEY.lon}"] = 5
+    with ImageStore(HttpFetcher(server.url_template, timeout=5), cache=ImageCache(str(tmp_path)), retries=1,
+                    backoff=0) as store:
+        assert store.get_many([KEY]) == {KEY: None}
+    assert len(server.requests) == 2
+
+
+def test_assembled_images_are_copies(server, tmp_path):
+    names = [image_name(KEY), "5_segmented_" + image_name(OTHER_KEY), image_name(MISSING_KEY), "not_a_frame.jpg"]
+    output_dir = tmp_path / "images"
+    with ImageStore(HttpFetcher(server.url_template, timeout=5), cache=ImageCache(str(tmp_path / "cache"))) as store:
+        missing = assemble_images(names, str(output_dir), store)
+        assert sorted(missing) == sorted([image_name(MISSING_KEY), "not_a_frame.jpg"])
+        assert sorted(os.listdir(output_dir)) == sorted(names[:2])
+
+        # Editing an assembled image leaves the cache as it was
+        with open(output_dir / image_name(KEY), "wb") as f:
+            f.write(b"edited")
+        with open(store.get(KEY), "rb") as f:
+            assert f.read() == b"32.07,34.78,240.0"
+
+        # Assembling again replaces the edited image
+        assemble_images(names, str(output_dir), store)
+        with open(output_dir / image_name(KEY), "rb") as f:
+            assert f.read() == b"32.07,34.78,240.0"
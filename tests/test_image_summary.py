@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from image_summary import summarize_images
+
+
+def survey(**extra):
+    return pd.DataFrame({
+        'file_name': ['a', 'a', 'b', 'c'],
+        'tree_id': [1.0, np.nan, 2.0, 3.0],
+        'best_angle_diff': [5.0, np.nan, 12.0, 3.0],
+        'possible_trees': [3, 2, 4, 1],
+        **extra,
+    })
+
+
+def test_second_best_needs_matched_details():
+    # More than one candidate is not a runner-up match
+    summary = summarize_images(survey())
+    assert not summary['second_best'].any()
+
+
+def test_second_best_from_matched_details():
+    details = [{'second_best_match_tree': 7}, None, {'second_best_match_tree': None}, {'second_best_match_tree': 8}]
+    summary = summarize_images(survey(matched_details=details))
+    assert summary['second_best'].tolist() == [True, False, True]
+
+
+def test_unmatched_runner_up_does_not_count():
+    details = [None, {'second_best_match_tree': 7}, None, None]
+    summary = summarize_images(survey(matched_details=details))
+    assert not summary['second_best'].any()
+
+
+def test_candidates_are_counted_once_per_image():
+    # possible_trees is the image's candidate count, repeated on every detection row
+    df = pd.DataFrame({
+        'file_name': ['a', 'a', 'a', 'b', 'c', 'c'],
+        'tree_id': [1.0, 2.0, np.nan, np.nan, 3.0, 4.0],
+        'best_angle_diff': [5.0, 7.0, np.nan, np.nan, 3.0, 4.0],
+        'possible_trees': [10, 10, 10, 0, 5, 5],
+    })
+    summary = summarize_images(df)
+    assert summary['n_candidates'].tolist() == [10, 0, 5]
+    assert summary['n_detections'].tolist() == [3, 1, 2]
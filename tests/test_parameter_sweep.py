@@ -0,0 +1,47 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from angle_matching import rematch_df
+from clean_data_before_json import clean_df
+from parameter_sweep import SUMMARY_QUANTILES, parameter_grid, run_sweep
+from synthetic_survey import make_synthetic_survey
+
+GRID = {'max_angle_diff': [10, 30, None], 'max_distance': [50, None], 'min_threshold': [None, 15],
+        'second_threshold': [5]}
+
+
+def rematch_summary(df, params):
+    """
+    evaluate_combination's summary, from a standalone rematch_df run.
+    """
+    rematched = rematch_df(df, **params)
+    matched = rematched[rematched['tree_id'].notna()]
+    diffs = matched['best_angle_diff'].to_numpy()
+    summary = dict(params)
+    summary['matched_detections'] = len(matched)
+    summary['matches_after_dedupe'] = len(matched.drop_duplicates(['file_name', 'tree_id']))
+    summary['distinct_trees'] = matched['tree_id'].nunique()
+    summary['with_second_best'] = sum(details['second_best_match_tree'] is not None
+                                      for details in rematched['matched_details'])
+    summary['angle_diff_mean'] = diffs.mean() if len(diffs) else np.nan
+    for q in SUMMARY_QUANTILES:
+        summary[f'angle_diff_p{int(q * 100)}'] = np.quantile(diffs, q) if len(diffs) else np.nan
+    return summary
+
+
+@pytest.fixture(scope="module")
+def cleaned():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return clean_df(make_synthetic_survey(1500, seed=15))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_sweep_points_equal_standalone_rematches(cleaned, workers):
+    sweep = run_sweep(cleaned, GRID, workers=workers)
+    expected = pd.DataFrame([rematch_summary(cleaned, params) for params in parameter_grid(GRID)])
+    assert len(sweep) == 12
+    pd.testing.assert_frame_equal(sweep, expected, check_dtype=False, check_exact=False, rtol=1e-12)
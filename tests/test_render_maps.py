@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+import warnings
+
+from clean_data_before_json import clean_df
+from main_3 import build_map_payload, partition_by_file_name, render_maps, rows_fingerprint
+from synthetic_survey import make_synthetic_survey
+
+
+def map_jobs(n_images, compact=False):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        df = clean_df(make_synthetic_survey(n_images * 6, seed=11), compact=compact)
+    return [(rows, "left") for rows in list(partition_by_file_name(df).values())[:n_images]]
+
+
+def test_abandoned_render_stops_the_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = map_jobs(60)
+    paths = render_maps(jobs, workers=2, progress_every=0)
+    next(paths)
+    # Closing the generator waits for the running maps and cancels the others
+    paths.close()
+    assert not multiprocessing.active_children()
+    assert len(os.listdir("maps")) < len(jobs)
+
+
+def test_all_maps_are_rendered(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = map_jobs(6)
+    paths = list(render_maps(jobs, workers=2, progress_every=0))
+    assert len(paths) == len(jobs) and all(os.path.exists(path) for path in paths)
+
+
+def test_compact_rows_have_the_same_fingerprints():
+    jobs = map_jobs(30)
+    compact_jobs = map_jobs(30, compact=True)
+    assert compact_jobs[0][0]['tree_index'].dtype != jobs[0][0]['tree_index'].dtype
+    for (rows, side), (compact_rows, _) in zip(jobs, compact_jobs):
+        # The maps are the same, so a --compact run keeps the maps of a plain one
+        assert build_map_payload(compact_rows) == build_map_payload(rows)
+        assert rows_fingerprint(compact_rows, side) == rows_fingerprint(rows, side)
+
+
+def test_fingerprints_only_follow_the_map_columns():
+    rows, side = map_jobs(1)[0]
+    fingerprint = rows_fingerprint(rows, side)
+    assert rows_fingerprint(rows.assign(x_box=rows['x_box'] + 1), side) == fingerprint
+    assert rows_fingerprint(rows.assign(real_angle=rows['real_angle'] + 1), side) != fingerprint
+    assert rows_fingerprint(rows, "right") != fingerprint
@@ -0,0 +1,53 @@
+import json
+import re
+
+import numpy as np
+import pytest
+
+import main_3
+from clean_data_before_json import clean_df
+from main_3 import build_map_payload, iter_report_cases, render_case_column
+from synthetic_survey import make_synthetic_survey
+
+
+def case_names(cases):
+    return [(file_name, list(tlv.index), None if small is None else list(small.index))
+            for file_name, tlv, small in cases]
+
+
+def test_given_summaries_select_the_same_cases(monkeypatch):
+    tlv, tlv_summary = clean_df(make_synthetic_survey(3000, seed=5), with_summary=True)
+    small, small_summary = clean_df(make_synthetic_survey(3000, seed=5, unmatched_fraction=0.6), with_summary=True)
+    expected = case_names(iter_report_cases(tlv, small, max_images=None))
+    assert 0 < len(expected) < tlv['file_name'].nunique()
+
+    # With the summaries given, no image is summarized again
+    def fail(df):
+        raise AssertionError("summarize_images called with a summary given")
+
+    monkeypatch.setattr(main_3, "summarize_images", fail)
+    cases = iter_report_cases(tlv, small, max_images=None, tlv_summary=tlv_summary, small_summary=small_summary)
+    assert case_names(cases) == expected
+
+
+def test_summary_of_other_images_counts_as_empty():
+    tlv, tlv_summary = clean_df(make_synthetic_survey(1000, seed=6), with_summary=True)
+    small, small_summary = clean_df(make_synthetic_survey(1000, seed=7), with_summary=True)
+    # The surveys share no image: only the tlv side keeps a case
+    cases = list(iter_report_cases(tlv, small, max_images=None, tlv_summary=tlv_summary, small_summary=small_summary))
+    assert cases and all(small_rows.empty for _, _, small_rows in cases)
+    assert case_names(cases) == case_names(iter_report_cases(tlv, small, max_images=None))
+
+
+def test_map_payload_is_strict_json():
+    df = clean_df(make_synthetic_survey(200, seed=8))
+    rows = df[df['file_name'] == df['file_name'].iloc[0]].copy()
+    rows['y_tree_image'] = np.nan
+    rows['x_tree'] = np.inf
+    rows['tree_id'] = rows['tree_id'].fillna(1.0)
+    html = render_case_column(rows, "imgs", "left", map_payload=build_map_payload(rows))
+
+    payload = json.loads(re.search(r"<script type='application/json'>(.*?)</script>", html).group(1),
+                         parse_constant=lambda name: pytest.fail(f"bare {name} in the payload"))
+    assert payload['center'][0] is None
+    assert all(marker[1] is None for marker in payload['markers'] if marker[2] == "best")
@@ -0,0 +1,55 @@
+import numpy as np
+
+from angle_matching import rematch_df
+from clean_data_before_json import clean_df, get_subset_df, select_images
+from synthetic_survey import make_synthetic_survey
+
+
+def original_interesting_images(df):
+    """
+    The matched images the original row-level select_images rule samples from.
+    """
+    matched = df[df["tree_id"].notna()]
+    high = matched["best_angle_diff"].quantile(0.9)
+    low = matched["best_angle_diff"].quantile(0.1)
+    interesting = matched[
+        matched["matched_details"].apply(lambda x: isinstance(x, dict) and x.get("second_best_match_tree") is not None)
+        | (matched["best_angle_diff"] > high) | (matched["best_angle_diff"] < low)]
+    return set(interesting["file_name"])
+
+
+def test_interesting_images_follow_the_row_level_rule():
+    df = clean_df(rematch_df(clean_df(make_synthetic_survey(5000, seed=3)), max_angle_diff=30))
+    expected = original_interesting_images(df)
+    assert 0 < len(expected) < df['file_name'].nunique()
+
+    # Sampling more images than there are takes them all
+    selected = select_images(df, n=0, n_matched=len(df))
+    assert set(selected['file_name']) == expected
+
+
+def test_selection_is_seeded():
+    df = clean_df(rematch_df(clean_df(make_synthetic_survey(2000, seed=4))))
+    first = select_images(df, n=20, n_matched=20, seed=7)
+    again = select_images(df, n=20, n_matched=20, seed=7)
+    assert np.array_equal(first.index, again.index)
+    assert first['file_name'].nunique() <= 40
+
+
+def test_rows_in_any_order():
+    df = clean_df(rematch_df(clean_df(make_synthetic_survey(2000, seed=5))))
+    # Every image's first rows, then every image's second rows...: images keep their order of first
+    # appearance, so grouping the rows back gives df
+    rank = df.groupby('file_name', sort=False).cumcount()
+    interleaved = df.iloc[np.argsort(rank.to_numpy(), kind='stable')]
+    assert not interleaved['file_name'].equals(df['file_name'])
+
+    selected = select_images(interleaved, n=20, n_matched=20, seed=7)
+    expected = select_images(df, n=20, n_matched=20, seed=7)
+    assert sorted(selected.index) == sorted(expected.index)
+    # Rows come back in the order they were given
+    assert selected.index.tolist() == [i for i in interleaved.index if i in set(expected.index)]
+
+    subset = get_subset_df(interleaved, n=15, seed=3)
+    assert sorted(subset.index) == sorted(get_subset_df(df, n=15, seed=3).index)
+    assert subset['file_name'].nunique() == 15
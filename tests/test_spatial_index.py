@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import spatial_index
+from spatial_index import TreeIndex
+
+
+@pytest.fixture
+def trees():
+    rng = np.random.default_rng(0)
+    return rng.uniform(34.75, 34.80, 2000), rng.uniform(32.05, 32.10, 2000)
+
+
+def brute_force_knn(x, y, qx, qy, k):
+    distances = np.hypot((x[None, :] - qx[:, None]) * 100000, (y[None, :] - qy[:, None]) * 100000)
+    return np.sort(distances, axis=1)[:, :k]
+
+
+def test_knn_matches_brute_force(trees):
+    x, y = trees
+    index = TreeIndex(x, y, cell_size=25.0)
+    rng = np.random.default_rng(1)
+    # Queries inside the inventory, at its edge and far away from it
+    qx = np.r_[rng.uniform(34.75, 34.80, 300), 34.70, 0.0]
+    qy = np.r_[rng.uniform(32.05, 32.10, 300), 32.0, 0.0]
+    tree_index, distance = index.query_knn(qx, qy, k=5)
+    np.testing.assert_allclose(distance, brute_force_knn(x, y, qx, qy, 5))
+    np.testing.assert_allclose(np.hypot(x[tree_index] - qx[:, None], y[tree_index] - qy[:, None]) * 100000, distance)
+
+
+def test_knn_non_finite_queries(trees):
+    index = TreeIndex(*trees)
+    tree_index, distance = index.query_knn([np.nan, 34.77, np.inf], [32.07, 32.07, 32.07], k=2)
+    assert (tree_index[[0, 2]] == -1).all() and np.isnan(distance[[0, 2]]).all()
+    assert (tree_index[1] >= 0).all() and np.isfinite(distance[1]).all()
+
+
+def test_knn_fewer_trees_than_k():
+    index = TreeIndex([34.77, 34.78], [32.07, 32.08])
+    tree_index, distance = index.query_knn([34.77], [32.07], k=3)
+    assert tree_index[0].tolist()[:2] == [0, 1] and tree_index[0, 2] == -1
+    assert distance[0, 0] == 0 and np.isinf(distance[0, 2])
+
+
+def test_brute_force_is_chunked(trees, monkeypatch):
+    # Far queries compare with every tree, a few queries at a time
+    monkeypatch.setattr(spatial_index, "MAX_BRUTE_FORCE_PAIRS", 5000)
+    x, y = trees
+    index = TreeIndex(x, y)
+    qx, qy = np.full(10, 10.0), np.linspace(0, 1, 10)
+    _, distance = index.query_knn(qx, qy, k=2)
+    np.testing.assert_allclose(distance, brute_force_knn(x, y, qx, qy, 2))
+    query_of, _, _ = index.query_radius(qx[:3], qy[:3], radius=1e9)
+    assert np.bincount(query_of).tolist() == [len(x)] * 3
@@ -0,0 +1,22 @@
+import warnings
+
+from main_3 import stream_report
+from profiling import RunLog, recording, stage
+from synthetic_survey import make_synthetic_survey
+
+
+def test_stream_report_stages(tmp_path, monkeypatch):
+    make_synthetic_survey(600, seed=12).to_csv(tmp_path / "survey.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+    run_log = RunLog()
+    with warnings.catch_warnings(), recording(run_log), stage("stream_report"):
+        warnings.simplefilter("ignore", FutureWarning)
+        stream_report("survey.csv", "imgs", chunk_rows=200, map_mode="shared", map_workers=1)
+
+    stages = set(run_log.stages)
+    # Reading (with its type coercions) and cleaning are recorded apart, each once
+    assert "stream_report/read_chunks" in stages
+    assert "stream_report/read_chunks/to_numeric" in stages
+    assert "stream_report/clean_df" in stages
+    assert not any("clean_df/clean_df" in key for key in stages)
+    assert run_log.stages["stream_report/read_chunks"]["rows"] == 600
@@ -0,0 +1,45 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from survey_cache import load_clean_survey, read_cached_frame, write_cached_frame
+from synthetic_survey import make_synthetic_survey
+
+
+@pytest.fixture(scope="module")
+def survey_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("survey") / "survey.xlsx"
+    make_synthetic_survey(500, seed=6).to_excel(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_cold_and_warm_loads_are_equal(survey_path, tmp_path, compact):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        cold, cold_summary = load_clean_survey(survey_path, compact=compact, with_summary=True, cache_dir=tmp_path)
+    warm, warm_summary = load_clean_survey(survey_path, compact=compact, with_summary=True, cache_dir=tmp_path)
+    # pandas only warns on NaN vs None for now
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        pd.testing.assert_frame_equal(cold, warm)
+        pd.testing.assert_frame_equal(cold_summary, warm_summary)
+    pd.testing.assert_series_equal(cold.dtypes, warm.dtypes)
+    for column in cold.columns[cold.dtypes == object]:
+        assert [type(value) for value in cold[column]] == [type(value) for value in warm[column]], column
+
+
+def test_nested_matches_round_trip_exactly(tmp_path):
+    matches = [
+        [{'id': 7, 'location_x': 34.78, 'tree_name': 'אשל'}, {'id': 8, 'location_x': 34.79}],
+        None,
+        [],
+        [{'id': 9.5, 'Name_Heb': None, 'extra': [1, 2]}],
+    ]
+    df = pd.DataFrame({'file_name': ['a', 'a', 'b', 'c'], 'additional_matches': matches})
+    path = str(tmp_path / "matches.parquet")
+    write_cached_frame(df, path)
+    read = read_cached_frame(path)
+    # repr tells 7 from 7.0 and a missing key from a None one, which == doesn't
+    assert [repr(value) for value in read['additional_matches']] == [repr(value) for value in matches]
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from survey_comparison import align_surveys, common_images, disagreeing_images, partial_images
+
+
+def survey(rows):
+    return pd.DataFrame(rows, columns=['file_name', 'tree_index', 'tree_id'])
+
+
+def test_align_surveys_outer_joins_detections():
+    a = survey([('x', 1, 10.0), ('x', 2, np.nan), ('y', 1, 30.0)])
+    b = survey([('x', 2, 20.0), ('x', 3, 5.0), ('y', 1, 30.0)])
+    aligned = align_surveys({'a': a, 'b': b})
+    assert aligned.index.tolist() == [('x', 1), ('x', 2), ('y', 1), ('x', 3)]
+    np.testing.assert_array_equal(aligned['a'], [10.0, np.nan, 30.0, np.nan])
+    np.testing.assert_array_equal(aligned['b'], [np.nan, 20.0, 30.0, 5.0])
+    assert list(disagreeing_images(aligned)) == ['x']
+
+
+def test_duplicated_detections_raise():
+    a = survey([('x', 1, 10.0), ('x', 1, 11.0), ('y', 1, 30.0)])
+    b = survey([('x', 1, 10.0), ('y', 1, 30.0)])
+    with pytest.raises(ValueError, match=r"a has 2 rows sharing .*\(x, 1\)"):
+        align_surveys({'a': a, 'b': b})
+
+
+def test_detections_without_tree_index_are_left_out(capsys):
+    a = survey([('x', 1, 10.0), ('x', pd.NA, 11.0), ('y', 2, 30.0)])
+    a['tree_index'] = a['tree_index'].astype('Int64')
+    b = survey([('x', 1, 10.0), ('y', 2, 30.0)])
+    aligned = align_surveys({'a': a, 'b': b})
+    assert aligned.index.tolist() == [('x', 1), ('y', 2)]
+    assert "a: 1 detections without a file_name or tree_index" in capsys.readouterr().out
+
+
+def test_partial_images_are_reported_not_compared():
+    a = survey([('x', 1, 10.0), ('y', 1, 30.0), ('z', 1, 1.0)])
+    b = survey([('x', 1, 10.0), ('w', 1, 2.0)])
+    c = survey([('x', 1, 12.0), ('y', 1, 30.0)])
+    surveys = {'a': a, 'b': b, 'c': c}
+    assert common_images(surveys).tolist() == ['x']
+    partial = partial_images(surveys)
+    assert partial.index.tolist() == ['y', 'z', 'w']
+    assert partial.to_dict('index') == {'y': {'a': True, 'b': False, 'c': True},
+                                        'z': {'a': True, 'b': False, 'c': False},
+                                        'w': {'a': False, 'b': True, 'c': False}}
+    assert align_surveys(surveys).index.tolist() == [('x', 1)]
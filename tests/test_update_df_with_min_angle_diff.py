@@ -0,0 +1,136 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from clean_data_before_json import update_df_with_min_angle_diff
+from synthetic_survey import make_synthetic_survey
+
+SMALL_SURVEY_STRING_COLUMNS = ['tree_name', 'tree_name_code', 'tree_name_big_csv']
+
+
+def reference_update_df_with_min_angle_diff(df, min_threshold=20, second_threshold=30, is_small_survey=False,
+                                            use_thresholds=False):
+    """
+    The original per-group loop, with its commented-out threshold branch as use_thresholds.
+    """
+    updated_df = df.copy()
+    grouped = updated_df.groupby(['file_name', 'tree_id'])
+    for (file_name, tree_id), group in grouped:
+        sorted_group = group.sort_values(by='best_angle_diff')
+        if len(sorted_group) > 1:
+            min_angle_diff = sorted_group.iloc[0]['best_angle_diff']
+            second_min_angle_diff = sorted_group.iloc[1]['best_angle_diff']
+        else:
+            min_angle_diff = sorted_group.iloc[0]['best_angle_diff']
+            second_min_angle_diff = float('inf')
+        if not use_thresholds or (min_angle_diff < min_threshold and second_min_angle_diff > second_threshold):
+            min_distance_idx = sorted_group.index[0]
+        else:
+            min_distance_idx = None
+        numeric_cols = ['tree_id', 'x_tree', 'y_tree', 'best_angle_diff']
+        if is_small_survey:
+            string_cols = SMALL_SURVEY_STRING_COLUMNS
+        else:
+            string_cols = ['tree_name', 'name_eng', 'name_heb', 'type_1', 'type_2', 'type_3']
+        for idx in group.index:
+            if idx != min_distance_idx:
+                updated_df.loc[idx, numeric_cols] = np.nan
+                updated_df.loc[idx, string_cols] = "None"
+    return updated_df
+
+
+def shared_tree_survey(n_rows=3000, seed=1, decimals=None):
+    """
+    Synthetic survey where most matched detections of an image share one tree, so groups have
+    runners-up. With decimals, best_angle_diff is rounded to create ties.
+    """
+    df = make_synthetic_survey(n_rows, seed=seed)
+    rng = np.random.default_rng(seed)
+    first_tree = df.groupby('file_name')['tree_id'].transform('first')
+    shared = df['tree_id'].notna() & (rng.random(len(df)) < 0.6)
+    df.loc[shared, 'tree_id'] = first_tree[shared]
+    if decimals is not None:
+        df['best_angle_diff'] = df['best_angle_diff'].round(decimals)
+    return df
+
+
+def small_survey(df):
+    df = df.drop(columns=['name_eng', 'name_heb', 'type_1', 'type_2', 'type_3'])
+    df['tree_name_code'] = df['tree_name'].where(df['tree_name'].isna(), "code")
+    df['tree_name_big_csv'] = df['tree_name']
+    return df
+
+
+def run_both(df, **params):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return reference_update_df_with_min_angle_diff(df, **params), update_df_with_min_angle_diff(df, **params)
+
+
+def differing_rows(expected, actual):
+    same = (expected == actual) | (expected.isna() & actual.isna())
+    return ~same.all(axis=1)
+
+
+@pytest.mark.parametrize("use_thresholds", [False, True])
+@pytest.mark.parametrize("is_small_survey", [False, True])
+def test_matches_original_loop(use_thresholds, is_small_survey):
+    df = shared_tree_survey()
+    if is_small_survey:
+        df = small_survey(df)
+    expected, actual = run_both(df, use_thresholds=use_thresholds, is_small_survey=is_small_survey)
+    assert not differing_rows(expected, actual).any()
+    # Every (file_name, tree_id) group keeps at most one detection
+    assert not actual.dropna(subset=['tree_id']).duplicated(['file_name', 'tree_id']).any()
+
+
+@pytest.mark.parametrize("use_thresholds", [False, True])
+def test_missing_runner_up(use_thresholds):
+    # Single-detection groups: the runner-up counts as infinitely far
+    df = pd.DataFrame({
+        'file_name': ['a', 'a', 'b', 'b'],
+        'tree_id': [1.0, 2.0, 1.0, np.nan],
+        'x_tree': [34.1, 34.2, 34.1, np.nan],
+        'y_tree': [32.1, 32.2, 32.1, np.nan],
+        'best_angle_diff': [5.0, 25.0, np.nan, np.nan],
+        'tree_name': ['x', 'y', 'x', np.nan],
+        'name_eng': [1, 2, 1, np.nan], 'name_heb': [1, 2, 1, np.nan],
+        'type_1': ['t', 't', 't', np.nan], 'type_2': ['t', 't', 't', np.nan], 'type_3': ['t', 't', 't', np.nan],
+    })
+    expected, actual = run_both(df, use_thresholds=use_thresholds)
+    assert not differing_rows(expected, actual).any()
+    kept = actual['tree_id'].notna().tolist()
+    assert kept == ([True, False, False, False] if use_thresholds else [True, True, True, False])
+
+
+def test_tied_best_angle_diff():
+    """
+    The one allowed difference: among detections tied on the group's smallest best_angle_diff,
+    the original loop kept whichever its (unstable) quicksort put first, the vectorized version
+    keeps the first in row order. Everything else matches.
+    """
+    df = shared_tree_survey(decimals=0)
+    expected, actual = run_both(df)
+
+    groups = df.dropna(subset=['tree_id']).groupby(['file_name', 'tree_id'])['best_angle_diff']
+    is_min = df['best_angle_diff'] == groups.transform('min').reindex(df.index)
+    tied_min = is_min & (is_min.groupby([df['file_name'], df['tree_id']]).transform('sum').reindex(df.index) > 1)
+    assert tied_min.any()
+
+    differing = differing_rows(expected, actual)
+    assert not (differing & ~tied_min).any()
+    # Both keep exactly one of the tied detections, with the same values
+    for kept in (expected, actual):
+        assert kept.loc[tied_min, 'tree_id'].notna().groupby(
+            [df['file_name'], df['tree_id']]).sum().eq(1).all()
+    first_tied = tied_min & ~df[tied_min].duplicated(['file_name', 'tree_id']).reindex(df.index, fill_value=True)
+    assert actual.loc[tied_min, 'tree_id'].notna().equals(first_tied[tied_min])
+
+
+def test_tied_thresholds_blank_the_group():
+    # A tie fails second_threshold, so both versions blank the whole group
+    df = shared_tree_survey(decimals=0)
+    expected, actual = run_both(df, use_thresholds=True)
+    assert not differing_rows(expected, actual).any()
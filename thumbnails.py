@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# Bump when the resizing/encoding below changes, so older variants are not reused
+THUMBNAIL_VERSION = 1
+
+THUMBNAIL_DIR = "thumbnails"
+
+# Widths of the generated variants, the report columns are half the page wide
+THUMBNAIL_WIDTHS = (480, 960)
+
+# Source path -> file size, mtime, content hash and dimensions, so unchanged images aren't read again
+thumbnails_manifest_name = "manifest.json"
+
+_FORMATS = {"webp": ("WEBP", {"quality": 75, "method": 4}),
+            "jpeg": ("JPEG", {"quality": 80, "optimize": True, "progressive": True})}
+
+
+def _hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest(thumbnail_dir):
+    path = os.path.join(thumbnail_dir, thumbnails_manifest_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, thumbnail_dir):
+    path = os.path.join(thumbnail_dir, thumbnails_manifest_name)
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def source_info(path, manifest):
+    """
+    Content hash and (width, height) of a source image, reusing the manifest's entry while the
+    file's size and mtime are unchanged.
+    """
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    saved = manifest.get(path)
+    if saved is None or saved["stamp"] != stamp:
+        with Image.open(path) as image:  # only reads the header
+            size = list(image.size)
+        saved = manifest[path] = {"stamp": stamp, "hash": _hash_file(path), "size": size}
+    return saved["hash"], tuple(saved["size"])
+
+
+def variant_path(digest, width, thumbnail_dir=THUMBNAIL_DIR, image_format="webp"):
+    return os.path.join(thumbnail_dir, digest[:2], f"{digest}_v{THUMBNAIL_VERSION}_{width}.{image_format}")
+
+
+def variant_widths(widths, source_width):
+    """
+    Requested widths capped at the source's, images are never upscaled.
+    """
+    return sorted({min(width, source_width) for width in widths})
+
+
+def _make_variants(job):
+    """
+    Write the missing (path, width) variants of one source image.
+    """
+    source, variants, image_format = job
+    pil_format, save_options = _FORMATS[image_format]
+    with Image.open(source) as image:
+        rgb = image.convert("RGB")
+    source_width, source_height = rgb.size
+    for path, width in variants:
+        if os.path.exists(path):
+            continue
+        height = max(1, round(source_height * width / source_width))
+        resized = rgb if width == source_width else rgb.resize((width, height), Image.Resampling.LANCZOS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        resized.save(tmp_path, format=pil_format, **save_options)
+        os.replace(tmp_path, path)
+
+
+def build_thumbnails(source_paths, widths=THUMBNAIL_WIDTHS, thumbnail_dir=THUMBNAIL_DIR, image_format="webp",
+                     workers=None):
+    """
+    Generate downscaled variants of report images in worker processes, cached by source content.
+
+    Args:
+        source_paths (iterable): Image paths on disk, missing ones are skipped.
+        widths (tuple): Variant widths in pixels.
+        thumbnail_dir (str): Output folder, variants are named by the source's sha256 and width.
+        image_format (str): "webp" or "jpeg".
+        workers (int | None): Worker processes, None for one per CPU and 1 to run in-process.
+
+    Returns:
+        dict: source path -> list of (variant path, width), narrowest first. Widths above the
+        source's are replaced by the source's own width.
+    """
+    if image_format not in _FORMATS:
+        raise ValueError(f"Unknown image_format: {image_format}")
+
+    manifest = _load_manifest(thumbnail_dir)
+    thumbnails = {}
+    for path in dict.fromkeys(source_paths):
+        if not os.path.exists(path):
+            continue
+        digest, (source_width, _) = source_info(path, manifest)
+        thumbnails[path] = [(variant_path(digest, width, thumbnail_dir, image_format), width)
+                            for width in variant_widths(widths, source_width)]
+    _save_manifest(manifest, thumbnail_dir)
+
+    # Only sources with a variant missing on disk go to the workers
+    jobs = [(path, variants, image_format) for path, variants in thumbnails.items()
+            if not all(os.path.exists(variant) for variant, _ in variants)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            _make_variants(job)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            list(executor.map(_make_variants, jobs, chunksize=8))
+    print(f"Thumbnails: {len(jobs)} images resized, {len(thumbnails) - len(jobs)} cached")
+
+    return thumbnails